@@ -0,0 +1,392 @@
+#!/usr/bin/python3
+#  -*- coding: utf-8 -*-
+
+# Define imports
+import argparse
+import importlib.util
+from datetime import datetime
+import json
+import os
+import platform
+import py_compile
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import bloodcheck_core as BloodCheck
+
+# Third-party modules that commands not running any query must not import
+heavyModules = ("neo4j", "pandas", "numpy", "pyarrow", "xlsxwriter", "yaml", "tabulate", "psutil")
+
+def generate_graph(users=1000, computers=500, groups=100, nestingDepth=3, adminDensity=0.005, sessionDensity=0.005, domain="BENCH.LOCAL", seed=0):
+    # Build a BloodHound shaped graph: nodes are (label, properties), edges are (source, type, target) node indexes
+    rng = random.Random(seed)
+    domainSid = "S-1-5-21-%s-%s-%s" % (rng.randint(10**8, 10**9), rng.randint(10**8, 10**9), rng.randint(10**8, 10**9))
+    now = int(time.time())
+    operatingSystems = ["Windows 10 Enterprise", "Windows Server 2016 Standard", "Windows Server 2019 Standard", "Windows 7 Professional", "Windows Server 2008 R2 Standard"]
+    descriptions = [None, None, None, "Service account", "Admin workstation", "Temporary password Welcome1", "\\\\FILESRV\\share"]
+    nodes = []
+    edges = []
+
+    nodes.append(("Domain", {'name': domain, 'objectid': domainSid, 'domain': domain}))
+    domainIndex = 0
+
+    groupIndexes = []
+    wellKnownGroups = [("DOMAIN ADMINS", 512), ("DOMAIN CONTROLLERS", 516), ("ENTERPRISE ADMINS", 519), ("DOMAIN USERS", 513)]
+    for i in range(max(groups, len(wellKnownGroups))):
+        if i < len(wellKnownGroups):
+            groupName, rid = wellKnownGroups[i]
+        else:
+            groupName, rid = "GROUP%05d" % i, 10000 + i
+        groupIndexes.append(len(nodes))
+        nodes.append(("Group", {'name': "%s@%s" % (groupName, domain), 'objectid': "%s-%s" % (domainSid, rid), 'domain': domain, 'highvalue': rid in (512, 516, 519)}))
+
+    # Nest groups in layers so that the MemberOf chains are at most nestingDepth long
+    customGroups = groupIndexes[len(wellKnownGroups):]
+    layers = [customGroups[layer::max(1, nestingDepth)] for layer in range(max(1, nestingDepth))]
+    for layer in range(1, len(layers)):
+        for groupIndex in layers[layer]:
+            if layers[layer - 1]:
+                edges.append((groupIndex, "MemberOf", rng.choice(layers[layer - 1])))
+
+    userIndexes = []
+    for i in range(users):
+        userIndexes.append(len(nodes))
+        nodes.append(("User", {
+            'name': "USER%06d@%s" % (i, domain),
+            'displayname': "User %06d" % i,
+            'objectid': "%s-%s" % (domainSid, 20000 + i),
+            'domain': domain,
+            'enabled': rng.random() > 0.1,
+            'hasspn': rng.random() < 0.02,
+            'dontreqpreauth': rng.random() < 0.01,
+            'passwordnotreqd': rng.random() < 0.01,
+            'sensitive': False,
+            'description': rng.choice(descriptions),
+            'pwdlastset': now - rng.randint(0, 5 * 365 * 86400),
+            'lastlogon': now - rng.randint(0, 365 * 86400),
+            'owned': rng.random() < 0.005
+        }))
+        edges.append((userIndexes[-1], "MemberOf", groupIndexes[3]))
+        if customGroups:
+            edges.append((userIndexes[-1], "MemberOf", rng.choice(customGroups)))
+    for userIndex in rng.sample(userIndexes, min(len(userIndexes), max(1, users // 500))):
+        edges.append((userIndex, "MemberOf", groupIndexes[0]))
+
+    computerIndexes = []
+    for i in range(computers):
+        computerIndexes.append(len(nodes))
+        nodes.append(("Computer", {
+            'name': "COMP%06d.%s" % (i, domain),
+            'objectid': "%s-%s" % (domainSid, 40000 + i),
+            'domain': domain,
+            'enabled': rng.random() > 0.05,
+            'operatingsystem': rng.choice(operatingSystems),
+            'haslaps': rng.random() > 0.3,
+            'unconstraineddelegation': rng.random() < 0.01,
+            'description': rng.choice(descriptions),
+            'pwdlastset': now - rng.randint(0, 365 * 86400),
+            'lastlogon': now - rng.randint(0, 90 * 86400)
+        }))
+    for computerIndex in computerIndexes[:max(1, computers // 200)]:
+        edges.append((computerIndex, "MemberOf", groupIndexes[1]))
+        nodes[computerIndex][1]['unconstraineddelegation'] = True
+
+    # AdminTo from groups and users, HasSession from computers to users
+    adminSources = customGroups + userIndexes
+    for computerIndex in computerIndexes:
+        edges.append((groupIndexes[0], "AdminTo", computerIndex))
+        for sourceIndex in rng.sample(adminSources, min(len(adminSources), int(len(adminSources) * adminDensity))):
+            edges.append((sourceIndex, "AdminTo", computerIndex))
+        for userIndex in rng.sample(userIndexes, min(len(userIndexes), int(len(userIndexes) * sessionDensity))):
+            edges.append((computerIndex, "HasSession", userIndex))
+    for groupIndex in customGroups:
+        if rng.random() < 0.05 and userIndexes:
+            edges.append((groupIndex, "ForceChangePassword", rng.choice(userIndexes)))
+        if rng.random() < 0.05 and computerIndexes:
+            edges.append((groupIndex, "CanRDP", rng.choice(computerIndexes)))
+    for nodeIndex in groupIndexes + userIndexes + computerIndexes:
+        edges.append((domainIndex, "Contains", nodeIndex))
+    return {'nodes': nodes, 'edges': edges}
+
+def get_graph_stats(graph):
+    labelCounts = {}
+    for label, properties in graph['nodes']:
+        labelCounts[label] = labelCounts.get(label, 0) + 1
+    edgeCounts = {}
+    for sourceIndex, edgeType, targetIndex in graph['edges']:
+        edgeCounts[edgeType] = edgeCounts.get(edgeType, 0) + 1
+    return {'nodes': labelCounts, 'edges': edgeCounts}
+
+def export_graph(graph, exportFile):
+    with open(exportFile, 'w', encoding="utf-8") as fo:
+        json.dump({
+            'nodes': [{'label': label, 'properties': properties} for label, properties in graph['nodes']],
+            'edges': [{'source': sourceIndex, 'type': edgeType, 'target': targetIndex} for sourceIndex, edgeType, targetIndex in graph['edges']]
+        }, fo)
+    print("[+] Synthetic graph exported to [%s]" % exportFile, file=sys.stderr)
+
+
+class MemorySession:
+    # Stand-in for a Neo4j session: answers each template with records taken from the synthetic graph
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        pass
+
+    def run(self, CypherQuery, **parameters):
+        labelMatch = re.search(r"\(\s*\w*\s*:\s*(\w+)", CypherQuery)
+        label = labelMatch.group(1) if labelMatch else "User"
+        headers = [header.strip("` ") for header in re.findall(r"\bAS\s+(`[^`]+`|\w+)", CypherQuery, re.IGNORECASE)]
+        if headers == ['partition']:
+            # Partitioned templates get a single slice covering the whole graph
+            return iter([{'partition': None}])
+        return (self.get_record(properties, headers) for nodeLabel, properties in self.graph['nodes'] if nodeLabel == label)
+
+    def get_record(self, properties, headers):
+        record = {}
+        for header in headers:
+            key = re.sub(r"[^a-z]", "", header.lower())
+            record[header] = properties.get(key, properties.get('name'))
+        return record
+
+
+class MemoryDriver:
+    def __init__(self, graph):
+        self.graph = graph
+
+    def session(self):
+        return MemorySession(self.graph)
+
+    def close(self):
+        pass
+
+
+def load_graph_into_neo4j(driver, graph, batchSize=5000):
+    # Labels can't be parameters, so nodes and edges are grouped by label and type
+    print("[+] Loading synthetic graph into Neo4j...", file=sys.stderr)
+    with driver.session() as session:
+        session.run("MATCH (n) DETACH DELETE n").consume()
+        nodesByLabel = {}
+        for nodeIndex, (label, properties) in enumerate(graph['nodes']):
+            nodesByLabel.setdefault(label, []).append(dict(properties, benchid=nodeIndex))
+        for label, nodes in nodesByLabel.items():
+            for i in range(0, len(nodes), batchSize):
+                session.run("UNWIND $nodes AS node CREATE (n:%s:Base) SET n = node" % label, nodes=nodes[i:i + batchSize]).consume()
+        session.run("CREATE INDEX ON :Base(benchid)").consume()
+        edgesByType = {}
+        for sourceIndex, edgeType, targetIndex in graph['edges']:
+            edgesByType.setdefault(edgeType, []).append({'source': sourceIndex, 'target': targetIndex})
+        for edgeType, edges in edgesByType.items():
+            for i in range(0, len(edges), batchSize):
+                session.run("UNWIND $edges AS edge MATCH (a:Base {benchid: edge.source}), (b:Base {benchid: edge.target}) CREATE (a)-[:%s]->(b)" % edgeType, edges=edges[i:i + batchSize]).consume()
+
+def get_backend(backendName, graph, config=None, loadGraph=False):
+    if backendName == "memory":
+        return MemoryDriver(graph)
+    if backendName == "local":
+        BloodCheck.localGraph = BloodCheck.build_local_graph([([label], properties) for label, properties in graph['nodes']], graph['edges'])
+        return MemoryDriver(graph)
+    driver = BloodCheck.connect_to_server(config)
+    if loadGraph:
+        load_graph_into_neo4j(driver, graph)
+    return driver
+
+def get_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode("utf-8").strip()
+    except Exception:
+        return None
+
+def run_benchmark(driver, templateDirectory, outputDirectory):
+    # Time each stage of the pipeline separately: loading, execution, parsing, saving and report
+    BloodCheck.logger.disabled = True
+    BloodCheck.saveResults = True
+    BloodCheck.resultCache = None
+    BloodCheck.columnarFormat = None
+    BloodCheck.sessionTimestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    stages = {}
+
+    startTime = time.perf_counter()
+    cypherQueries = BloodCheck.load_yaml_folder(templateDirectory, recursive=True) or []
+    stages['load_templates'] = time.perf_counter() - startTime
+
+    queryTimings = []
+    parsedResults = []
+    for queryIndex, cypherYaml in enumerate(cypherQueries):
+        headers = cypherYaml['Headers']
+        description = cypherYaml['Description']
+        startTime = time.perf_counter()
+        if BloodCheck.localGraph is not None:
+            records = BloodCheck.run_local_query(BloodCheck.localGraph, cypherYaml) or []
+        else:
+            with driver.session() as session:
+                records = list(BloodCheck.run_cypher_query(session, cypherYaml['Query']) or [])
+        executionTime = time.perf_counter() - startTime
+        startTime = time.perf_counter()
+        BloodCheck.parse_result(iter(records), headers, description)
+        parseTime = time.perf_counter() - startTime
+        outputFileName = BloodCheck.get_output_file_name(outputDirectory, cypherYaml, queryIndex)
+        startTime = time.perf_counter()
+        parsedResult = BloodCheck.parse_result(iter(records), headers, description, outputFileName, BloodCheck.reportRowThreshold)
+        saveTime = time.perf_counter() - startTime - parseTime
+        if parsedResult and parsedResult['count']:
+            parsedResult['description'] = description.strip()
+            parsedResult['headers'] = headers
+            parsedResults.append(parsedResult)
+        queryTimings.append({
+            'description': description.strip(),
+            'rows': len(records),
+            'execution': executionTime,
+            'parse_result': parseTime,
+            'save_result': max(0.0, saveTime)
+        })
+    for stage in ('execution', 'parse_result', 'save_result'):
+        stages[stage] = sum(queryTiming[stage] for queryTiming in queryTimings)
+
+    startTime = time.perf_counter()
+    if parsedResults:
+        BloodCheck.build_report(outputDirectory, parsedResults)
+    stages['build_report'] = time.perf_counter() - startTime
+    return stages, queryTimings
+
+def run_command(command, cwd=None, env=None):
+    startTime = time.perf_counter()
+    result = subprocess.run(command, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    return time.perf_counter() - startTime, result.stderr
+
+def run_startup_benchmark(repeat):
+    # Startup of CLI commands not running any query, net of the Python interpreter startup
+    scriptPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "BloodCheck.py")
+    # Commands are timed as installed, with the bytecode of the module cached (even with PYTHONDONTWRITEBYTECODE set)
+    py_compile.compile(BloodCheck.__file__, cfile=importlib.util.cache_from_source(BloodCheck.__file__))
+    with tempfile.TemporaryDirectory() as installDirectory:
+        # Minimal local Neo4j installation, enough to list its databases
+        os.makedirs(os.path.join(installDirectory, "conf"))
+        os.makedirs(os.path.join(installDirectory, "data", "databases", "bench.db"))
+        with open(os.path.join(installDirectory, "conf", "neo4j.conf"), 'w', encoding="utf-8") as fo:
+            fo.write("dbms.active_database=bench.db\n")
+        with open(os.path.join(installDirectory, "benchconfig.py"), 'w', encoding="utf-8") as fo:
+            fo.write("neo4jInstanceType = \"local\"\nneo4jURI = \"bolt://localhost:7687\"\nneo4jConfPath = %r\nneo4jDataPath = %r\nneo4jUser = \"neo4j\"\nneo4jPass = \"neo4j\"\n" % (os.path.join(installDirectory, "conf"), os.path.join(installDirectory, "data")))
+        env = dict(os.environ, PYTHONPATH=installDirectory)
+        commands = {
+            'interpreter': [sys.executable, "-c", "pass"],
+            'help': [sys.executable, scriptPath, "-h"],
+            'list': [sys.executable, scriptPath, "-c", "benchconfig.py", "-dL"]
+        }
+        timings = {}
+        for name, command in commands.items():
+            timings[name] = sorted(run_command(command, installDirectory, env)[0] for _ in range(repeat))[repeat // 2]
+        startup = {}
+        for name in ('help', 'list'):
+            _, importTimes = run_command(commands[name][:1] + ["-X", "importtime"] + commands[name][1:], installDirectory, env)
+            importedModules = set(line.split("|")[-1].strip().split(".")[0] for line in importTimes.splitlines() if line.startswith("import time:"))
+            startup[name] = {
+                'time': timings[name] - timings['interpreter'],
+                'heavyModules': sorted(importedModules & set(heavyModules))
+            }
+    return timings['interpreter'], startup
+
+def main():
+    parser = argparse.ArgumentParser(description="BloodCheck offline benchmark")
+    parser.add_argument("-b", "--backend", help="query backend (default: memory)", choices=["memory", "local", "neo4j"], default="memory")
+    parser.add_argument("-c", "--config", help="Neo4j configuration module for the neo4j backend (default: config)", dest="configFile", default="config")
+    parser.add_argument("-l", "--load", help="load the synthetic graph into Neo4j before running (wipes the active database!)", action="store_true")
+    parser.add_argument("-t", "--templates", help="templates directory (default: templates)", dest="templateDirectory", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates"))
+    parser.add_argument("-o", "--output", help="benchmark results JSON file (default: stdout)", dest="outputFile")
+    parser.add_argument("-e", "--export", help="export the synthetic graph as JSON", dest="exportFile")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--computers", type=int, default=500)
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--nesting-depth", dest="nestingDepth", type=int, default=3)
+    parser.add_argument("--admin-density", dest="adminDensity", help="ratio of users/groups admin to each computer", type=float, default=0.005)
+    parser.add_argument("--session-density", dest="sessionDensity", help="ratio of users with a session on each computer", type=float, default=0.005)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-s", "--startup", help="only time the startup of commands not running any query, and check it against the budget", action="store_true")
+    parser.add_argument("--startup-budget", dest="startupBudget", help="maximum startup time in milliseconds, net of the interpreter startup (default: 100)", type=float, default=100)
+    parser.add_argument("--repeat", help="number of runs of each command, the median is reported (default: 10)", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.startup:
+        interpreterTime, startup = run_startup_benchmark(max(1, args.repeat))
+        startupResults = {
+            'timestamp': datetime.now().isoformat(),
+            'commit': get_commit(),
+            'python': platform.python_version(),
+            'interpreter': interpreterTime,
+            'budget': args.startupBudget / 1000,
+            'commands': startup
+        }
+        write_results(startupResults, args.outputFile)
+        overBudget = [name for name, commandStartup in startup.items() if commandStartup['time'] * 1000 > args.startupBudget or commandStartup['heavyModules']]
+        for name in overBudget:
+            print("[!] Command [%s] started in %.0f ms (budget: %.0f ms), heavy modules imported: %s" % (name, startup[name]['time'] * 1000, args.startupBudget, ", ".join(startup[name]['heavyModules']) or "none"), file=sys.stderr)
+        sys.exit(1 if overBudget else 0)
+
+    parameters = {
+        'users': args.users,
+        'computers': args.computers,
+        'groups': args.groups,
+        'nestingDepth': args.nestingDepth,
+        'adminDensity': args.adminDensity,
+        'sessionDensity': args.sessionDensity,
+        'seed': args.seed
+    }
+    print("[+] Generating synthetic graph...", file=sys.stderr)
+    startTime = time.perf_counter()
+    graph = generate_graph(**parameters)
+    generationTime = time.perf_counter() - startTime
+    if args.exportFile:
+        export_graph(graph, args.exportFile)
+
+    config = None
+    if args.backend == "neo4j":
+        config = BloodCheck.importlib.import_module(os.path.splitext(args.configFile)[0])
+    driver = get_backend(args.backend, graph, config, args.load)
+
+    with tempfile.TemporaryDirectory() as outputDirectory:
+        # Console output of the pipeline is not part of the benchmark results
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            stages, queryTimings = run_benchmark(driver, args.templateDirectory, outputDirectory)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+    driver.close()
+
+    benchmarkResults = {
+        'timestamp': datetime.now().isoformat(),
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'backend': args.backend,
+        'parameters': parameters,
+        'graph': get_graph_stats(graph),
+        'generation': generationTime,
+        'stages': stages,
+        'total': sum(stages.values()),
+        'queries': queryTimings
+    }
+    write_results(benchmarkResults, args.outputFile)
+
+def write_results(benchmarkResults, outputFile):
+    if outputFile:
+        with open(outputFile, 'w', encoding="utf-8") as fo:
+            json.dump(benchmarkResults, fo, indent=2)
+        print("[+] Benchmark results saved to [%s]" % outputFile)
+    else:
+        json.dump(benchmarkResults, sys.stdout, indent=2)
+        print()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,3567 @@
+#  -*- coding: utf-8 -*-
+
+# Define imports
+import argparse
+import collections
+import contextlib
+import csv
+from datetime import datetime, timedelta
+import hashlib
+import importlib
+import importlib.util
+import io
+import itertools
+import json
+import logging
+import math
+import os
+import platform
+import queue
+import random
+import re
+import shutil
+import string
+import sys
+import tempfile
+import threading
+import time
+import types
+from urllib.parse import urlparse
+
+class LazyModule:
+    # Third-party modules are only imported on first use, so that each command only pays for the modules it needs
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+def lazy_import(name, optional=False):
+    # Optional modules are None when they are not installed, as checked by the commands requiring them
+    if optional and importlib.util.find_spec(name) is None:
+        return None
+    return LazyModule(name)
+
+# Standard modules only used by some commands are also imported on first use
+ctypes = lazy_import("ctypes")
+futures = lazy_import("concurrent.futures")
+httpServer = lazy_import("http.server")
+pickle = lazy_import("pickle")
+socket = lazy_import("socket")
+subprocess = lazy_import("subprocess")
+zipfile = lazy_import("zipfile")
+
+neo4j = lazy_import("neo4j")
+psutil = lazy_import("psutil")
+tabulate = lazy_import("tabulate")
+xlsxwriter = lazy_import("xlsxwriter")
+yaml = lazy_import("yaml")
+
+pa = lazy_import("pyarrow", optional=True)
+pq = lazy_import("pyarrow.parquet") if pa else None
+
+np = lazy_import("numpy", optional=True)
+
+# Check OS
+global runningOS
+runningOS = platform.system()
+
+if runningOS == 'Windows':
+    win32con = lazy_import("win32con")
+    win32event = lazy_import("win32event")
+    shell = lazy_import("win32com.shell.shell")
+else:
+    import grp
+    import pwd
+
+# Define logging
+global logger
+logger = logging.getLogger()
+logging.basicConfig(
+    stream=sys.stdout,
+    level=logging.INFO, 
+    format='[+] %(levelname)s - %(message)s (%(filename)s:%(lineno)d)',
+)
+
+# Define result streaming
+global previewSize
+previewSize = 10
+global resultBatchSize
+resultBatchSize = 5000
+global reportRowThreshold
+reportRowThreshold = 20000
+# Bumped whenever the layout of the CSV result files changes, so that cached results are not reused
+global resultFileVersion
+resultFileVersion = 2
+
+# Define execution pipeline (batches or results queued between two stages before the producer waits)
+global pipelineDepth
+pipelineDepth = 4
+
+# Define columnar output format (parquet or arrow, disabled by default)
+global columnarFormat
+columnarFormat = None
+
+# Define result diff (rows are partitioned by hash in chunks of that size)
+global diffChunkSize
+diffChunkSize = 64 * 1024 * 1024
+
+# Define template indexes management (disabled by default, 'plan' only shows the missing indexes)
+global indexMode
+indexMode = None
+
+# Define owned principals (labels of the nodes that can be marked as owned)
+global ownedLabels
+ownedLabels = ['User', 'Computer', 'Group', 'OU', 'GPO', 'Domain']
+
+# Define SharpHound collections ingestion (node label of each collection type)
+global ingestTypes
+ingestTypes = {'users': 'User', 'computers': 'Computer', 'groups': 'Group', 'domains': 'Domain', 'gpos': 'GPO', 'ous': 'OU', 'containers': 'Container'}
+global ingestLabels
+ingestLabels = dict((label.lower(), label) for label in ingestTypes.values())
+# Rights named after their extended right or written property in BloodHound 3 collections
+global ingestAceTypes
+ingestAceTypes = {'All': 'AllExtendedRights', 'User-Force-Change-Password': 'ForceChangePassword', 'DS-Replication-Get-Changes': 'GetChanges', 'DS-Replication-Get-Changes-All': 'GetChangesAll', 'Member': 'AddMember', 'AllowedToAct': 'AddAllowedToAct'}
+
+# Define admin closure precomputation (disabled by default)
+global precomputeClosure
+precomputeClosure = False
+
+# Define estimate mode (templates providing an Estimate section are evaluated on random node samples)
+global estimateMode
+estimateMode = False
+global sampleSize
+sampleSize = 1000
+global estimateConfidence
+estimateConfidence = 95
+# Normal quantiles of the supported confidence levels
+global estimateZScores
+estimateZScores = {90: 1.645, 95: 1.960, 99: 2.576}
+global estimateHeaders
+estimateHeaders = ['Statistic', 'Estimate', 'Lower bound', 'Upper bound', 'Sample size', 'Population']
+
+# Define local graph engine (templates run against Neo4j by default)
+global localGraph
+localGraph = None
+
+# Define daemon mode (drivers, template catalogs and local graphs are kept in memory between commands)
+global daemonState
+daemonState = None
+
+# Define template catalog (defaults to the _cache directory)
+global catalogDirectory
+catalogDirectory = None
+# Number of new or modified templates from which they are parsed by a pool of processes
+global catalogParallelThreshold
+catalogParallelThreshold = 200
+global yamlLoader
+yamlLoader = None
+
+# Define query profiling (disabled unless requested)
+global profileQueries
+profileQueries = False
+global profileDbHits
+profileDbHits = False
+global queryProfiles
+queryProfiles = []
+
+# Define run metrics (live progress view and Prometheus text metrics, disabled unless requested)
+global runMetrics
+runMetrics = None
+global progressInterval
+progressInterval = 1
+# Metrics of the query run by each worker thread, updated while its rows are streamed
+global queryMetricsContext
+queryMetricsContext = threading.local()
+
+# Define result cache (disabled unless requested)
+global resultCache
+resultCache = None
+# Temporary files older than that (in seconds) were left by an interrupted run and are removed by the eviction
+global cacheTempMaxAge
+cacheTempMaxAge = 3600
+
+# Define query execution policy (seconds per query and for the whole run, no limit by default)
+global queryTimeout
+queryTimeout = None
+global runDeadline
+runDeadline = None
+global queryRetries
+queryRetries = 2
+global retryDelay
+retryDelay = 1.0
+global failedQueries
+failedQueries = []
+
+class QueryTimeout(Exception):
+    pass
+
+
+def show_banner():
+    print(
+            "                                                           \n" +
+            "      |________|___________________|_                      \n" +
+            "      |        |B|L|O|O|D|C|H|E|C|K| |________________     \n" +
+            "      |________|___________________|_|                ,    \n" +
+            "      |        |                   |                  ,    \n"
+    )
+
+def is_valid_file(parser, arg):
+    if not os.path.exists(arg):
+        logger.error("The file '%s' does not exist!" % arg)
+    else:
+        openedFile = open(arg, 'r')
+        # Files given to a daemon command are closed once the command completed
+        if daemonState is not None:
+            daemonState['openedFiles'].append(openedFile)
+        return openedFile
+
+def is_valid_directory(parser, arg):
+    if not os.path.isdir(arg):
+        logger.error("The directory '%s' does not exist!" % arg)
+    else:
+        return arg
+
+def connect_to_server(config):
+    # The daemon reuses the driver, and its connection pool, of previous commands
+    driverKey = (config.neo4jURI, config.neo4jUser, config.neo4jPass)
+    if daemonState is not None and driverKey in daemonState['drivers']:
+        print("[+] Connection to database [OK]")
+        return daemonState['drivers'][driverKey]
+    try:
+        print("[+] Connecting to database...")
+        driver = neo4j.GraphDatabase.driver(config.neo4jURI, auth=(config.neo4jUser, config.neo4jPass))
+        print("[+] Connection to database [OK]")
+        if daemonState is not None:
+            daemonState['drivers'][driverKey] = driver
+        return driver
+    except Exception as ex:
+        print("[!] Connection to database [KO]")
+        print("[+] Please check your configuration")
+        logger.error("%s" % str(ex))
+        sys.exit(1)
+
+def run_cypher_query(session, CypherQuery, queryDeadline=None):
+    try:
+        logger.info("Getting result for query '%s'" % CypherQuery.strip())
+        results = session.run(get_timed_query(CypherQuery, queryDeadline))
+        return results
+    except Exception as ex:
+        if is_timeout_error(ex) or is_retryable_error(ex):
+            raise
+        print("[!] Error running cypher query [%s]" % CypherQuery.strip())
+        logger.warning("%s" % str(ex))
+        return False
+
+def get_timed_query(CypherQuery, queryDeadline=None):
+    # The transaction timeout is enforced by the server, which also stops queries still computing their first record
+    if queryDeadline is None or not hasattr(neo4j, 'Query'):
+        return CypherQuery
+    return neo4j.Query(CypherQuery, timeout=max(queryDeadline - time.perf_counter(), 0.001))
+
+def is_timeout_error(ex):
+    # Neo4j reports transactions stopped by their timeout as timed out or terminated, depending on the version
+    if isinstance(ex, QueryTimeout):
+        return True
+    errorCode = str(getattr(ex, 'code', None) or "")
+    return "TransactionTimedOut" in errorCode or ("Terminated" in errorCode and "timeout" in str(ex).lower())
+
+def is_retryable_error(ex):
+    # Transient server errors and lost connections, a query that timed out would only time out again
+    if is_timeout_error(ex) or not type(ex).__module__.startswith("neo4j"):
+        return False
+    if hasattr(ex, 'is_retryable'):
+        return ex.is_retryable()
+    return isinstance(ex, (neo4j.exceptions.TransientError, neo4j.exceptions.ServiceUnavailable, neo4j.exceptions.SessionExpired))
+
+def get_query_deadline(cypherYaml, startTime):
+    # The template timeout takes precedence over the global one, both are capped by the remaining run time
+    timeout = cypherYaml.get('Timeout', queryTimeout)
+    deadlines = [deadline for deadline in (startTime + timeout if timeout else None, runDeadline) if deadline is not None]
+    return min(deadlines) if deadlines else None
+
+def fetch_result(driver, cypherYaml, outputFileName=None, columnarFileName=None, cacheIdentity=None, queryDeadline=None):
+    # Each call gets its own session so that several workers can share the driver pool
+    try:
+        if resultCache:
+            cacheKey = get_cache_key(cypherYaml, cacheIdentity or resultCache['identity'])
+            parsedResult = load_cached_result(resultCache['directory'], cacheKey, outputFileName, columnarFileName)
+            if parsedResult:
+                logger.info("Using cached result for query [%s]" % cypherYaml['Description'].strip())
+                return parsedResult
+        if localGraph is not None:
+            return parse_result(run_local_query(localGraph, cypherYaml), cypherYaml['Headers'], cypherYaml['Description'], outputFileName, reportRowThreshold if outputFileName else 0, columnarFileName, queryDeadline)
+        isEstimate = estimateMode and bool(cypherYaml.get('Estimate'))
+        # Partitioned templates run their slice query, the template query stays a standalone query
+        CypherQuery = cypherYaml['Partition']['SliceQuery'] if cypherYaml.get('Partition') else cypherYaml['Query']
+        CypherQuery = "PROFILE " + CypherQuery.strip() if profileDbHits else CypherQuery
+        partitionStats = {'dbHits': []}
+        with driver.session() as session:
+            if isEstimate:
+                results = run_estimate_query(session, cypherYaml, queryDeadline)
+            elif cypherYaml.get('Partition'):
+                results = run_partitioned_query(driver, cypherYaml, CypherQuery, partitionStats, queryDeadline)
+            else:
+                results = run_cypher_query(session, CypherQuery, queryDeadline)
+            if resultCache and results is not False:
+                resultFileName = outputFileName or os.path.join(resultCache['directory'], cacheKey + ".csv.tmp")
+                try:
+                    parsedResult = parse_result(results, cypherYaml['Headers'], cypherYaml['Description'], resultFileName, reportRowThreshold if outputFileName else 0, columnarFileName, queryDeadline)
+                    if parsedResult:
+                        store_cached_result(resultCache['directory'], cacheKey, cypherYaml, parsedResult, cacheIdentity or resultCache['identity'])
+                        if not outputFileName:
+                            parsedResult['outputFileName'] = None
+                finally:
+                    # The temporary file is removed whether the query completed, failed or timed out
+                    if not outputFileName and os.path.isfile(resultFileName):
+                        os.remove(resultFileName)
+            else:
+                parsedResult = parse_result(results, cypherYaml['Headers'], cypherYaml['Description'], outputFileName, reportRowThreshold if outputFileName else 0, columnarFileName, queryDeadline)
+            if profileDbHits and parsedResult and not isEstimate:
+                if cypherYaml.get('Partition'):
+                    parsedResult['dbHits'] = None if None in partitionStats['dbHits'] else sum(partitionStats['dbHits'])
+                else:
+                    parsedResult['dbHits'] = get_db_hits(results)
+            return parsedResult
+    except Exception as ex:
+        if is_timeout_error(ex) or is_retryable_error(ex):
+            raise
+        print("[!] Error fetching results for cypher query [%s]" % cypherYaml['Query'].strip())
+        logger.warning("%s" % str(ex))
+        return False
+
+def get_partitions(driver, cypherYaml, queryDeadline=None):
+    with driver.session() as session:
+        results = run_cypher_query(session, cypherYaml['Partition']['Query'], queryDeadline)
+        if results is False:
+            return False
+        return [list(record.values())[0] for record in results]
+
+def run_partition(driver, CypherQuery, partition, partitionStats, queryDeadline=None):
+    try:
+        with driver.session() as session:
+            results = session.run(get_timed_query(CypherQuery, queryDeadline), partition=partition)
+            for record in results:
+                yield record
+            if profileDbHits:
+                partitionStats['dbHits'].append(get_db_hits(results))
+    except Exception as ex:
+        print("[!] Error running cypher query [%s] for partition [%s]" % (CypherQuery.strip(), partition))
+        logger.warning("%s" % str(ex))
+        raise
+
+def run_partitioned_query(driver, cypherYaml, CypherQuery, partitionStats, queryDeadline=None):
+    # Each partition is a separate transaction, keeping the server memory bounded by the size of a slice
+    partitions = get_partitions(driver, cypherYaml, queryDeadline)
+    if partitions is False:
+        return False
+    logger.info("Running query [%s] over %s partitions" % (cypherYaml['Description'].strip(), len(partitions)))
+    partitionWorkers = min(max(1, cypherYaml['Partition'].get('Workers', 1)), max(1, len(partitions)))
+    records = get_partition_records(driver, CypherQuery, partitions, partitionStats, partitionWorkers, queryDeadline)
+    if cypherYaml['Partition'].get('OrderBy') or cypherYaml['Partition'].get('Limit'):
+        # Slices are sorted and limited on their own, the merged result has to be sorted and limited again
+        return sort_records(records, cypherYaml['Partition'])
+    return records
+
+def get_partition_records(driver, CypherQuery, partitions, partitionStats, partitionWorkers=1, queryDeadline=None):
+    # Slices are streamed in order. With several workers, only partitionWorkers slices are run ahead of the consumer,
+    # so that at most that many slices are held in memory.
+    if partitionWorkers == 1:
+        for partition in partitions:
+            yield from run_partition(driver, CypherQuery, partition, partitionStats, queryDeadline)
+        return
+    with futures.ThreadPoolExecutor(max_workers=partitionWorkers) as executor:
+        for partitionRecords in map_results(executor, lambda partition: list(run_partition(driver, CypherQuery, partition, partitionStats, queryDeadline)), ((partition,) for partition in partitions), partitionWorkers):
+            yield from partitionRecords
+
+def sort_records(records, orderSpec):
+    # Used to merge partitioned results and by the local engine: sort on one header, then limit
+    records = [dict(record.items()) for record in records]
+    orderBy = orderSpec.get('OrderBy')
+    if orderBy:
+        # Null values come last in ascending orders and first in descending orders, as in Neo4j
+        descending = orderSpec.get('Descending', False)
+        sortedRecords = sorted((record for record in records if record.get(orderBy) is not None), key=lambda record: record[orderBy], reverse=descending)
+        nullRecords = [record for record in records if record.get(orderBy) is None]
+        records = nullRecords + sortedRecords if descending else sortedRecords + nullRecords
+    if orderSpec.get('Limit'):
+        records = records[:orderSpec['Limit']]
+    return records
+
+def profile_result(driver, cypherYaml, outputFileName=None, columnarFileName=None, cacheIdentity=None, queryMetrics=None):
+    startTime = time.perf_counter()
+    if queryMetrics is not None:
+        queryMetrics['startTime'] = startTime
+        queryMetrics['state'] = 'running'
+    queryMetricsContext.queryMetrics = queryMetrics
+    try:
+        parsedResult, status, attempts, error = fetch_result_with_retries(driver, cypherYaml, outputFileName, columnarFileName, cacheIdentity, startTime)
+    finally:
+        queryMetricsContext.queryMetrics = None
+    endTime = time.perf_counter()
+    queryProfile = {
+        'description': cypherYaml['Description'].strip(),
+        'hash': cypherYaml.get('Hash'),
+        'status': status,
+        'cached': bool(parsedResult and parsedResult.get('cached')),
+        'wallTime': endTime - startTime,
+        'firstRecordTime': None,
+        'rows': 0,
+        'bytesWritten': 0,
+        'dbHits': None,
+        'attempts': attempts,
+        'error': error
+    }
+    if parsedResult is False:
+        # Partial results of a failed query are not kept
+        remove_result_files(outputFileName, columnarFileName)
+    if parsedResult:
+        if parsedResult.get('firstRecordTime'):
+            queryProfile['firstRecordTime'] = parsedResult['firstRecordTime'] - startTime
+        queryProfile['rows'] = parsedResult['count']
+        queryProfile['dbHits'] = parsedResult.get('dbHits')
+        queryProfile['bytesWritten'] = get_written_bytes(parsedResult.get('outputFileName'), parsedResult.get('columnarFileName'))
+    if queryMetrics is not None:
+        queryMetrics['rows'] = queryProfile['rows']
+        queryMetrics['bytesWritten'] = queryProfile['bytesWritten']
+        queryMetrics['endTime'] = endTime
+        queryMetrics['state'] = "cached" if queryProfile['cached'] else ("done" if status == 'ok' else status)
+    return parsedResult, queryProfile
+
+def fetch_result_with_retries(driver, cypherYaml, outputFileName=None, columnarFileName=None, cacheIdentity=None, startTime=None):
+    # Transient errors are retried with an exponential backoff, as long as the query and the run have time left.
+    # Returns the result, its status (ok, error, timeout or skipped), the number of attempts and the last error.
+    cypherDescription = cypherYaml['Description'].strip()
+    startTime = startTime or time.perf_counter()
+    if runDeadline is not None and startTime >= runDeadline:
+        logger.info("Skipping query [%s], the run timeout is reached" % cypherDescription)
+        return False, 'skipped', 0, "run timeout reached"
+    queryDeadline = get_query_deadline(cypherYaml, startTime)
+    retries = cypherYaml.get('Retries', queryRetries)
+    for attempt in range(retries + 1):
+        try:
+            parsedResult = fetch_result(driver, cypherYaml, outputFileName, columnarFileName, cacheIdentity, queryDeadline)
+            return parsedResult, 'ok' if parsedResult is not False else 'error', attempt + 1, None
+        except Exception as ex:
+            if is_timeout_error(ex):
+                print("[!] Query [%s] timed out after %.1f seconds" % (cypherDescription, time.perf_counter() - startTime))
+                logger.warning("%s" % str(ex))
+                return False, 'timeout', attempt + 1, str(ex)
+            retryTime = min(retryDelay * 2 ** attempt, 30) * random.uniform(1, 1.5)
+            if attempt == retries or (queryDeadline is not None and time.perf_counter() + retryTime >= queryDeadline):
+                print("[!] Error fetching results for cypher query [%s]" % cypherDescription)
+                logger.warning("%s" % str(ex))
+                return False, 'error', attempt + 1, str(ex)
+            print("[!] Transient error running query [%s], retrying in %.1f seconds (%s/%s)" % (cypherDescription, retryTime, attempt + 1, retries))
+            logger.warning("%s" % str(ex))
+            # The next attempt starts over, it would not overwrite the rows written so far if it returns none
+            remove_result_files(outputFileName, columnarFileName)
+            time.sleep(retryTime)
+
+def remove_result_files(*resultFileNames):
+    for resultFileName in resultFileNames:
+        if resultFileName and os.path.isfile(resultFileName):
+            os.remove(resultFileName)
+
+def show_failed_queries(failedQueries):
+    tabFailed = [[queryProfile['description'], queryProfile['status'], queryProfile['attempts'], queryProfile['wallTime'], (queryProfile['error'] or "").strip().split("\n")[0][:80]] for queryProfile in failedQueries]
+    print("[!] %s {queries} did not complete:\n".format(queries="queries" if len(failedQueries) > 1 else "query") % len(failedQueries))
+    print(tabulate.tabulate(tabFailed, headers=['Query', 'Status', 'Attempts', 'Time (s)', 'Error'], tablefmt='github', floatfmt='.1f') + '\n')
+
+def get_written_bytes(*resultFileNames):
+    return sum(os.path.getsize(resultFileName) for resultFileName in resultFileNames if resultFileName and os.path.isfile(resultFileName))
+
+def get_db_hits(results):
+    # The profiled plan is a dict with recent drivers and an object with older ones
+    try:
+        summary = results.consume() if hasattr(results, 'consume') else results.summary()
+        plans = [summary.profile]
+        dbHits = 0
+        while plans:
+            plan = plans.pop()
+            if plan is None:
+                continue
+            if isinstance(plan, dict):
+                dbHits += plan.get('dbHits', 0)
+                plans.extend(plan.get('children', []))
+            else:
+                dbHits += plan.db_hits
+                plans.extend(plan.children)
+        return dbHits
+    except Exception as ex:
+        logger.warning("Unable to get profiled db hits: %s" % str(ex))
+        return None
+
+def show_profile_report(outputDirectory, queryProfiles):
+    # Slowest queries first
+    rankedProfiles = sorted(queryProfiles, key=lambda queryProfile: queryProfile['wallTime'], reverse=True)
+    tabProfiles = []
+    for rank, queryProfile in enumerate(rankedProfiles, 1):
+        tabProfiles.append([
+            rank,
+            queryProfile['description'],
+            queryProfile['wallTime'],
+            queryProfile['firstRecordTime'],
+            queryProfile['rows'],
+            queryProfile['bytesWritten'],
+            queryProfile['dbHits'] if queryProfile['dbHits'] is not None else "",
+            "cached" if queryProfile['cached'] else queryProfile['status']
+        ])
+    print("[+] Query profile:\n")
+    print(tabulate.tabulate(tabProfiles, headers=['Rank', 'Query', 'Wall time (s)', 'First record (s)', 'Rows', 'Bytes written', 'DB hits', 'Status'], tablefmt='github', floatfmt='.3f', missingval='') + '\n')
+    outputFileName = os.path.join(outputDirectory, "BloodCheck-Profile-" + sessionTimestamp + ".json")
+    try:
+        with open(outputFileName, "w", encoding="utf-8") as outputFile:
+            json.dump({'timestamp': sessionTimestamp, 'totalTime': sum(queryProfile['wallTime'] for queryProfile in queryProfiles), 'queries': rankedProfiles}, outputFile, indent=2)
+        print("[!] Query profile saved to [%s]" % (outputFileName))
+    except Exception as ex:
+        print("[!] Error while saving query profile")
+        logger.error("%s" % str(ex))
+
+def start_run_metrics(showProgress=False, metricsFile=None, metricsPort=None):
+    # Metrics are refreshed by a background thread every progressInterval seconds
+    runMetrics = {
+        'lock': threading.Lock(),
+        'outputLock': threading.Lock(),
+        'stopEvent': threading.Event(),
+        'startTime': time.perf_counter(),
+        'queries': [],
+        'rowRate': 0.0,
+        'lastRows': 0,
+        'lastTime': time.perf_counter(),
+        'progressStream': sys.stdout if showProgress else None,
+        'progressShown': False,
+        'lastProgressTime': 0,
+        'metricsFile': metricsFile,
+        'server': None
+    }
+    if metricsPort:
+        try:
+            runMetrics['server'] = start_metrics_server(runMetrics, metricsPort)
+            print("[+] Serving metrics on [http://127.0.0.1:%s/metrics]" % (metricsPort))
+        except Exception as ex:
+            print("[!] Error while starting the metrics endpoint")
+            logger.error("%s" % str(ex))
+    runMetrics['thread'] = threading.Thread(target=run_metrics_loop, args=(runMetrics,), daemon=True)
+    runMetrics['thread'].start()
+    return runMetrics
+
+def start_metrics_server(runMetrics, metricsPort):
+    # Only bound to the loopback interface, since the metrics expose the template descriptions
+    class MetricsHandler(httpServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = get_prometheus_metrics(runMetrics).encode("utf-8")
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = httpServer.ThreadingHTTPServer(('127.0.0.1', metricsPort), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def stop_run_metrics(runMetrics):
+    runMetrics['stopEvent'].set()
+    runMetrics['thread'].join()
+    update_run_metrics(runMetrics, final=True)
+    if runMetrics['server']:
+        runMetrics['server'].shutdown()
+        runMetrics['server'].server_close()
+    if runMetrics['metricsFile']:
+        print("[!] Run metrics saved to [%s]" % (runMetrics['metricsFile']))
+
+def register_query_metrics(description):
+    if runMetrics is None:
+        return None
+    with runMetrics['lock']:
+        queryMetrics = {'index': len(runMetrics['queries']), 'description': description.strip(), 'state': 'queued', 'rows': 0, 'bytesWritten': 0, 'startTime': None, 'endTime': None}
+        runMetrics['queries'].append(queryMetrics)
+    return queryMetrics
+
+def run_metrics_loop(runMetrics):
+    while not runMetrics['stopEvent'].wait(progressInterval):
+        update_run_metrics(runMetrics)
+
+def update_run_metrics(runMetrics, final=False):
+    summary = get_metrics_summary(runMetrics)
+    if final:
+        runMetrics['rowRate'] = summary['rows'] / summary['elapsed'] if summary['elapsed'] > 0 else 0.0
+    else:
+        runMetrics['rowRate'] = (summary['rows'] - runMetrics['lastRows']) / max(summary['now'] - runMetrics['lastTime'], 1e-6)
+        runMetrics['lastRows'] = summary['rows']
+        runMetrics['lastTime'] = summary['now']
+    if runMetrics['progressStream']:
+        show_progress(runMetrics, summary, final)
+    if runMetrics['metricsFile']:
+        write_metrics_file(runMetrics, get_prometheus_metrics(runMetrics, summary))
+
+def get_metrics_summary(runMetrics):
+    now = time.perf_counter()
+    with runMetrics['lock']:
+        queries = list(runMetrics['queries'])
+    states = collections.Counter(queryMetrics['state'] for queryMetrics in queries)
+    finished = states['done'] + states['cached'] + states['error'] + states['timeout'] + states['skipped']
+    elapsed = now - runMetrics['startTime']
+    return {
+        'now': now,
+        'elapsed': elapsed,
+        'queries': queries,
+        'states': states,
+        'finished': finished,
+        'rows': sum(queryMetrics['rows'] for queryMetrics in queries),
+        'bytesWritten': sum(queryMetrics['bytesWritten'] for queryMetrics in queries),
+        # Queries still to run are expected to take as long as the finished ones did on average
+        'remainingTime': elapsed / finished * (len(queries) - finished) if finished else None
+    }
+
+def get_size_text(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return "%.1f %s" % (size, unit) if unit != 'B' else "%d B" % (size)
+        size /= 1024
+
+def get_duration_text(seconds):
+    return str(timedelta(seconds=int(seconds))) if seconds is not None else "--:--:--"
+
+def get_progress_line(runMetrics, summary, final=False):
+    states = summary['states']
+    progressLine = "[+] Queries %s/%s (%s running" % (summary['finished'], len(summary['queries']), states['running'])
+    if states['error']:
+        progressLine += ", %s failed" % (states['error'])
+    if states['timeout']:
+        progressLine += ", %s timed out" % (states['timeout'])
+    if states['skipped']:
+        progressLine += ", %s skipped" % (states['skipped'])
+    if states['cached']:
+        progressLine += ", %s cached" % (states['cached'])
+    progressLine += ") | %s rows (%s rows/s) | %s written | %s elapsed" % ("{:,}".format(summary['rows']), "{:,.0f}".format(runMetrics['rowRate']), get_size_text(summary['bytesWritten']), get_duration_text(summary['elapsed']))
+    if final:
+        return progressLine
+    progressLine += ", %s remaining" % (get_duration_text(summary['remainingTime']))
+    runningQueries = [queryMetrics for queryMetrics in summary['queries'] if queryMetrics['state'] == 'running']
+    if runningQueries:
+        # The longest running query is the one most likely to stall the run
+        queryMetrics = min(runningQueries, key=lambda queryMetrics: queryMetrics['startTime'])
+        progressLine += " | [%s] %s rows in %s" % (queryMetrics['description'], "{:,}".format(queryMetrics['rows']), get_duration_text(summary['now'] - queryMetrics['startTime']))
+    return progressLine
+
+def show_progress(runMetrics, summary, final=False):
+    # Drawn in place on a terminal, otherwise (e.g. through the daemon) printed as a new line every 15 seconds
+    progressStream = runMetrics['progressStream']
+    progressLine = get_progress_line(runMetrics, summary, final)
+    try:
+        with runMetrics['outputLock']:
+            if progressStream.isatty():
+                progressStream.write("\r\033[K" + progressLine[:shutil.get_terminal_size().columns - 1] + ("\n" if final else ""))
+                runMetrics['progressShown'] = not final
+            elif final or summary['now'] - runMetrics['lastProgressTime'] >= 15:
+                progressStream.write(progressLine + "\n")
+                runMetrics['lastProgressTime'] = summary['now']
+            progressStream.flush()
+    except (OSError, ValueError) as ex:
+        logger.warning("Unable to show progress: %s" % str(ex))
+        runMetrics['progressStream'] = None
+
+@contextlib.contextmanager
+def pause_progress():
+    # The progress line is cleared while results are printed, and drawn again on the next refresh
+    if runMetrics is None or runMetrics['progressStream'] is None:
+        yield
+        return
+    with runMetrics['outputLock']:
+        if runMetrics['progressShown']:
+            runMetrics['progressStream'].write("\r\033[K")
+            runMetrics['progressShown'] = False
+        yield
+
+def get_metric_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def get_prometheus_metrics(runMetrics, summary=None):
+    # Prometheus text exposition format, as served by the endpoint and read by the node exporter textfile collector
+    if summary is None:
+        summary = get_metrics_summary(runMetrics)
+    metricLines = [
+        "# HELP bloodcheck_queries Number of queries in each state",
+        "# TYPE bloodcheck_queries gauge"
+    ]
+    for state in ('queued', 'running', 'done', 'cached', 'error', 'timeout', 'skipped'):
+        metricLines.append('bloodcheck_queries{state="%s"} %s' % (state, summary['states'][state]))
+    metricLines.extend([
+        "# HELP bloodcheck_rows_total Rows read from the query results",
+        "# TYPE bloodcheck_rows_total counter",
+        "bloodcheck_rows_total %s" % (summary['rows']),
+        "# HELP bloodcheck_written_bytes_total Bytes written to the result files",
+        "# TYPE bloodcheck_written_bytes_total counter",
+        "bloodcheck_written_bytes_total %s" % (summary['bytesWritten']),
+        "# HELP bloodcheck_rows_per_second Rows read per second over the last refresh interval",
+        "# TYPE bloodcheck_rows_per_second gauge",
+        "bloodcheck_rows_per_second %.3f" % (runMetrics['rowRate']),
+        "# HELP bloodcheck_run_duration_seconds Time since the queries started",
+        "# TYPE bloodcheck_run_duration_seconds gauge",
+        "bloodcheck_run_duration_seconds %.3f" % (summary['elapsed']),
+        "# HELP bloodcheck_remaining_seconds Estimated time until all the queries are finished",
+        "# TYPE bloodcheck_remaining_seconds gauge",
+        "bloodcheck_remaining_seconds %s" % ("%.3f" % summary['remainingTime'] if summary['remainingTime'] is not None else "NaN")
+    ])
+    queryMetricLines = {'state': [], 'rows': [], 'bytes': [], 'duration': []}
+    for queryMetrics in summary['queries']:
+        queryLabels = 'index="%s",query="%s"' % (queryMetrics['index'], get_metric_label(queryMetrics['description']))
+        if queryMetrics['startTime'] is None:
+            duration = 0.0
+        else:
+            duration = (queryMetrics['endTime'] or summary['now']) - queryMetrics['startTime']
+        queryMetricLines['state'].append('bloodcheck_query_state{%s,state="%s"} 1' % (queryLabels, queryMetrics['state']))
+        queryMetricLines['rows'].append('bloodcheck_query_rows{%s} %s' % (queryLabels, queryMetrics['rows']))
+        queryMetricLines['bytes'].append('bloodcheck_query_written_bytes{%s} %s' % (queryLabels, queryMetrics['bytesWritten']))
+        queryMetricLines['duration'].append('bloodcheck_query_duration_seconds{%s} %.3f' % (queryLabels, duration))
+    metricLines.extend(["# HELP bloodcheck_query_state Current state of each query", "# TYPE bloodcheck_query_state gauge"] + queryMetricLines['state'])
+    metricLines.extend(["# HELP bloodcheck_query_rows Rows read from each query result", "# TYPE bloodcheck_query_rows gauge"] + queryMetricLines['rows'])
+    metricLines.extend(["# HELP bloodcheck_query_written_bytes Bytes written to the result files of each query", "# TYPE bloodcheck_query_written_bytes gauge"] + queryMetricLines['bytes'])
+    metricLines.extend(["# HELP bloodcheck_query_duration_seconds Time spent running each query", "# TYPE bloodcheck_query_duration_seconds gauge"] + queryMetricLines['duration'])
+    return "\n".join(metricLines) + "\n"
+
+def write_metrics_file(runMetrics, metricsText):
+    # Replaced atomically, so that a collector never reads a partial file
+    metricsFile = runMetrics['metricsFile']
+    try:
+        tempFileName = metricsFile + ".tmp"
+        with open(tempFileName, "w", encoding="utf-8") as tempFile:
+            tempFile.write(metricsText)
+        os.replace(tempFileName, metricsFile)
+    except Exception as ex:
+        print("[!] Error while writing the metrics file [%s]" % (metricsFile))
+        logger.error("%s" % str(ex))
+        runMetrics['metricsFile'] = None
+
+def execute_queries(driver, cypherQueries, outputDirectory, workers=1, firstQueryIndex=None, showResults=True, cacheIdentity=None, reportWriter=None):
+    global queryCount
+    # Result files are numbered at submission time, so naming does not depend on completion order
+    if firstQueryIndex is None:
+        firstQueryIndex = queryCount
+        queryCount += len(cypherQueries)
+    outputFileNames = []
+    columnarFileNames = []
+    for queryIndex, cypherYaml in enumerate(cypherQueries, firstQueryIndex):
+        outputFileNames.append(get_output_file_name(outputDirectory, cypherYaml, queryIndex) if saveResults else None)
+        columnarFileNames.append(get_columnar_file_name(outputDirectory, cypherYaml, queryIndex) if saveResults and columnarFormat else None)
+    queryArguments = [(cypherYaml, outputFileName, columnarFileName, cacheIdentity, register_query_metrics(cypherYaml['Description'])) for cypherYaml, outputFileName, columnarFileName in zip(cypherQueries, outputFileNames, columnarFileNames)]
+    if workers > 1:
+        logger.info("Running %s queries with %s workers" % (len(cypherQueries), workers))
+    # Queries always run in worker threads, so that fetching the next query overlaps with displaying and reporting the current one
+    executor = futures.ThreadPoolExecutor(max_workers=workers)
+    parsedResults = map_results(executor, lambda *args: profile_result(driver, *args), queryArguments, workers + pipelineDepth)
+    queryResults = []
+    try:
+        for queryIndex, (cypherYaml, (parsedResult, queryProfile)) in enumerate(zip(cypherQueries, parsedResults), firstQueryIndex):
+            if profileQueries:
+                queryProfiles.append(queryProfile)
+            if queryProfile['status'] != 'ok':
+                failedQueries.append(queryProfile)
+            if showResults:
+                with pause_progress():
+                    hasResults = show_result(parsedResult, cypherYaml['Headers'], cypherYaml['Description'])
+            else:
+                hasResults = bool(parsedResult and parsedResult['count'] > 0)
+            if hasResults:
+                parsedResult['queryIndex'] = queryIndex
+                parsedResult['description'] = cypherYaml['Description'].strip()
+                parsedResult['headers'] = cypherYaml['Headers']
+                queryResults.append(parsedResult)
+                if reportWriter:
+                    reportWriter['queue'].put(parsedResult)
+    finally:
+        executor.shutdown(wait=True)
+    return queryResults
+
+def get_template_lookups(cypherQueries):
+    # Properties used to find nodes: inline property maps and WHERE predicates that an index can answer
+    lookups = {}
+    for cypherYaml in cypherQueries:
+        for CypherQuery in (cypherYaml['Query'], cypherYaml.get('ClosureQuery'), (cypherYaml.get('Partition') or {}).get('Query'), (cypherYaml.get('Partition') or {}).get('SliceQuery')):
+            if not CypherQuery:
+                continue
+            aliasLabels = {}
+            for alias, label in re.findall(r"\(\s*(\w+)\s*:\s*(\w+)", CypherQuery):
+                aliasLabels.setdefault(alias, label)
+            queryLookups = set()
+            for label, propertyMap in re.findall(r"\(\s*\w*\s*:\s*(\w+)\s*\{([^}]*)\}", CypherQuery):
+                for propertyName in re.findall(r"(\w+)\s*:", propertyMap):
+                    queryLookups.add((label, propertyName))
+            for lookupMatch in re.finditer(r"\b(\w+)\.(\w+)\s*(?:=(?!~)|<(?!>)=?|>=?|IN\b|STARTS\s+WITH\b|ENDS\s+WITH\b|CONTAINS\b|IS\s+NOT\s+NULL\b)", CypherQuery, re.IGNORECASE):
+                # Negated predicates are not answered by an index
+                if lookupMatch.group(1) in aliasLabels and not re.search(r"\bNOT\s*\(?\s*$", CypherQuery[:lookupMatch.start()], re.IGNORECASE):
+                    queryLookups.add((aliasLabels[lookupMatch.group(1)], lookupMatch.group(2)))
+            for lookup in queryLookups:
+                lookups.setdefault(lookup, set()).add(cypherYaml['Description'].strip())
+    return lookups
+
+def get_database_indexes(session):
+    # Single property node indexes (including the ones backing unique constraints) and their state.
+    # The db.indexes() columns changed across Neo4j versions, and SHOW INDEXES replaced it in Neo4j 5.
+    try:
+        records = [dict(record.items()) for record in session.run("CALL db.indexes()")]
+    except Exception:
+        records = [dict(record.items()) for record in session.run("SHOW INDEXES")]
+    indexes = {}
+    for record in records:
+        labels = record.get('labelsOrTypes') or record.get('tokenNames') or ([record['label']] if record.get('label') else [])
+        properties = record.get('properties') or []
+        if record.get('entityType', "NODE") == "NODE" and len(labels) == 1 and len(properties) == 1:
+            indexes[(labels[0], properties[0])] = str(record.get('state', "")).lower()
+    return indexes
+
+def ensure_indexes(driver, cypherQueries, dryRun=False, indexTimeout=300):
+    lookups = get_template_lookups(cypherQueries)
+    if not lookups:
+        print("[+] No indexed lookup found in the templates")
+        return True
+    try:
+        with driver.session() as session:
+            indexes = get_database_indexes(session)
+            missingIndexes = sorted(lookup for lookup in lookups if lookup not in indexes)
+            if not dryRun:
+                createdIndexes = []
+                for label, propertyName in missingIndexes:
+                    try:
+                        session.run("CREATE INDEX ON :`%s`(`%s`)" % (label, propertyName)).consume()
+                    except Exception:
+                        try:
+                            session.run("CREATE INDEX IF NOT EXISTS FOR (n:`%s`) ON (n.`%s`)" % (label, propertyName)).consume()
+                        except Exception as ex:
+                            print("[!] Error while creating the index on [%s.%s]" % (label, propertyName))
+                            logger.warning("%s" % str(ex))
+                            indexes[(label, propertyName)] = "failed"
+                            continue
+                    indexes[(label, propertyName)] = "created"
+                    createdIndexes.append((label, propertyName))
+                if createdIndexes:
+                    # New indexes are populated in the background, queries would not use them until they are online
+                    print("[+] Waiting for %s {indexes} to come online...".format(indexes="indexes" if len(createdIndexes) > 1 else "index") % len(createdIndexes))
+                    startTime = time.perf_counter()
+                    try:
+                        session.run("CALL db.awaitIndexes(%d)" % indexTimeout).consume()
+                        print("[+] Indexes online in %.1f seconds" % (time.perf_counter() - startTime))
+                    except Exception as ex:
+                        print("[!] Error while waiting for the indexes to come online")
+                        logger.warning("%s" % str(ex))
+                        for lookup in createdIndexes:
+                            indexes[lookup] = "created, not online"
+            indexRows = [[label, propertyName, len(lookups[(label, propertyName)]), indexes.get((label, propertyName)) or "missing"] for label, propertyName in sorted(lookups)]
+            print("[+] Index plan:\n")
+            print(tabulate.tabulate(indexRows, headers=['Label', 'Property', 'Templates', 'Index'], tablefmt='github') + '\n')
+            if any(indexes.get(lookup) == "failed" for lookup in missingIndexes):
+                return False
+        return True
+    except Exception as ex:
+        print("[!] Error while managing the template indexes")
+        logger.error("%s" % str(ex))
+        return False
+
+def get_database_identity(driver, neo4jDBPath=None, activeDB=None):
+    # Identify the dataset by its name and a fingerprint that changes whenever the store is written to
+    try:
+        fingerprint = hashlib.sha256()
+        with driver.session() as session:
+            try:
+                txId = session.run('CALL dbms.queryJmx("org.neo4j:instance=kernel#0,name=Transactions") YIELD attributes RETURN attributes.LastCommittedTxId.value AS txId').single()
+                if txId:
+                    fingerprint.update(("tx:%s;" % txId['txId']).encode("utf-8"))
+            except Exception as ex:
+                logger.info("Last committed transaction not available: %s" % str(ex))
+            nodeCount = session.run("MATCH (n) RETURN count(n) AS count").single()['count']
+            relationshipCount = session.run("MATCH ()-[r]->() RETURN count(r) AS count").single()['count']
+            fingerprint.update(("nodes:%s;relationships:%s;" % (nodeCount, relationshipCount)).encode("utf-8"))
+        if neo4jDBPath and activeDB and os.path.isdir(os.path.join(neo4jDBPath, activeDB)):
+            for root, dirs, files in os.walk(os.path.join(neo4jDBPath, activeDB)):
+                for file in sorted(files):
+                    fileStat = os.stat(os.path.join(root, file))
+                    fingerprint.update(("%s:%s:%s;" % (file, fileStat.st_size, fileStat.st_mtime_ns)).encode("utf-8"))
+        return "%s:%s" % (activeDB or get_driver_address(driver), fingerprint.hexdigest())
+    except Exception as ex:
+        print("[!] Error while getting database identity")
+        logger.warning("%s" % str(ex))
+        return False
+
+def get_identity_alias_file(cacheDirectory, databaseIdentity):
+    return os.path.join(cacheDirectory, "identity-%s.alias" % hashlib.sha256(databaseIdentity.encode("utf-8")).hexdigest()[:16])
+
+def get_cache_identity(cacheDirectory, driver, neo4jDBPath=None, activeDB=None):
+    # The admin closure moves the fingerprint forward without changing the data, the identity found once it was removed
+    # points to the identity the cached results were stored with
+    databaseIdentity = get_database_identity(driver, neo4jDBPath, activeDB)
+    if not databaseIdentity:
+        return databaseIdentity
+    aliasFileName = get_identity_alias_file(cacheDirectory, databaseIdentity)
+    try:
+        if os.path.isfile(aliasFileName):
+            with open(aliasFileName, 'r', encoding="utf-8") as fi:
+                aliasIdentity = json.load(fi)['identity']
+            os.utime(aliasFileName)
+            logger.info("Database identity [%s] is an alias of [%s]" % (databaseIdentity, aliasIdentity))
+            return aliasIdentity
+    except Exception as ex:
+        print("[!] Error while reading database identity alias [%s]" % aliasFileName)
+        logger.warning("%s" % str(ex))
+    return databaseIdentity
+
+def store_identity_alias(cacheDirectory, cacheIdentity, driver, neo4jDBPath=None, activeDB=None):
+    # Called once the admin closure was removed, when no other write happened the cached results remain valid
+    databaseIdentity = get_database_identity(driver, neo4jDBPath, activeDB)
+    if not databaseIdentity or databaseIdentity == cacheIdentity:
+        return
+    aliasFileName = get_identity_alias_file(cacheDirectory, databaseIdentity)
+    try:
+        with open(aliasFileName + ".part", 'w', encoding="utf-8") as fo:
+            json.dump({'identity': cacheIdentity, 'created': datetime.now().isoformat()}, fo)
+        os.replace(aliasFileName + ".part", aliasFileName)
+    except Exception as ex:
+        print("[!] Error while writing database identity alias [%s]" % aliasFileName)
+        logger.warning("%s" % str(ex))
+
+def get_driver_address(driver):
+    try:
+        return str(driver.get_server_info().address)
+    except Exception:
+        return "remote"
+
+def get_cache_key(cypherYaml, databaseIdentity):
+    cacheKey = hashlib.sha256()
+    cacheKey.update(str(cypherYaml.get('Hash', '')).encode("utf-8"))
+    cacheKey.update(cypherYaml['Query'].strip().encode("utf-8"))
+    if cypherYaml.get('Partition'):
+        cacheKey.update(json.dumps(cypherYaml['Partition'], sort_keys=True).encode("utf-8"))
+    cacheKey.update(';'.join(cypherYaml['Headers']).encode("utf-8"))
+    if estimateMode:
+        # Estimates are kept apart from the exact results of the same template, and from estimates with other samples
+        cacheKey.update(("estimate:%s:%s:%s" % (json.dumps(cypherYaml.get('Estimate'), sort_keys=True), sampleSize, estimateConfidence)).encode("utf-8"))
+    cacheKey.update(str(resultFileVersion).encode("utf-8"))
+    cacheKey.update(databaseIdentity.encode("utf-8"))
+    return cacheKey.hexdigest()
+
+def load_cached_result(cacheDirectory, cacheKey, outputFileName=None, columnarFileName=None):
+    metaFileName = os.path.join(cacheDirectory, cacheKey + ".json")
+    csvFileName = os.path.join(cacheDirectory, cacheKey + ".csv")
+    try:
+        if not os.path.isfile(metaFileName):
+            return None
+        with open(metaFileName, 'r', encoding="utf-8") as fi:
+            parsedResult = json.load(fi)
+        if parsedResult['count'] > 0:
+            if not os.path.isfile(csvFileName):
+                return None
+            if columnarFileName:
+                cachedColumnarFileName = os.path.join(cacheDirectory, cacheKey + "." + columnarFormat)
+                if not os.path.isfile(cachedColumnarFileName):
+                    return None
+                os.makedirs(os.path.dirname(columnarFileName), exist_ok=True)
+                shutil.copyfile(cachedColumnarFileName, columnarFileName)
+            if outputFileName:
+                shutil.copyfile(csvFileName, outputFileName)
+            os.utime(csvFileName)
+        # Entries are evicted by last access
+        os.utime(metaFileName)
+        parsedResult['outputFileName'] = outputFileName if parsedResult['count'] > 0 else None
+        parsedResult['columnarFileName'] = columnarFileName if parsedResult['count'] > 0 else None
+        parsedResult['cached'] = True
+        return parsedResult
+    except Exception as ex:
+        print("[!] Error while loading cached result [%s]" % cacheKey)
+        logger.warning("%s" % str(ex))
+        return None
+
+def store_cached_result(cacheDirectory, cacheKey, cypherYaml, parsedResult, databaseIdentity):
+    metaFileName = os.path.join(cacheDirectory, cacheKey + ".json")
+    csvFileName = os.path.join(cacheDirectory, cacheKey + ".csv")
+    try:
+        if parsedResult['outputFileName']:
+            shutil.copyfile(parsedResult['outputFileName'], csvFileName + ".part")
+            os.replace(csvFileName + ".part", csvFileName)
+        if parsedResult.get('columnarFileName'):
+            cachedColumnarFileName = os.path.join(cacheDirectory, cacheKey + "." + columnarFormat)
+            shutil.copyfile(parsedResult['columnarFileName'], cachedColumnarFileName + ".part")
+            os.replace(cachedColumnarFileName + ".part", cachedColumnarFileName)
+        cacheEntry = {
+            'description': cypherYaml['Description'].strip(),
+            'hash': cypherYaml.get('Hash'),
+            'database': databaseIdentity,
+            'created': datetime.now().isoformat(),
+            'count': parsedResult['count'],
+            'preview': parsedResult['preview'],
+            'rows': None
+        }
+        # The metadata file is written last, an entry only exists once its CSV is complete
+        with open(metaFileName + ".part", 'w', encoding="utf-8") as fo:
+            json.dump(cacheEntry, fo, default=str)
+        os.replace(metaFileName + ".part", metaFileName)
+    except Exception as ex:
+        print("[!] Error while caching result for query [%s]" % cypherYaml['Description'].strip())
+        logger.warning("%s" % str(ex))
+
+def evict_cache(cacheDirectory, cacheMaxSize, cacheMaxAge):
+    try:
+        now = time.time()
+        cacheEntries = []
+        for metaFile in os.scandir(cacheDirectory):
+            if metaFile.name.endswith(".alias") and now - metaFile.stat().st_mtime > cacheMaxAge * 3600:
+                os.remove(metaFile.path)
+            elif metaFile.name.endswith((".tmp", ".part")) and now - metaFile.stat().st_mtime > cacheTempMaxAge:
+                os.remove(metaFile.path)
+            if not metaFile.name.endswith(".json"):
+                continue
+            cacheFileNames = [metaFile.path] + [os.path.join(cacheDirectory, metaFile.name[:-len(".json")] + extension) for extension in (".csv", ".parquet", ".arrow")]
+            entrySize = sum(os.path.getsize(cacheFile) for cacheFile in cacheFileNames if os.path.isfile(cacheFile))
+            cacheEntries.append((metaFile.stat().st_mtime, entrySize, cacheFileNames))
+        cacheEntries.sort()
+        totalSize = sum(entry[1] for entry in cacheEntries)
+        evictedCount = 0
+        for lastAccess, entrySize, cacheFileNames in cacheEntries:
+            if now - lastAccess > cacheMaxAge * 3600 or totalSize > cacheMaxSize * 1024 * 1024:
+                for cacheFile in cacheFileNames:
+                    if os.path.isfile(cacheFile):
+                        os.remove(cacheFile)
+                totalSize -= entrySize
+                evictedCount += 1
+        if evictedCount:
+            logger.info("%s cache {entries} evicted".format(entries="entries" if evictedCount > 1 else "entry") % evictedCount)
+    except Exception as ex:
+        print("[!] Error while evicting cache entries")
+        logger.warning("%s" % str(ex))
+
+def get_databases(neo4jDBPath):
+    try:
+        DBlist = []
+        for file in os.listdir(neo4jDBPath):
+            if os.path.isdir(os.path.join(neo4jDBPath, file)):
+                if file != "graph.db":
+                    DBlist.append(file)
+        return DBlist
+    except Exception as ex:
+        print("[!] Error while getting databases")
+        logger.error("%s" % str(ex))
+        return False
+
+def list_databases(DBlist, currentDB):
+    try:
+        print("[+] Available Databases: ")
+        i = 0
+        for DB in DBlist:
+            if DB == currentDB:
+                print('-> [%s]: %s' % (str(i), DBlist[i]))
+            else:
+                print('   [%s]: %s' % (str(i), DBlist[i]))
+            i += 1
+    except Exception as ex:
+        print("[!] Error while listing databases")
+        logger.error("%s" % str(ex))
+
+def is_valid_database_name(neo4jDBPath, NewDB, DBlist):
+    NewDBPath = os.path.realpath(os.path.join(neo4jDBPath,NewDB))
+    return NewDB != "" and NewDB.find(".") == -1 and NewDB not in DBlist and os.path.commonprefix((NewDBPath,neo4jDBPath)) == neo4jDBPath
+
+def generate_database(neo4jDBPath, DBlist, NewDBs=None):
+    try:
+        graphDBArchive = "Clean.graphdb.zip"
+        pathName = os.path.dirname(sys.argv[0])
+        fullPath = os.path.abspath(pathName)
+        cleanDBPath = os.path.join(fullPath, graphDBArchive).strip()
+        if not os.path.isfile(cleanDBPath):
+            print("[!] Neo4j database sample file does not exist! \n")
+            return False
+        if not NewDBs:
+            while True:
+                NewDB = input('\nPlease input the new Database name: ')
+                if is_valid_database_name(neo4jDBPath, NewDB, DBlist):
+                    NewDBs = [NewDB]
+                    break
+                else:
+                    print("[!] Database name not valid!")
+        # Names are checked before the template database is extracted, which is only done when something is to be created
+        validDBs = []
+        for NewDB in NewDBs:
+            if not is_valid_database_name(neo4jDBPath, NewDB, DBlist + validDBs):
+                print("[!] Database name '%s' not valid!" % (NewDB))
+            else:
+                validDBs.append(NewDB)
+        if not validDBs:
+            print("[!] No valid database name provided!")
+            return False
+        templateDBPath = get_template_database(neo4jDBPath, cleanDBPath)
+        if not templateDBPath:
+            return False
+        for NewDB in validDBs:
+            print("[!] Creating database '%s'" % (NewDB))
+            startTime = time.perf_counter()
+            NewDBPath = os.path.realpath(os.path.join(neo4jDBPath,NewDB))
+            cloneMethod = clone_directory(templateDBPath, NewDBPath)
+            if runningOS == 'Linux':
+                change_directory_ownership(NewDBPath)
+            DBlist.append(NewDB)
+            logger.info("Database '%s' created using %s in %.3fs" % (NewDB, cloneMethod, time.perf_counter() - startTime))
+        return True
+    except Exception as ex:
+        print("[!] Error while generating database")
+        logger.error("%s" % str(ex))
+        return False
+
+def get_template_database(neo4jDBPath, cleanDBPath):
+    # The clean archive is extracted once next to the databases directory (same filesystem, so clones can be reflinks)
+    templateDBPath = os.path.join(os.path.dirname(os.path.realpath(neo4jDBPath)), "bloodcheck-template")
+    markerFile = os.path.join(templateDBPath, ".bloodcheck-archive")
+    archiveStat = os.stat(cleanDBPath)
+    archiveVersion = "%s:%s" % (archiveStat.st_size, archiveStat.st_mtime_ns)
+    try:
+        if os.path.isfile(markerFile):
+            with open(markerFile, 'r') as fi:
+                if fi.read().strip() == archiveVersion:
+                    return templateDBPath
+        logger.info("Extracting template database to [%s]" % templateDBPath)
+        tempDBPath = templateDBPath + ".tmp"
+        if os.path.isdir(tempDBPath):
+            shutil.rmtree(tempDBPath)
+        # The marker is only written once the archive is fully extracted, a partial extract is never reused
+        if not unzip_file(cleanDBPath, tempDBPath):
+            shutil.rmtree(tempDBPath, ignore_errors=True)
+            return False
+        with open(os.path.join(tempDBPath, ".bloodcheck-archive"), 'w') as fo:
+            fo.write(archiveVersion)
+        if runningOS == 'Linux':
+            change_directory_ownership(tempDBPath)
+        if os.path.isdir(templateDBPath):
+            shutil.rmtree(templateDBPath)
+        os.rename(tempDBPath, templateDBPath)
+        return templateDBPath
+    except Exception as ex:
+        shutil.rmtree(templateDBPath + ".tmp", ignore_errors=True)
+        print("[!] Error while preparing the template database [%s]" % templateDBPath)
+        logger.error("%s" % str(ex))
+        return False
+
+def clone_file(sourceFile, targetFile):
+    # Copy-on-write clone (btrfs, XFS, ...). Hardlinks are not an option as Neo4j updates store files in place.
+    if runningOS == 'Linux':
+        import fcntl
+        FICLONE = 0x40049409
+        try:
+            with open(sourceFile, 'rb') as fi, open(targetFile, 'wb') as fo:
+                fcntl.ioctl(fo.fileno(), FICLONE, fi.fileno())
+            shutil.copystat(sourceFile, targetFile)
+            return "reflink"
+        except OSError:
+            pass
+    shutil.copy2(sourceFile, targetFile)
+    return "copy"
+
+def clone_directory(sourcePath, targetPath):
+    cloneMethods = set()
+    for root, dirs, files in os.walk(sourcePath):
+        targetRoot = os.path.join(targetPath, os.path.relpath(root, sourcePath))
+        os.makedirs(targetRoot, exist_ok=True)
+        for file in files:
+            if file == ".bloodcheck-archive":
+                continue
+            cloneMethods.add(clone_file(os.path.join(root, file), os.path.join(targetRoot, file)))
+    return "/".join(sorted(cloneMethods)) or "copy"
+
+def select_database_to_switch(DBlist, currentDB):
+    try:
+        choice = ""
+        list_databases(DBlist, currentDB)
+        while True:
+            choice = input('\n[!] Please select the Database to switch to: ')
+            if choice.isdigit():
+                if int(choice) in range(0,len(DBlist)):
+                    break
+                else:
+                    print("[!] Database not valid!")
+            else:
+                print("[!] Database not valid!")
+        print("[!] Switching to database '%s'" % (str(DBlist[int(choice)])))
+        return DBlist[int(choice)]
+    except Exception as ex:
+        print("[!] Error while switching databases")
+        logger.error("%s" % str(ex))
+        return False
+
+def select_database_to_purge(DBlist, currentDB):
+    try:
+        choice = ""
+        list_databases(DBlist, currentDB)
+        while True:
+            choice = input('\n[!] Please select the Database to purge : ')
+            if choice.isdigit():
+                if int(choice) in range(0,len(DBlist)):
+                    break
+                else:
+                    print("[!] Database not valid!")
+            else:
+                print("[!] Database not valid!")
+        print("[!] Deleting database '%s'" % (DBlist[int(choice)]))
+        return DBlist[int(choice)]
+    except Exception as ex:
+        print("[!] Error while purging database")
+        logger.error("%s" % str(ex))
+        return False
+
+def set_active_database(neo4jConFile, selectedDB):
+    try:
+        if os.path.isfile(neo4jConFile):
+            f = open(neo4jConFile, 'r')
+            lines = f.read().splitlines()
+            i = 0
+            newlines = []
+            for line in lines:
+                if line.startswith("dbms.active_database="):
+                    line=line.replace(line,"dbms.active_database=%s" % (selectedDB))
+                newlines.append(line)
+                i += 1
+            f.close()
+            f = open(neo4jConFile, 'w')
+            for line in newlines:
+                f.write(line+"\n")
+            f.close()
+            print("[+] Neo4j database ready, please restart Neo4j and refresh BloodHound DB stats")
+        else:
+            print("[!] Neo4j Configuration file '%s' does not exist ! Please check the config.py file \n" % (neo4jConFile))
+    except Exception as ex:
+        print("[!] Error while setting active database")
+        logger.error("%s" % str(ex))
+
+def get_active_database(neo4jConFile):
+    try:
+        returnDB = None
+        f = open(neo4jConFile, 'r')
+        lines = f.read().splitlines()
+        for line in lines:
+            if line.startswith("dbms.active_database="):
+                returnDB = line.replace("dbms.active_database=","")
+        f.close()
+        return returnDB
+    except Exception as ex:
+        print("[!] Error while getting active database")
+        logger.error("%s" % str(ex))
+        return False
+
+def run_as_admin(argv=None, debug=False):
+    try:
+        shell32 = ctypes.windll.shell32
+        if argv is None and shell32.IsUserAnAdmin():
+            return True
+
+        if argv is None:
+            argv = sys.argv
+        if hasattr(sys, '_MEIPASS'):
+            arguments = map(str, argv[1:])
+        else:
+            arguments = map(str, argv)
+        argument_line = u''.join(arguments)
+        executable = str(sys.executable)
+        # showCmd = win32con.SW_SHOWNORMAL
+        showCmd = win32con.SW_HIDE
+        #fMask = SEE_MASK_NOASYNC(0x00000100) = 256 + SEE_MASK_NOCLOSEPROCESS(0x00000040) = 64
+        dict = shell.ShellExecuteEx(nShow=showCmd, fMask = 256 + 64, lpVerb=u"runas", lpFile=executable, lpParameters=argument_line)
+        hh = dict['hProcess']
+        ret = win32event.WaitForSingleObject(hh, -1)
+        return True
+    except Exception as ex:
+        print("[!] Error while running as admin")
+        logger.error("%s" % str(ex))
+        return False
+
+def run_as_root(servicePath):
+    try:
+        p = subprocess.Popen(["python3", servicePath], stdout=subprocess.PIPE)
+        (subprocessOutput, subprocessErr) = p.communicate()
+        subprocessOutput = subprocessOutput.decode('utf-8').strip()
+        return True
+    except Exception as ex:
+        print("[!] Error while running as root")
+        logger.error("%s" % str(ex))
+        return False
+
+def get_service(serviceName):
+    service = None
+    try:
+        if runningOS == 'Windows':
+            service = psutil.win_service_get(serviceName)
+            service = service.as_dict()
+        else:
+            p = subprocess.Popen(["service", serviceName, "status"], stdout=subprocess.PIPE)
+            (subprocessOutput, subprocessErr) = p.communicate()
+            subprocessOutput = subprocessOutput.decode('utf-8').strip()
+            if "Loaded: loaded" in subprocessOutput:
+                if "Active: active (running)" in subprocessOutput:
+                    service = {'status': 'running'}
+                else:
+                    service = {'status': 'stopped'}
+        return service
+    except Exception as ex:
+        print("[!] Neo4j service not found")
+        logger.error("%s" % str(ex))
+
+def restart_service(service, config, restartTimeout=120):
+    try:
+        if service:
+            logger.info("Neo4j service found")
+            pathName = os.path.dirname(sys.argv[0])
+            fullPath = os.path.abspath(pathName)
+            servicePath = os.path.join(fullPath, "service.py").strip()
+            if runningOS == 'Windows':
+                runAsAdminReturn = run_as_admin(servicePath)
+            else:
+                runAsAdminReturn = run_as_root(servicePath)
+            if runAsAdminReturn:
+                print("[!] Neo4j service restarted! Waiting for Neo4j to be ready...")
+                startupTime = wait_for_neo4j(config, restartTimeout)
+                if startupTime is False:
+                    print("[!] Neo4j is not ready after %s seconds!" % (restartTimeout))
+                    return False
+                print("[+] Neo4j ready in %.1f seconds" % (startupTime))
+                return True
+            else:
+                return False
+        else:
+            print("[!] Neo4j service not found!")
+            return False
+    except Exception as ex:
+        print("[!] Error while restarting service [%s]" % service)
+        logger.error("%s" % str(ex))
+        return False
+
+def wait_for_neo4j(config, restartTimeout=120, initialDelay=0.1, maxDelay=2.0):
+    # Poll the Bolt port, then run a trivial query, with exponential backoff until the deadline
+    neo4jURI = urlparse(config.neo4jURI)
+    host = neo4jURI.hostname or "localhost"
+    port = neo4jURI.port or 7687
+    startTime = time.perf_counter()
+    deadline = startTime + restartTimeout
+    delay = initialDelay
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            with socket.create_connection((host, port), timeout=min(1.0, restartTimeout)):
+                pass
+            driver = neo4j.GraphDatabase.driver(config.neo4jURI, auth=(config.neo4jUser, config.neo4jPass))
+            try:
+                with driver.session() as session:
+                    session.run("RETURN 1").single()
+            finally:
+                driver.close()
+            startupTime = time.perf_counter() - startTime
+            logger.info("Neo4j ready after %s attempts" % attempts)
+            return startupTime
+        except Exception as ex:
+            logger.info("Neo4j not ready yet: %s" % str(ex))
+        remainingTime = deadline - time.perf_counter()
+        if remainingTime <= 0:
+            return False
+        time.sleep(min(delay, remainingTime))
+        delay = min(delay * 2, maxDelay)
+
+def unzip_file(zipFilePath,outFolder):
+    try:
+        with zipfile.ZipFile(zipFilePath, 'r') as zip_ref:
+            zip_ref.extractall(outFolder)
+        return True
+    except Exception as ex:
+        print("[!] Error while unzipping file [%s]" % zipFilePath)
+        logger.error("%s" % str(ex))
+        return False
+
+def change_directory_ownership(directoryPath):
+    try:
+        try:
+            uid = pwd.getpwnam("neo4j").pw_uid
+            gid = grp.getgrnam("neo4j").gr_gid
+        except KeyError:
+            # No local neo4j account (e.g. docker volume), use the default neo4j uid/gid
+            uid = 101
+            gid = 101
+        for root, dirs, files in os.walk(directoryPath):
+            for name in dirs + files:
+                os.chown(os.path.join(root, name), uid, gid)
+        os.chown(directoryPath, uid, gid)
+    except Exception as ex:
+        print("[!] Error while changing ownership of directory [%s]" % directoryPath)
+        logger.error("%s" % str(ex))
+
+def load_yaml_folder(queryDirectory, recursive=False):
+    try:
+        print("[+] Loading query files from directory [%s]" % queryDirectory.strip())
+        cypherQueries = load_query_catalog(queryDirectory, recursive)
+        print("[+] %s query {files} loaded !".format(files="files" if len(cypherQueries) > 1 else "file") % (len(cypherQueries)))
+        return cypherQueries
+    except Exception as ex:
+        print("[!] Error while loading yaml files from folder [%s]" % queryDirectory)
+        logger.warning("%s" % str(ex))
+        return False
+
+def get_template_files(queryDirectory, recursive=False):
+    # Sorted walk, so that templates are always run in the same order
+    templateFiles = []
+    for root, dirs, files in os.walk(queryDirectory):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.endswith(".yml"):
+                templateFiles.append(os.path.join(root, filename))
+        if not recursive:
+            break
+    return templateFiles
+
+def load_query_catalog(queryDirectory, recursive=False):
+    # Parsed templates are kept in a pickled catalog, only new or modified files are parsed again
+    catalogPath = catalogDirectory or os.path.join(os.path.abspath(os.path.dirname(sys.argv[0])), "_cache")
+    catalogKey = hashlib.sha256(("%s:%s" % (os.path.realpath(queryDirectory), recursive)).encode("utf-8")).hexdigest()[:16]
+    catalogFile = os.path.join(catalogPath, "catalog-" + catalogKey + ".pickle")
+    catalog = {}
+    try:
+        if daemonState is not None and catalogFile in daemonState['catalogs']:
+            catalog = daemonState['catalogs'][catalogFile]
+        else:
+            with open(catalogFile, 'rb') as fi:
+                catalog = pickle.load(fi)
+        if catalog.get('version') != 1 or catalog.get('loader') != get_yaml_loader().__name__:
+            catalog = {}
+    except Exception:
+        catalog = {}
+    catalogEntries = catalog.get('entries', {})
+    newCatalogEntries = {}
+    cypherQueries = []
+    templateFiles = get_template_files(queryDirectory, recursive)
+    staleFiles = []
+    for yamlFile in templateFiles:
+        fileStat = os.stat(yamlFile)
+        fileVersion = (fileStat.st_mtime_ns, fileStat.st_size)
+        catalogEntry = catalogEntries.get(yamlFile)
+        if catalogEntry is None or catalogEntry['version'] != fileVersion:
+            staleFiles.append(yamlFile)
+            catalogEntry = {'version': fileVersion, 'cypherYaml': None}
+        newCatalogEntries[yamlFile] = catalogEntry
+    for yamlFile, cypherYaml in zip(staleFiles, parse_template_files(staleFiles)):
+        newCatalogEntries[yamlFile]['cypherYaml'] = cypherYaml
+    catalogChanged = bool(staleFiles)
+    for yamlFile in templateFiles:
+        catalogEntry = newCatalogEntries[yamlFile]
+        if catalogEntry['cypherYaml'] is False and yamlFile not in staleFiles:
+            print("[!] Error while loading the yaml file [%s]" % yamlFile)
+        if catalogEntry['cypherYaml'] is not False:
+            cypherQueries.append(dict(catalogEntry['cypherYaml']))
+    if daemonState is not None:
+        daemonState['catalogs'][catalogFile] = {'version': 1, 'loader': get_yaml_loader().__name__, 'entries': newCatalogEntries}
+    if catalogChanged or len(newCatalogEntries) != len(catalogEntries):
+        try:
+            os.makedirs(catalogPath, exist_ok=True)
+            with open(catalogFile + ".part", 'wb') as fo:
+                pickle.dump({'version': 1, 'loader': get_yaml_loader().__name__, 'entries': newCatalogEntries}, fo, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(catalogFile + ".part", catalogFile)
+        except Exception as ex:
+            logger.warning("Unable to save the query catalog: %s" % str(ex))
+    return cypherQueries
+
+def parse_template_files(yamlFiles):
+    # YAML parsing holds the GIL, large sets of new or modified templates are parsed by a pool of processes.
+    # Smaller sets are parsed in this process, as starting the pool would take longer than parsing them.
+    workers = min(os.cpu_count() or 1, 8)
+    if workers < 2 or len(yamlFiles) < catalogParallelThreshold:
+        return [load_yaml_file(yamlFile) for yamlFile in yamlFiles]
+    logger.info("Parsing %s templates with %s processes" % (len(yamlFiles), workers))
+    try:
+        with futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(load_yaml_file, yamlFiles, chunksize=max(1, len(yamlFiles) // (workers * 4))))
+    except Exception as ex:
+        logger.warning("Unable to parse the templates in parallel: %s" % str(ex))
+        return [load_yaml_file(yamlFile) for yamlFile in yamlFiles]
+
+def validate_cypher_yaml(cypherYaml):
+    if not isinstance(cypherYaml, dict):
+        raise ValueError("template is not a mapping")
+    for requiredKey, requiredType in (('Description', str), ('Headers', list), ('Query', str)):
+        if requiredKey not in cypherYaml:
+            raise ValueError("missing required section '%s'" % requiredKey)
+        if not isinstance(cypherYaml[requiredKey], requiredType):
+            raise ValueError("section '%s' must be a %s" % (requiredKey, "list" if requiredType is list else "string"))
+    if 'Hash' in cypherYaml and not isinstance(cypherYaml['Hash'], str):
+        raise ValueError("section 'Hash' must be a string")
+    if not cypherYaml['Headers']:
+        raise ValueError("section 'Headers' is empty")
+    if 'Local' in cypherYaml:
+        localSpec = cypherYaml['Local']
+        if not isinstance(localSpec, dict) or not isinstance(localSpec.get('Match'), list) or not isinstance(localSpec.get('Return'), list):
+            raise ValueError("section 'Local' must be a mapping with 'Match' and 'Return' lists")
+        if len(localSpec['Return']) != len(cypherYaml['Headers']):
+            raise ValueError("local 'Return' must have one entry per header")
+    if 'Timeout' in cypherYaml and (isinstance(cypherYaml['Timeout'], bool) or not isinstance(cypherYaml['Timeout'], (int, float)) or cypherYaml['Timeout'] <= 0):
+        raise ValueError("section 'Timeout' must be a positive number of seconds")
+    if 'Retries' in cypherYaml and (isinstance(cypherYaml['Retries'], bool) or not isinstance(cypherYaml['Retries'], int) or cypherYaml['Retries'] < 0):
+        raise ValueError("section 'Retries' must be a positive integer")
+    if 'Estimate' in cypherYaml:
+        estimateSpec = cypherYaml['Estimate']
+        if not isinstance(estimateSpec, dict) or not (estimateSpec.get('CountStore') is True or (isinstance(estimateSpec.get('Population'), str) and isinstance(estimateSpec.get('Query'), str))):
+            raise ValueError("section 'Estimate' must be a mapping with 'Population' and 'Query' strings, or 'CountStore' set to true")
+        if estimateSpec.get('CountStore') and len(cypherYaml['Headers']) != 2:
+            raise ValueError("count store estimates must have two headers")
+        if estimateSpec.get('Sample') is not None and (isinstance(estimateSpec['Sample'], bool) or not isinstance(estimateSpec['Sample'], int) or estimateSpec['Sample'] < 1):
+            raise ValueError("estimate 'Sample' must be a positive integer")
+        if estimateSpec.get('Proportions') is not None and (not isinstance(estimateSpec['Proportions'], list) or not all(isinstance(statisticName, str) for statisticName in estimateSpec['Proportions'])):
+            raise ValueError("estimate 'Proportions' must be a list of statistic names")
+    if 'ClosureQuery' in cypherYaml and not isinstance(cypherYaml['ClosureQuery'], str):
+        raise ValueError("section 'ClosureQuery' must be a string")
+    if 'Partition' in cypherYaml:
+        partition = cypherYaml['Partition']
+        if not isinstance(partition, dict) or not isinstance(partition.get('Query'), str) or not isinstance(partition.get('SliceQuery'), str):
+            raise ValueError("section 'Partition' must be a mapping with 'Query' and 'SliceQuery' strings")
+        if partition.get('OrderBy') is not None and partition['OrderBy'] not in cypherYaml['Headers']:
+            raise ValueError("partition 'OrderBy' must be one of the headers")
+        for partitionKey in ('Limit', 'Workers'):
+            if partition.get(partitionKey) is not None and (not isinstance(partition[partitionKey], int) or partition[partitionKey] < 1):
+                raise ValueError("partition '%s' must be a positive integer" % partitionKey)
+
+def get_yaml_loader():
+    # The C loader is used when PyYAML was built with libyaml
+    global yamlLoader
+    if yamlLoader is None:
+        yamlLoader = getattr(yaml, "CFullLoader", yaml.FullLoader)
+    return yamlLoader
+
+def load_yaml_file(yamlFile):
+    try:
+        with open(yamlFile, 'r', encoding="utf-8") as fi:
+            cypherYaml = yaml.load(fi, Loader=get_yaml_loader())
+            validate_cypher_yaml(cypherYaml)
+            cypherDescription = cypherYaml['Description'].strip()
+            # Templates are grouped by their directory (users, computers, da, ...)
+            cypherYaml.setdefault('Category', os.path.basename(os.path.dirname(os.path.abspath(yamlFile))))
+            logger.info("[+] Parsing query [%s]" % cypherDescription)
+        return cypherYaml
+    except Exception as ex:
+        print("[!] Error while loading the yaml file [%s]" % yamlFile)
+        logger.warning("%s" % str(ex))
+        return False
+
+def start_result_writer(outputFileName, columnarFileName, headers, queryMetrics=None):
+    # Batches are written by a background thread, so that fetching the next batch overlaps with disk writes
+    resultWriter = {'queue': queue.Queue(maxsize=pipelineDepth), 'error': None, 'queryMetrics': queryMetrics}
+    resultWriter['thread'] = threading.Thread(target=run_result_writer, args=(resultWriter, outputFileName, columnarFileName, headers), daemon=True)
+    resultWriter['thread'].start()
+    return resultWriter
+
+def run_result_writer(resultWriter, outputFileName, columnarFileName, headers):
+    outputFile = None
+    columnarWriter = None
+    try:
+        while True:
+            batch = resultWriter['queue'].get()
+            if batch is None:
+                break
+            # Once an error occurred, remaining batches are drained so that the producer never blocks
+            if resultWriter['error'] is not None:
+                continue
+            try:
+                if outputFileName:
+                    outputFile = save_result(outputFile, outputFileName, headers, batch)
+                if columnarFileName:
+                    columnarWriter = write_columnar_batch(columnarWriter, columnarFileName, headers, batch)
+                if resultWriter['queryMetrics'] is not None:
+                    resultWriter['queryMetrics']['bytesWritten'] = get_written_bytes(outputFileName, columnarFileName)
+            except Exception as ex:
+                resultWriter['error'] = ex
+    finally:
+        if outputFile:
+            outputFile.close()
+        if columnarWriter:
+            columnarWriter['writer'].close()
+
+def put_result_batch(resultWriter, batchRows):
+    # Blocks while the queue is full, which keeps at most pipelineDepth batches in memory
+    if resultWriter['error'] is not None:
+        raise resultWriter['error']
+    resultWriter['queue'].put(batchRows)
+
+def stop_result_writer(resultWriter):
+    resultWriter['queue'].put(None)
+    resultWriter['thread'].join()
+    return resultWriter['error']
+
+def parse_result(results, headers, description, outputFileName=None, reportRowLimit=0, columnarFileName=None, queryDeadline=None):
+    # Records are pulled from the result iterator and handed in batches to a writer thread, only the preview is kept in memory.
+    # Up to reportRowLimit rows are also kept for the Excel report, larger results are read back from the CSV file.
+    cypherDescription = description.strip()
+    resultWriter = None
+    queryMetrics = getattr(queryMetricsContext, 'queryMetrics', None)
+    try:
+        if results is False:
+            return False
+        resultCount = 0
+        previewResults = []
+        reportRows = [] if reportRowLimit > 0 else None
+        batchRows = []
+        firstRecordTime = None
+        if outputFileName or columnarFileName:
+            resultWriter = start_result_writer(outputFileName, columnarFileName, headers, queryMetrics)
+        for record in results:
+            if firstRecordTime is None:
+                firstRecordTime = time.perf_counter()
+            # Each row is read once into a tuple, shared by the preview, the report and the writer thread
+            row = tuple(map(record.get, headers))
+            if len(previewResults) < previewSize:
+                previewResults.append(row)
+            if reportRows is not None:
+                if len(reportRows) < reportRowLimit:
+                    reportRows.append(row)
+                else:
+                    reportRows = None
+            resultCount += 1
+            if queryMetrics is not None and not resultCount % 1000:
+                queryMetrics['rows'] = resultCount
+            # Checked on each record while streaming, the server stops queries that are still running at the deadline
+            if queryDeadline is not None and time.perf_counter() > queryDeadline:
+                raise QueryTimeout("query stopped after %s rows" % (resultCount))
+            if resultWriter:
+                batchRows.append(row)
+                if len(batchRows) >= resultBatchSize:
+                    put_result_batch(resultWriter, batchRows)
+                    batchRows = []
+        if batchRows:
+            put_result_batch(resultWriter, batchRows)
+        if resultWriter:
+            writerError = stop_result_writer(resultWriter)
+            resultWriter = None
+            if writerError is not None:
+                raise writerError
+        return {'count': resultCount, 'preview': previewResults, 'rows': reportRows, 'outputFileName': outputFileName if resultCount else None, 'columnarFileName': columnarFileName if resultCount else None, 'firstRecordTime': firstRecordTime}
+    except Exception as ex:
+        if is_timeout_error(ex) or is_retryable_error(ex):
+            raise
+        print("[!] Error while parsing result for query [%s]" % cypherDescription)
+        logger.warning("%s" % str(ex))
+        return False
+    finally:
+        if resultWriter:
+            stop_result_writer(resultWriter)
+
+def show_result(parsedResult, headers, description):
+    cypherDescription = description.strip()
+    if not parsedResult:
+        return False
+    if parsedResult['count'] > 0:
+        print("[!] [%s] -> Found %s {results}\n".format(results="results" if parsedResult['count'] > 1 else "result") % (cypherDescription,parsedResult['count']))
+        try:
+            print(tabulate.tabulate(parsedResult['preview'], headers=headers, tablefmt='github') + '\n')
+        except:
+            print("[!] Error parsing results!")
+        return True
+    else:
+        logger.info("No result for query [%s]" % cypherDescription)
+        return False
+
+def get_columnar_file_name(outputDirectory, cypherYaml, queryIndex):
+    # Files are laid out as a dataset partitioned by template category (hive style)
+    cypherDescription = cypherYaml['Description'].strip()
+    category = cypherYaml.get('Category', 'misc')
+    return os.path.join(outputDirectory, "BloodCheck-Dataset-" + sessionTimestamp, "category=" + category, cypherDescription + "_" + "%03d" % queryIndex + "." + columnarFormat)
+
+def get_columnar_value(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [get_columnar_value(item) for item in value]
+    return str(value)
+
+def get_columnar_array(column, fieldType=None):
+    # Columns with mixed or unknown types are stored as strings. With a known field type, the column type is checked first,
+    # since pyarrow would otherwise truncate floats to integers or split strings into lists of characters.
+    try:
+        array = pa.array(column)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        array = None
+    if fieldType is None:
+        if array is not None and not pa.types.is_null(array.type):
+            return array
+    elif array is not None and array.type == fieldType:
+        return array
+    elif array is not None and pa.types.is_null(array.type):
+        return pa.array(column, type=fieldType)
+    elif array is not None and pa.types.is_floating(fieldType) and pa.types.is_integer(array.type):
+        return array.cast(fieldType)
+    elif not pa.types.is_string(fieldType):
+        raise pa.ArrowTypeError("column of type %s does not fit the field type %s" % (array.type if array is not None else "mixed", fieldType))
+    return pa.array([None if value is None else str(value) for value in column], type=pa.string())
+
+def write_columnar_batch(columnarWriter, columnarFileName, headers, rows):
+    columns = [[get_columnar_value(value) for value in column] for column in zip(*rows)]
+    if columnarWriter is None:
+        arrays = [get_columnar_array(column) for column in columns]
+        schema = pa.schema([pa.field(header, array.type) for header, array in zip(headers, arrays)])
+        os.makedirs(os.path.dirname(columnarFileName), exist_ok=True)
+        columnarWriter = open_columnar_writer(columnarFileName, schema)
+    else:
+        try:
+            arrays = [get_columnar_array(column, field.type) for column, field in zip(columns, columnarWriter['schema'])]
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            columnarWriter = widen_columnar_file(columnarWriter, columnarFileName, columns)
+            arrays = [get_columnar_array(column, field.type) for column, field in zip(columns, columnarWriter['schema'])]
+    columnarWriter['writer'].write_table(pa.Table.from_arrays(arrays, schema=columnarWriter['schema']))
+    return columnarWriter
+
+def open_columnar_writer(columnarFileName, schema):
+    if columnarFormat == "parquet":
+        writer = pq.ParquetWriter(columnarFileName, schema)
+    else:
+        writer = pa.ipc.new_file(columnarFileName, schema)
+    return {'writer': writer, 'schema': schema}
+
+def get_widened_type(fieldType, column):
+    # Integers become floats when floats show up, any other type change falls back to strings
+    try:
+        get_columnar_array(column, fieldType)
+        return fieldType
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        columnType = get_columnar_array(column).type
+        if pa.types.is_integer(fieldType) and pa.types.is_floating(columnType):
+            return pa.float64()
+        return pa.string()
+
+def widen_columnar_file(columnarWriter, columnarFileName, columns):
+    # The schema is set by the first batch. When a later batch does not fit it, the rows already written are
+    # copied batch by batch to a new file with the widened schema.
+    schema = pa.schema([pa.field(field.name, get_widened_type(field.type, column)) for field, column in zip(columnarWriter['schema'], columns)])
+    logger.info("Widening the schema of [%s] to %s" % (columnarFileName, schema))
+    columnarWriter['writer'].close()
+    previousFileName = columnarFileName + ".previous"
+    os.replace(columnarFileName, previousFileName)
+    columnarWriter = open_columnar_writer(columnarFileName, schema)
+    try:
+        if columnarFormat == "parquet":
+            previousBatches = pq.ParquetFile(previousFileName).iter_batches()
+        else:
+            previousReader = pa.ipc.open_file(previousFileName)
+            previousBatches = (previousReader.get_batch(batchIndex) for batchIndex in range(previousReader.num_record_batches))
+        for previousBatch in previousBatches:
+            arrays = [get_columnar_array(previousBatch.column(columnIndex).to_pylist(), field.type) for columnIndex, field in enumerate(schema)]
+            columnarWriter['writer'].write_table(pa.Table.from_arrays(arrays, schema=schema))
+    finally:
+        previousBatches = None
+        previousReader = None
+        os.remove(previousFileName)
+    return columnarWriter
+
+def get_output_file_name(outputDirectory, cypherYaml, queryIndex):
+    cypherDescription = cypherYaml['Description'].strip()
+    return os.path.join(outputDirectory, cypherDescription + "_" + "%03d" % queryIndex + "_" + sessionTimestamp + ".csv")
+
+def get_csv_row(row):
+    # Null values are kept as None, as read back by read_result_rows
+    if None in row:
+        return ["None" if value is None else value for value in row]
+    return row
+
+def save_result(outputFile, outputFileName, headers, rows):
+    # The file is only created once the first batch is available, so empty results leave no file behind.
+    # Values containing the delimiter, quotes or newlines (e.g. AD descriptions) are quoted by the csv writer.
+    try:
+        if outputFile is None:
+            outputFile = open(outputFileName, "w", encoding="utf-8", newline='')
+            csv.writer(outputFile, delimiter=';', lineterminator='\n').writerow(headers)
+        csv.writer(outputFile, delimiter=';', lineterminator='\n').writerows(map(get_csv_row, rows))
+        return outputFile
+    except IOError:
+        print("[!] Error writing results to file!")
+        raise
+    except Exception as ex:
+        print("[!] Error while saving results")
+        logger.error("%s" % str(ex))
+        raise
+
+def get_report_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+def read_result_rows(outputFileName, headers):
+    # Fallback for results that were too large to be kept in memory
+    with open(outputFileName, 'r', encoding="utf-8", newline='') as fi:
+        reader = csv.reader(fi, delimiter=';')
+        next(reader, None)
+        for row in reader:
+            yield ["" if value == "None" else value for value in row[:len(headers)]]
+
+def write_report_sheet(workbook, sheetName, headers, rows):
+    worksheet = workbook.add_worksheet(sheetName)
+    worksheet.write_row(0, 0, headers)
+    columnWidths = [len(str(header)) for header in headers]
+    rowIndex = 1
+    batchRows = []
+    for row in rows:
+        batchRows.append([get_report_value(value) for value in row])
+        if len(batchRows) >= resultBatchSize:
+            rowIndex = write_report_rows(worksheet, rowIndex, batchRows, columnWidths)
+            batchRows = []
+    if batchRows:
+        rowIndex = write_report_rows(worksheet, rowIndex, batchRows, columnWidths)
+    # Auto-adjust columns' width
+    for columnIndex, columnWidth in enumerate(columnWidths):
+        worksheet.set_column(columnIndex, columnIndex, columnWidth)
+    worksheet.freeze_panes(1, 0)
+    return rowIndex - 1
+
+def write_report_rows(worksheet, rowIndex, batchRows, columnWidths):
+    # Column widths are computed in a single pass over each batch
+    for columnIndex, column in enumerate(zip(*batchRows)):
+        columnWidths[columnIndex] = max(columnWidths[columnIndex], max(map(len, map(str, column))))
+    for row in batchRows:
+        worksheet.write_row(rowIndex, 0, row)
+        rowIndex += 1
+    return rowIndex
+
+def write_report_result(workbook, parsedResult):
+    sheetName = os.path.splitext(os.path.basename(parsedResult['outputFileName']))[0].replace("_" + sessionTimestamp,"")
+    if len(sheetName) > 25:
+        shortSheetName = sheetName[:25]+sheetName[-4:]
+    else:
+        shortSheetName = sheetName
+    logger.info("[+] Writing sheet [%s]" % shortSheetName)
+    if parsedResult['rows'] is not None:
+        rows = parsedResult['rows']
+    else:
+        rows = read_result_rows(parsedResult['outputFileName'], parsedResult['headers'])
+    write_report_sheet(workbook, shortSheetName, parsedResult['headers'], rows)
+
+def build_report(outputDirectory, parsedResults):
+    print("[+] Building Excel report...")
+    outputFileName = os.path.join(outputDirectory,"BloodCheck-Report-" + sessionTimestamp + ".xlsx")
+    # Rows are written in order and flushed to disk as soon as a result set does not fit in memory
+    constantMemory = any(parsedResult['rows'] is None for parsedResult in parsedResults)
+    if constantMemory:
+        logger.info("Result sets above %s rows, using constant memory mode" % reportRowThreshold)
+    workbook = xlsxwriter.Workbook(outputFileName, {'constant_memory': constantMemory, 'strings_to_numbers': True})
+    try:
+        for parsedResult in parsedResults:
+            if not parsedResult['outputFileName']:
+                continue
+            write_report_result(workbook, parsedResult)
+    finally:
+        workbook.close()
+    print("[!] Excel spreadsheet saved to [%s]" % (outputFileName))
+
+def start_report_writer(outputDirectory):
+    # Sheets are written by a background thread as results come in, while the next queries are still running.
+    # The size of upcoming results is unknown, so the workbook is always written in constant memory mode.
+    reportWriter = {'queue': queue.Queue(maxsize=pipelineDepth), 'outputDirectory': outputDirectory, 'error': None}
+    reportWriter['thread'] = threading.Thread(target=run_report_writer, args=(reportWriter,), daemon=True)
+    reportWriter['thread'].start()
+    return reportWriter
+
+def run_report_writer(reportWriter):
+    outputFileName = os.path.join(reportWriter['outputDirectory'],"BloodCheck-Report-" + sessionTimestamp + ".xlsx")
+    workbook = None
+    try:
+        while True:
+            parsedResult = reportWriter['queue'].get()
+            if parsedResult is None:
+                break
+            if reportWriter['error'] is not None or not parsedResult['outputFileName']:
+                continue
+            try:
+                if workbook is None:
+                    print("[+] Building Excel report...")
+                    workbook = xlsxwriter.Workbook(outputFileName, {'constant_memory': True, 'strings_to_numbers': True})
+                write_report_result(workbook, parsedResult)
+                # Report rows are no longer needed once the sheet is written
+                parsedResult['rows'] = None
+            except Exception as ex:
+                reportWriter['error'] = ex
+                print("[!] Error while building Excel report")
+                logger.error("%s" % str(ex))
+    finally:
+        if workbook:
+            workbook.close()
+            if reportWriter['error'] is None:
+                print("[!] Excel spreadsheet saved to [%s]" % (outputFileName))
+
+def stop_report_writer(reportWriter):
+    reportWriter['queue'].put(None)
+    reportWriter['thread'].join()
+
+def map_results(executor, function, arguments, window):
+    # Like executor.map, yields in submission order but only keeps window tasks ahead of the consumer
+    arguments = iter(arguments)
+    pendingResults = collections.deque(executor.submit(function, *args) for args in itertools.islice(arguments, window))
+    while pendingResults:
+        result = pendingResults.popleft().result()
+        for args in itertools.islice(arguments, 1):
+            pendingResults.append(executor.submit(function, *args))
+        yield result
+
+def get_run_files(runPath):
+    # A run is a result directory, optionally followed by @<timestamp> (the latest run of the directory by default)
+    runDirectory, _, runTimestamp = runPath.partition("@")
+    if not os.path.isdir(runDirectory):
+        print("[!] Result directory [%s] does not exist!" % (runDirectory))
+        return None
+    runFiles = {}
+    for fileName in sorted(os.listdir(runDirectory)):
+        fileMatch = re.match(r"^(.+)_([0-9]{3,})_([0-9]{8}-[0-9]{6})\.csv$", fileName)
+        if fileMatch:
+            runFiles.setdefault(fileMatch.group(3), []).append((int(fileMatch.group(2)), fileMatch.group(1), os.path.join(runDirectory, fileName)))
+    if not runFiles:
+        print("[!] No result found in directory [%s]!" % (runDirectory))
+        return None
+    runTimestamp = runTimestamp or max(runFiles)
+    if runTimestamp not in runFiles:
+        print("[!] No run [%s] found in directory [%s]!" % (runTimestamp, runDirectory))
+        return None
+    # Templates are matched on their description, duplicates on their order in the run
+    resultFiles = {}
+    for queryIndex, description, fileName in sorted(runFiles[runTimestamp]):
+        occurrence = 1
+        while (description, occurrence) in resultFiles:
+            occurrence += 1
+        resultFiles[(description, occurrence)] = fileName
+    return runTimestamp, resultFiles
+
+def read_diff_rows(fileName):
+    # Rows are cut to the headers, result files of older runs end each row with a delimiter
+    with open(fileName, 'r', encoding="utf-8", newline='') as fi:
+        reader = csv.reader(fi, delimiter=';')
+        headerCount = len(next(reader, []))
+        for row in reader:
+            yield tuple(row[:headerCount])
+
+def get_result_headers(fileName):
+    with open(fileName, 'r', encoding="utf-8", newline='') as fi:
+        return next(csv.reader(fi, delimiter=';'), [])
+
+def get_row_bucket(row, bucketCount):
+    rowHash = hashlib.blake2b(";".join(row).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(rowHash, "big") % bucketCount
+
+def partition_result_file(fileName, bucketCount, bucketDirectory, prefix):
+    bucketFileNames = [os.path.join(bucketDirectory, "%s_%04d.csv" % (prefix, i)) for i in range(bucketCount)]
+    bucketFiles = [open(bucketFileName, 'w', encoding="utf-8", newline='') for bucketFileName in bucketFileNames]
+    try:
+        bucketWriters = [csv.writer(bucketFile, delimiter=';') for bucketFile in bucketFiles]
+        # Buckets are read back like result files, starting with the header line that read_diff_rows cuts rows to
+        headers = get_result_headers(fileName) if fileName else []
+        for bucketWriter in bucketWriters:
+            bucketWriter.writerow(headers)
+        if fileName:
+            for row in read_diff_rows(fileName):
+                bucketWriters[get_row_bucket(row, bucketCount)].writerow(row)
+    finally:
+        for bucketFile in bucketFiles:
+            bucketFile.close()
+    return bucketFileNames
+
+def diff_result_files(oldFileName, newFileName, diffFileName):
+    # Rows are hash partitioned into buckets small enough to be compared in memory, one bucket at a time
+    fileSize = max(os.path.getsize(fileName) for fileName in (oldFileName, newFileName) if fileName)
+    bucketCount = max(1, -(-fileSize // diffChunkSize))
+    headers = get_result_headers(newFileName or oldFileName)
+    diffCounts = {'old': 0, 'new': 0, 'added': 0, 'removed': 0}
+    diffFile = None
+    with tempfile.TemporaryDirectory(prefix="bloodcheck-diff-") as bucketDirectory:
+        if bucketCount > 1:
+            logger.info("Partitioning [%s] and [%s] into %s buckets" % (oldFileName, newFileName, bucketCount))
+            oldBuckets = partition_result_file(oldFileName, bucketCount, bucketDirectory, "old")
+            newBuckets = partition_result_file(newFileName, bucketCount, bucketDirectory, "new")
+        else:
+            oldBuckets = [oldFileName]
+            newBuckets = [newFileName]
+        try:
+            for oldBucket, newBucket in zip(oldBuckets, newBuckets):
+                oldRows = {}
+                if oldBucket:
+                    for row in read_diff_rows(oldBucket):
+                        oldRows[row] = oldRows.get(row, 0) + 1
+                        diffCounts['old'] += 1
+                changes = []
+                if newBucket:
+                    for row in read_diff_rows(newBucket):
+                        diffCounts['new'] += 1
+                        if oldRows.get(row, 0) > 0:
+                            oldRows[row] -= 1
+                        else:
+                            changes.append(("+",) + row)
+                            diffCounts['added'] += 1
+                for row, count in oldRows.items():
+                    changes.extend([("-",) + row] * count)
+                    diffCounts['removed'] += count
+                if changes:
+                    if diffFile is None:
+                        diffFile = open(diffFileName, 'w', encoding="utf-8", newline='')
+                        diffWriter = csv.writer(diffFile, delimiter=';')
+                        diffWriter.writerow(["Change"] + headers)
+                    diffWriter.writerows(changes)
+        finally:
+            if diffFile:
+                diffFile.close()
+    return diffCounts
+
+def diff_runs(oldRunPath, newRunPath, outputDirectory):
+    oldRun = get_run_files(oldRunPath)
+    newRun = get_run_files(newRunPath)
+    if not oldRun or not newRun:
+        return False
+    print("[+] Comparing run [%s] of [%s] with run [%s] of [%s]" % (oldRun[0], oldRunPath.partition("@")[0], newRun[0], newRunPath.partition("@")[0]))
+    diffDirectory = os.path.join(outputDirectory, "BloodCheck-Diff-" + sessionTimestamp)
+    os.makedirs(diffDirectory, exist_ok=True)
+    diffRows = []
+    resultKeys = list(oldRun[1]) + [resultKey for resultKey in newRun[1] if resultKey not in oldRun[1]]
+    for description, occurrence in resultKeys:
+        diffFileName = os.path.join(diffDirectory, description + ("" if occurrence == 1 else "_%s" % occurrence) + ".csv")
+        try:
+            diffCounts = diff_result_files(oldRun[1].get((description, occurrence)), newRun[1].get((description, occurrence)), diffFileName)
+        except Exception as ex:
+            print("[!] Error while comparing results of '%s'" % description)
+            logger.error("%s" % str(ex))
+            continue
+        diffRows.append([description, diffCounts['old'], diffCounts['new'], diffCounts['added'], diffCounts['removed']])
+    print(tabulate.tabulate(diffRows, headers=['Query', 'Old', 'New', 'Added', 'Removed'], tablefmt='github') + '\n')
+    print("[!] Added and removed rows saved to [%s]" % (diffDirectory))
+    return True
+
+def read_owned_file(ownedFile):
+    principals = []
+    with open(ownedFile, 'r', encoding="utf-8") as fi:
+        for line in fi:
+            stripLine = line.strip()
+            if stripLine == "":
+                continue
+            lineArray = stripLine.split(';')
+            principal = {'name': lineArray[0].upper(), 'wave': None}
+            if len(lineArray) > 1 and lineArray[1] != "":
+                principal['wave'] = lineArray[1].upper()
+            principals.append(principal)
+    return principals
+
+def run_owned_batches(session, CypherQuery, principals, batchSize, action):
+    # Principals are sent as a parameter list, one transaction per batch, so the query plan is cached by Neo4j
+    batchCount = (len(principals) + batchSize - 1) // batchSize
+    totalMatched = 0
+    totalUnmatched = 0
+    for batchIndex in range(batchCount):
+        batch = principals[batchIndex * batchSize:(batchIndex + 1) * batchSize]
+        batchNames = set(principal['name'] for principal in batch)
+        startTime = time.perf_counter()
+        tx = session.begin_transaction()
+        try:
+            # One row per label of the UNION
+            records = list(tx.run(CypherQuery, principals=batch))
+            tx.commit()
+        except Exception:
+            tx.rollback()
+            raise
+        elapsedTime = time.perf_counter() - startTime
+        matchedNames = set(name for record in records for name in record['matched'])
+        unmatchedNames = sorted(batchNames - matchedNames)
+        totalMatched += len(matchedNames)
+        totalUnmatched += len(unmatchedNames)
+        print("[+] Batch %s/%s: %s nodes %s, %s not found (%.2fs)" % (batchIndex + 1, batchCount, len(matchedNames), action, len(unmatchedNames), elapsedTime))
+        for node in unmatchedNames:
+            print("[!] [%s] node not found" % node)
+    return totalMatched, totalUnmatched
+
+def get_owned_query(ownedAction):
+    # Principals are matched on each label separately, so that every lookup is served by the name index of the label
+    return "\nUNION ALL\n".join("""
+UNWIND $principals AS principal
+MATCH (n:%s {name: principal.name})
+%s
+RETURN collect(DISTINCT principal.name) AS matched""" % (label, ownedAction) for label in ownedLabels) + "\n"
+
+def inject_owned(session, ownedFile, batchSize=1000):
+    print("[+] Injecting owned principales...")
+    principals = read_owned_file(ownedFile)
+    CypherQuery = get_owned_query("SET n.owned = true, n.wave = coalesce(principal.wave, n.wave)")
+    totalMatched, totalUnmatched = run_owned_batches(session, CypherQuery, principals, batchSize, "set as owned")
+    print("[+] %s nodes set as owned, %s not found" % (totalMatched, totalUnmatched))
+
+def undo_owned(session, ownedFile, batchSize=1000):
+    print("[+] Undoing owned principales injection...")
+    principals = read_owned_file(ownedFile)
+    CypherQuery = get_owned_query("REMOVE n.owned, n.wave")
+    totalMatched, totalUnmatched = run_owned_batches(session, CypherQuery, principals, batchSize, "reset")
+    print("[+] %s nodes reset, %s not found" % (totalMatched, totalUnmatched))
+
+def wipe_owned(session):
+    print("[+] Wiping owned principales...")
+    if confirmation():
+        run_cypher_query(session, "MATCH (n) REMOVE n.owned,n.wave")
+        print("[+] All owned principales wiped")
+    else:
+        print("[!] Action aborted!")
+
+def get_ingest_files(ingestPaths):
+    # Collections are SharpHound JSON files, zip archives of JSON files or directories of both
+    ingestFiles = []
+    for ingestPath in ingestPaths:
+        if os.path.isdir(ingestPath):
+            ingestFiles.extend(get_ingest_files(sorted(os.path.join(ingestPath, fileName) for fileName in os.listdir(ingestPath) if fileName.lower().endswith((".json", ".zip")))))
+        elif ingestPath.lower().endswith(".zip"):
+            with zipfile.ZipFile(ingestPath) as zipFile:
+                for memberName in sorted(zipFile.namelist()):
+                    if memberName.lower().endswith(".json"):
+                        ingestFiles.append((ingestPath, memberName))
+        else:
+            ingestFiles.append((ingestPath, None))
+    return ingestFiles
+
+def read_ingest_items(ingestPath, memberName=None, chunkSize=1024 * 1024):
+    # Incremental parser: the file is read by chunks and only the current object of the data array is decoded,
+    # so that memory usage does not depend on the size of the collection
+    ingestName = memberName or ingestPath
+    with contextlib.ExitStack() as stack:
+        if memberName is None:
+            binaryFile = stack.enter_context(open(ingestPath, 'rb'))
+        else:
+            binaryFile = stack.enter_context(stack.enter_context(zipfile.ZipFile(ingestPath)).open(memberName))
+        textFile = io.TextIOWrapper(binaryFile, encoding="utf-8-sig")
+        decoder = json.JSONDecoder()
+        state = {'buffer': "", 'position': 0, 'eof': False}
+
+        def fill():
+            if state['position'] > chunkSize:
+                state['buffer'] = state['buffer'][state['position']:]
+                state['position'] = 0
+            chunk = textFile.read(chunkSize)
+            state['eof'] = chunk == ""
+            state['buffer'] += chunk
+            return not state['eof']
+
+        def next_char():
+            # Skips whitespaces and returns the next character without consuming it
+            while True:
+                while state['position'] < len(state['buffer']) and state['buffer'][state['position']].isspace():
+                    state['position'] += 1
+                if state['position'] < len(state['buffer']):
+                    return state['buffer'][state['position']]
+                if not fill():
+                    raise ValueError("unexpected end of file")
+
+        def next_value():
+            next_char()
+            while True:
+                try:
+                    value, end = decoder.raw_decode(state['buffer'], state['position'])
+                    # A number may continue in the next chunk
+                    if end < len(state['buffer']) or state['eof'] or isinstance(value, (str, list, dict)):
+                        state['position'] = end
+                        return value
+                except json.JSONDecodeError:
+                    if state['eof']:
+                        raise
+                fill()
+
+        def expect(character):
+            if next_char() != character:
+                raise ValueError("expected '%s' at offset %s" % (character, state['position']))
+            state['position'] += 1
+
+        fileMatch = re.search(r"([a-z]+)\.json$", os.path.basename(ingestName).lower())
+        objectType = fileMatch.group(1) if fileMatch else None
+        expect("{")
+        while next_char() != "}":
+            if next_char() == ",":
+                state['position'] += 1
+            key = next_value()
+            expect(":")
+            if (key == "data" or key in ingestTypes) and next_char() == "[":
+                # BloodHound 3 collections store the objects under their type, later ones under data
+                if key != "data":
+                    objectType = key
+                if objectType not in ingestTypes:
+                    raise ValueError("unknown collection type '%s'" % objectType)
+                state['position'] += 1
+                while next_char() != "]":
+                    if next_char() == ",":
+                        state['position'] += 1
+                        continue
+                    yield objectType, next_value()
+                state['position'] += 1
+            else:
+                value = next_value()
+                if key == "meta" and isinstance(value, dict) and value.get('type') in ingestTypes:
+                    objectType = value['type']
+
+def get_ingest_id(member, idKey="ObjectIdentifier", typeKey="ObjectType"):
+    # Members are {MemberId, MemberType} in BloodHound 3 collections and {ObjectIdentifier, ObjectType} in later ones
+    if isinstance(member, str):
+        return None, member.upper()
+    memberId = member.get(idKey) or member.get("MemberId") or member.get("ObjectIdentifier")
+    memberType = member.get(typeKey) or member.get("MemberType") or member.get("ObjectType")
+    return ingestLabels.get(str(memberType).lower()), memberId.upper() if memberId else None
+
+def get_ingest_results(value):
+    # Computer collections are lists in BloodHound 3 and {Results, Collected} objects in later versions
+    if isinstance(value, dict):
+        return value.get("Results") or []
+    return value or []
+
+def get_ace_type(ace):
+    rightName = ace.get("RightName")
+    # BloodHound 3 collections give extended rights and written properties by their name
+    if rightName in ("ExtendedRight", "WriteProperty"):
+        return ingestAceTypes.get(ace.get("AceType"), ace.get("AceType"))
+    return rightName
+
+def get_ingest_properties(properties):
+    # Neo4j properties can't be maps, nor lists of mixed or null values
+    ingestProperties = {}
+    for key, value in (properties or {}).items():
+        if isinstance(value, dict):
+            continue
+        if isinstance(value, list) and (None in value or len(set(type(item) for item in value)) > 1):
+            value = [str(item) for item in value if item is not None]
+        ingestProperties[key.lower()] = value
+    return ingestProperties
+
+def get_ingest_rows(objectType, item):
+    # Each object gives its node and the relationships it holds, as (label, objectid, properties)
+    # and (source label, type, target label, source objectid, target objectid, properties) rows
+    label = ingestTypes[objectType]
+    objectId = (item.get("ObjectIdentifier") or item.get("Properties", {}).get("objectid") or "").upper()
+    if not objectId:
+        return [], []
+    properties = get_ingest_properties(item.get("Properties"))
+    properties['objectid'] = objectId
+    nodes = [(label, objectId, properties)]
+    edges = []
+
+    def add_edge(sourceLabel, edgeType, targetLabel, sourceId, targetId, edgeProperties=None):
+        if sourceLabel and targetLabel and sourceId and targetId and edgeType and re.match(r"^[A-Za-z]+$", edgeType):
+            edges.append((sourceLabel, edgeType, targetLabel, sourceId.upper(), targetId.upper(), edgeProperties or {}))
+
+    for ace in item.get("Aces") or []:
+        principalLabel, principalId = get_ingest_id(ace, "PrincipalSID", "PrincipalType")
+        add_edge(principalLabel, get_ace_type(ace), label, principalId, objectId, {'isacl': True, 'isinherited': bool(ace.get("IsInherited"))})
+    if item.get("PrimaryGroupSID"):
+        add_edge(label, "MemberOf", "Group", objectId, item["PrimaryGroupSID"], {'isacl': False})
+    for member in item.get("Members") or []:
+        memberLabel, memberId = get_ingest_id(member)
+        add_edge(memberLabel, "MemberOf", label, memberId, objectId, {'isacl': False})
+    for edgeType, localGroup in (("AdminTo", "LocalAdmins"), ("CanRDP", "RemoteDesktopUsers"), ("ExecuteDCOM", "DcomUsers"), ("CanPSRemote", "PSRemoteUsers")):
+        for member in get_ingest_results(item.get(localGroup)):
+            memberLabel, memberId = get_ingest_id(member)
+            add_edge(memberLabel, edgeType, label, memberId, objectId, {'isacl': False, 'fromgpo': False})
+    for sessionKey in ("Sessions", "PrivilegedSessions", "RegistrySessions"):
+        for session in get_ingest_results(item.get(sessionKey)):
+            add_edge("Computer", "HasSession", "User", session.get("ComputerSID") or session.get("ComputerId") or objectId, session.get("UserSID") or session.get("UserId"), {'isacl': False})
+    for delegate in item.get("AllowedToDelegate") or []:
+        delegateLabel, delegateId = get_ingest_id(delegate)
+        add_edge(label, "AllowedToDelegate", delegateLabel or "Computer", objectId, delegateId, {'isacl': False})
+    for principal in item.get("AllowedToAct") or []:
+        principalLabel, principalId = get_ingest_id(principal)
+        add_edge(principalLabel, "AllowedToAct", label, principalId, objectId, {'isacl': False})
+    for principal in item.get("HasSIDHistory") or []:
+        principalLabel, principalId = get_ingest_id(principal)
+        add_edge(label, "HasSIDHistory", principalLabel, objectId, principalId, {'isacl': False})
+    for target in item.get("SPNTargets") or []:
+        add_edge(label, target.get("Service"), "Computer", objectId, target.get("ComputerSID"), {'isacl': False, 'port': target.get("Port")})
+    for containedKey, containedLabel in (("Users", "User"), ("Computers", "Computer"), ("ChildOus", "OU")):
+        for containedId in item.get(containedKey) or []:
+            add_edge(label, "Contains", containedLabel, objectId, containedId, {'isacl': False})
+    for child in item.get("ChildObjects") or []:
+        childLabel, childId = get_ingest_id(child)
+        add_edge(label, "Contains", childLabel, objectId, childId, {'isacl': False})
+    for link in item.get("Links") or []:
+        add_edge("GPO", "GpLink", label, link.get("Guid") or link.get("GUID"), objectId, {'isacl': False, 'enforced': bool(link.get("IsEnforced"))})
+    for trust in item.get("Trusts") or []:
+        targetId = trust.get("TargetDomainSid") or trust.get("TargetDomainName")
+        trustDirection = str(trust.get("TrustDirection")).lower()
+        trustProperties = {'isacl': False, 'sidfiltering': trust.get("SidFilteringEnabled"), 'trusttype': str(trust.get("TrustType")), 'transitive': trust.get("IsTransitive")}
+        if trustDirection in ("1", "3", "inbound", "bidirectional"):
+            add_edge("Domain", "TrustedBy", "Domain", objectId, targetId, trustProperties)
+        if trustDirection in ("2", "3", "outbound", "bidirectional"):
+            add_edge("Domain", "TrustedBy", "Domain", targetId, objectId, trustProperties)
+    return nodes, edges
+
+def get_ingest_query(batchKey):
+    # Labels and relationship types can't be parameters, so there is one query per kind of row
+    if batchKey[0] == "node":
+        return "UNWIND $rows AS row MERGE (n:%s {objectid: row.objectid}) SET n += row.properties" % batchKey[1]
+    return "UNWIND $rows AS row MERGE (s:%s {objectid: row.source}) MERGE (t:%s {objectid: row.target}) MERGE (s)-[r:%s]->(t) SET r += row.properties" % (batchKey[1], batchKey[3], batchKey[2])
+
+def write_ingest_batch(driver, batchKey, rows, retries=5):
+    # Parallel batches may deadlock on shared nodes (e.g. Domain Users), transient errors are retried with a backoff
+    CypherQuery = get_ingest_query(batchKey)
+    for attempt in range(retries + 1):
+        try:
+            with driver.session() as session:
+                tx = session.begin_transaction()
+                try:
+                    tx.run(CypherQuery, rows=rows).consume()
+                    tx.commit()
+                except Exception:
+                    tx.rollback()
+                    raise
+            return len(rows)
+        except neo4j.exceptions.TransientError as ex:
+            if attempt == retries:
+                raise
+            logger.info("Retrying ingestion batch [%s] after a transient error: %s" % (" ".join(batchKey), str(ex)))
+            time.sleep(0.1 * 2 ** attempt + random.random() * 0.1)
+
+def create_ingest_constraints(driver):
+    # MERGE on objectid is an index seek, and safe between parallel sessions, once objectid is unique for each label
+    with driver.session() as session:
+        for label in sorted(set(ingestTypes.values())):
+            try:
+                session.run("CREATE CONSTRAINT ON (n:%s) ASSERT n.objectid IS UNIQUE" % label).consume()
+            except Exception:
+                try:
+                    session.run("CREATE CONSTRAINT IF NOT EXISTS FOR (n:%s) REQUIRE n.objectid IS UNIQUE" % label).consume()
+                except Exception as ex:
+                    print("[!] Error while creating the objectid constraint on [%s]" % label)
+                    logger.warning("%s" % str(ex))
+
+def ingest_collections(driver, ingestPaths, batchSize=1000, workers=1):
+    try:
+        ingestFiles = get_ingest_files(ingestPaths)
+    except Exception as ex:
+        print("[!] Error while listing the collection files")
+        logger.error("%s" % str(ex))
+        return False
+    if not ingestFiles:
+        print("[!] No collection file found!")
+        return False
+    print("[+] Ingesting %s collection {files}...".format(files="files" if len(ingestFiles) > 1 else "file") % len(ingestFiles))
+    create_ingest_constraints(driver)
+    startTime = time.perf_counter()
+    totals = {'objects': 0, 'nodes': 0, 'relationships': 0}
+    # Batches are written by parallel sessions, at most a few batches per worker are waiting to be written.
+    # Relationships are written as soon as their batch is full: MERGE creates their missing nodes, which are completed by the node batches.
+    executor = futures.ThreadPoolExecutor(max_workers=max(1, workers))
+    pendingBatches = collections.deque()
+
+    def submit_batch(batchKey, rows):
+        while len(pendingBatches) >= 2 * max(1, workers):
+            pendingBatches.popleft().result()
+        pendingBatches.append(executor.submit(write_ingest_batch, driver, batchKey, rows))
+
+    try:
+        for ingestPath, memberName in ingestFiles:
+            ingestName = memberName or ingestPath
+            fileStartTime = time.perf_counter()
+            fileCounts = {'objects': 0, 'nodes': 0, 'relationships': 0}
+            batches = {}
+            try:
+                for objectType, item in read_ingest_items(ingestPath, memberName):
+                    nodes, edges = get_ingest_rows(objectType, item)
+                    rows = [(("node", nodeLabel), {'objectid': objectId, 'properties': properties}) for nodeLabel, objectId, properties in nodes]
+                    rows.extend((("edge", sourceLabel, edgeType, targetLabel), {'source': sourceId, 'target': targetId, 'properties': properties}) for sourceLabel, edgeType, targetLabel, sourceId, targetId, properties in edges)
+                    for batchKey, row in rows:
+                        batches.setdefault(batchKey, []).append(row)
+                        if len(batches[batchKey]) >= batchSize:
+                            submit_batch(batchKey, batches.pop(batchKey))
+                    fileCounts['objects'] += 1
+                    fileCounts['nodes'] += len(nodes)
+                    fileCounts['relationships'] += len(edges)
+                for batchKey, rows in batches.items():
+                    submit_batch(batchKey, rows)
+                while pendingBatches:
+                    pendingBatches.popleft().result()
+            except Exception as ex:
+                print("[!] Error while ingesting collection file [%s]" % ingestName)
+                logger.error("%s" % str(ex))
+                while pendingBatches:
+                    pendingBatches.popleft().cancel()
+                continue
+            fileTime = time.perf_counter() - fileStartTime
+            for countKey in totals:
+                totals[countKey] += fileCounts[countKey]
+            print("[+] [%s] %s objects, %s nodes and %s relationships written in %.1f seconds (%.0f rows/s)" % (ingestName, fileCounts['objects'], fileCounts['nodes'], fileCounts['relationships'], fileTime, (fileCounts['nodes'] + fileCounts['relationships']) / max(fileTime, 1e-6)))
+    finally:
+        executor.shutdown(wait=True)
+    totalTime = time.perf_counter() - startTime
+    print("[+] %s objects ingested: %s nodes and %s relationships written in %.1f seconds (%.0f rows/s)" % (totals['objects'], totals['nodes'], totals['relationships'], totalTime, (totals['nodes'] + totals['relationships']) / max(totalTime, 1e-6)))
+    return True
+
+def run_closure_batches(session, CypherQuery, nodeIds, batchSize):
+    totalCreated = 0
+    for batchIndex in range(0, len(nodeIds), batchSize):
+        tx = session.begin_transaction()
+        try:
+            record = tx.run(CypherQuery, nodeIds=nodeIds[batchIndex:batchIndex + batchSize]).single()
+            tx.commit()
+        except Exception:
+            tx.rollback()
+            raise
+        totalCreated += record['created'] if record else 0
+    return totalCreated
+
+def drop_admin_closure(driver):
+    # Removes the BloodCheckMemberOf and BloodCheckAdminTo relationships, including those left by an interrupted run
+    droppedCount = 0
+    try:
+        with driver.session() as session:
+            deletedCount = 1
+            while deletedCount:
+                deletedCount = session.run("MATCH ()-[r:BloodCheckMemberOf|BloodCheckAdminTo]->() WITH r LIMIT 10000 DELETE r RETURN count(r) AS deleted").single()['deleted']
+                droppedCount += deletedCount
+        return droppedCount
+    except Exception as ex:
+        print("[!] Error while removing admin closure, remove it using MATCH ()-[r:BloodCheckMemberOf|BloodCheckAdminTo]->() DELETE r")
+        logger.error("%s" % str(ex))
+        return None
+
+def build_admin_closure(driver, batchSize=1000):
+    # Group membership and admin rights closures are written as BloodCheckMemberOf and BloodCheckAdminTo relationships
+    # for the duration of the run only, and removed with drop_admin_closure once the queries completed
+    try:
+        staleCount = drop_admin_closure(driver)
+        if staleCount is None:
+            return False
+        if staleCount:
+            print("[!] Removed %s closure relationships left by a previous run" % (staleCount))
+        print("[+] Precomputing admin closure...")
+        startTime = time.perf_counter()
+        with driver.session() as session:
+            memberIds = [record['nodeId'] for record in session.run("MATCH (n)-[:MemberOf]->() RETURN DISTINCT id(n) AS nodeId")]
+            memberCount = run_closure_batches(session, """
+UNWIND $nodeIds AS nodeId
+MATCH (n) WHERE id(n) = nodeId
+MATCH (n)-[:MemberOf*1..]->(g:Group)
+WITH DISTINCT n, g
+CREATE (n)-[:BloodCheckMemberOf]->(g)
+RETURN count(*) AS created
+""", memberIds, batchSize)
+            adminIds = [record['nodeId'] for record in session.run("MATCH (n)-[:MemberOf|AdminTo]->() RETURN DISTINCT id(n) AS nodeId")]
+            adminCount = run_closure_batches(session, """
+UNWIND $nodeIds AS nodeId
+MATCH (n) WHERE id(n) = nodeId
+MATCH (n)-[:MemberOf|AdminTo*1..]->(c:Computer)
+WITH DISTINCT n, c
+CREATE (n)-[:BloodCheckAdminTo]->(c)
+RETURN count(*) AS created
+""", adminIds, batchSize)
+        print("[+] Admin closure built in %.1f seconds: %s memberships, %s admin rights" % (time.perf_counter() - startTime, memberCount, adminCount))
+        return True
+    except Exception as ex:
+        print("[!] Error while precomputing admin closure, templates will run their own traversals")
+        logger.error("%s" % str(ex))
+        drop_admin_closure(driver)
+        return False
+
+def get_closure_queries(cypherQueries):
+    # Templates providing a ClosureQuery read the precomputed closure instead of traversing the graph
+    closureQueries = []
+    for cypherYaml in cypherQueries:
+        if cypherYaml.get('ClosureQuery'):
+            cypherYaml = dict(cypherYaml, Query=cypherYaml['ClosureQuery'])
+            cypherYaml.pop('Partition', None)
+        closureQueries.append(cypherYaml)
+    return closureQueries
+
+def get_estimate_queries(cypherQueries):
+    # Only templates providing an Estimate section are run, with the statistics headers unless they read the count store
+    estimateQueries = []
+    for cypherYaml in cypherQueries:
+        if not cypherYaml.get('Estimate'):
+            logger.info("No estimate for query [%s]" % cypherYaml['Description'].strip())
+            continue
+        if cypherYaml['Estimate'].get('CountStore'):
+            estimateQueries.append(dict(cypherYaml))
+        else:
+            estimateQueries.append(dict(cypherYaml, Description=cypherYaml['Description'].strip() + " (estimate)", Headers=estimateHeaders))
+        estimateQueries[-1].pop('Partition', None)
+    if len(estimateQueries) < len(cypherQueries):
+        print("[!] %s {queries} without an Estimate section skipped".format(queries="queries" if len(cypherQueries) - len(estimateQueries) > 1 else "query") % (len(cypherQueries) - len(estimateQueries)))
+    return estimateQueries
+
+def run_estimate_query(session, cypherYaml, queryDeadline=None):
+    # The population size is read from the count store and the nodes are sampled with a label scan, without reading their properties.
+    # The estimate query then only runs on the sampled node ids, and returns one row per matching node.
+    estimateSpec = cypherYaml['Estimate']
+    if estimateSpec.get('CountStore'):
+        return get_label_counts(session, cypherYaml['Headers'], queryDeadline)
+    label = estimateSpec['Population'].replace('`', '``')
+    population = session.run(get_timed_query("MATCH (n:`%s`) RETURN count(n) AS count" % label, queryDeadline)).single()['count']
+    targetSize = min(estimateSpec.get('Sample', sampleSize), population)
+    nodeIds = []
+    if targetSize:
+        # Slightly oversampled, so that the sample rarely ends up smaller than requested
+        samplingRate = min(1.0, 1.2 * targetSize / population)
+        nodeIds = [record['nodeId'] for record in session.run(get_timed_query("MATCH (n:`%s`) WHERE rand() < $rate RETURN id(n) AS nodeId" % label, queryDeadline), rate=samplingRate)]
+        if len(nodeIds) > targetSize:
+            nodeIds = random.sample(nodeIds, targetSize)
+    statistics = {}
+    if nodeIds:
+        results = session.run(get_timed_query(estimateSpec['Query'], queryDeadline), sample=nodeIds)
+        for statisticName in results.keys():
+            if statisticName != 'node':
+                statistics[statisticName] = {}
+        for record in results:
+            for statisticName in statistics:
+                statistics[statisticName][record['node']] = record[statisticName]
+    logger.info("Estimating query [%s] on %s of %s nodes" % (cypherYaml['Description'].strip(), len(nodeIds), population))
+    return get_estimate_records(statistics, len(nodeIds), population, estimateSpec.get('Proportions', []))
+
+def get_label_counts(session, headers, queryDeadline=None):
+    # Node counts by label are kept in the count store, so that they are read without scanning the nodes
+    labels = [record['label'] for record in session.run(get_timed_query("CALL db.labels() YIELD label RETURN label", queryDeadline))]
+    return [{headers[0]: label, headers[1]: session.run(get_timed_query("MATCH (n:`%s`) RETURN count(n) AS count" % label.replace('`', '``'), queryDeadline)).single()['count']} for label in sorted(labels)]
+
+def get_estimate_records(statistics, sampleCount, population, proportions=()):
+    # Sampled nodes without a row count as false or 0. Boolean statistics are estimated as proportions with a Wilson interval,
+    # numeric ones as means with a normal interval, both with a finite population correction.
+    # Without any value, the statistics listed in the Proportions section of the template are still proportions.
+    zScore = estimateZScores[estimateConfidence]
+    populationCorrection = math.sqrt((population - sampleCount) / (population - 1)) if population > 1 else 0.0
+    records = []
+    for statisticName, nodeValues in statistics.items():
+        values = [value for value in nodeValues.values() if value is not None]
+        if sampleCount == 0:
+            records.append(get_estimate_record(statisticName, 0.0, 0.0, 0.0, sampleCount, population))
+        elif all(isinstance(value, bool) for value in values) if values else statisticName in proportions:
+            proportion = sum(values) / sampleCount
+            center = (proportion + zScore ** 2 / (2 * sampleCount)) / (1 + zScore ** 2 / sampleCount)
+            margin = zScore / (1 + zScore ** 2 / sampleCount) * math.sqrt(proportion * (1 - proportion) / sampleCount + zScore ** 2 / (4 * sampleCount ** 2))
+            # The correction narrows the interval around the sample proportion, down to it when all the nodes are sampled
+            lowerBound = proportion - (proportion - max(0.0, center - margin)) * populationCorrection
+            upperBound = proportion + (min(1.0, center + margin) - proportion) * populationCorrection
+            records.append(get_estimate_record(statisticName + " (%)", 100 * proportion, 100 * lowerBound, 100 * upperBound, sampleCount, population))
+            records.append(get_estimate_record(statisticName + " (count)", population * proportion, population * lowerBound, population * upperBound, sampleCount, population))
+        else:
+            mean = sum(values) / sampleCount
+            variance = (sum(value ** 2 for value in values) - sampleCount * mean ** 2) / (sampleCount - 1) if sampleCount > 1 else 0.0
+            margin = zScore * math.sqrt(max(variance, 0.0) / sampleCount) * populationCorrection
+            records.append(get_estimate_record(statisticName + " (mean)", mean, mean - margin, mean + margin, sampleCount, population))
+            records.append(get_estimate_record(statisticName + " (total)", population * mean, population * (mean - margin), population * (mean + margin), sampleCount, population))
+    return records
+
+def get_estimate_record(statisticName, estimate, lowerBound, upperBound, sampleCount, population):
+    return dict(zip(estimateHeaders, (statisticName, round(estimate, 2), round(lowerBound, 2), round(upperBound, 2), sampleCount, population)))
+
+def build_local_graph(nodes, edges):
+    # Nodes are (labels, properties) and edges are (source index, type, target index),
+    # labels are stored as boolean masks and relationships as numpy arrays per type
+    nodeCount = len(nodes)
+    properties = []
+    labelNodes = {}
+    for nodeIndex, (labels, nodeProperties) in enumerate(nodes):
+        properties.append(nodeProperties)
+        for label in labels:
+            labelNodes.setdefault(label, []).append(nodeIndex)
+    labelMasks = {}
+    for label, nodeIndexes in labelNodes.items():
+        labelMasks[label] = np.zeros(nodeCount, dtype=bool)
+        labelMasks[label][nodeIndexes] = True
+    edgeLists = {}
+    for sourceIndex, edgeType, targetIndex in edges:
+        edgeList = edgeLists.setdefault(edgeType, ([], []))
+        edgeList[0].append(sourceIndex)
+        edgeList[1].append(targetIndex)
+    edgeArrays = dict((edgeType, (np.array(sources, dtype=np.int64), np.array(targets, dtype=np.int64))) for edgeType, (sources, targets) in edgeLists.items())
+    return {'nodeCount': nodeCount, 'properties': properties, 'labels': labelMasks, 'edges': edgeArrays, 'adjacency': {}}
+
+def get_local_graph(graphFile):
+    # The daemon keeps the last loaded graph of each file, until the file changes
+    if daemonState is None:
+        return load_local_graph(graphFile)
+    fileStat = os.stat(graphFile)
+    graphKey = os.path.realpath(graphFile)
+    graphVersion = (fileStat.st_mtime_ns, fileStat.st_size)
+    if graphKey in daemonState['localGraphs'] and daemonState['localGraphs'][graphKey][0] == graphVersion:
+        print("[+] Using loaded graph [%s]" % (graphFile))
+        return daemonState['localGraphs'][graphKey][1]
+    graph = load_local_graph(graphFile)
+    if graph:
+        daemonState['localGraphs'][graphKey] = (graphVersion, graph)
+    return graph
+
+def load_local_graph(graphFile):
+    if np is None:
+        print("[!] The numpy package is required by the local engine")
+        return False
+    try:
+        print("[+] Loading graph [%s]..." % (graphFile))
+        startTime = time.perf_counter()
+        with open(graphFile, 'r', encoding="utf-8") as fi:
+            graphData = json.load(fi)
+        nodes = [(node['labels'] if 'labels' in node else [node['label']], node.get('properties', {})) for node in graphData['nodes']]
+        edges = [(edge['source'], edge['type'], edge['target']) for edge in graphData['edges']]
+        graph = build_local_graph(nodes, edges)
+        print("[+] %s nodes and %s relationships loaded in %.1f seconds" % (len(nodes), len(edges), time.perf_counter() - startTime))
+        return graph
+    except Exception as ex:
+        print("[!] Error while loading graph [%s]" % (graphFile))
+        logger.error("%s" % str(ex))
+        return False
+
+def export_local_graph(driver, graphFile):
+    # One bulk pull of all nodes and relationships, in the format read by load_local_graph
+    try:
+        print("[+] Exporting graph to [%s]..." % (graphFile))
+        with driver.session() as session:
+            nodes = []
+            nodeIndexes = {}
+            for record in session.run("MATCH (n) RETURN id(n) AS nodeId, labels(n) AS labels, properties(n) AS properties"):
+                nodeIndexes[record['nodeId']] = len(nodes)
+                nodes.append({'labels': record['labels'], 'properties': record['properties']})
+            edges = []
+            for record in session.run('MATCH (a)-[r]->(b) WHERE NOT type(r) STARTS WITH "BloodCheck" RETURN id(a) AS sourceId, type(r) AS type, id(b) AS targetId'):
+                edges.append({'source': nodeIndexes[record['sourceId']], 'type': record['type'], 'target': nodeIndexes[record['targetId']]})
+        with open(graphFile, 'w', encoding="utf-8") as fo:
+            json.dump({'nodes': nodes, 'edges': edges}, fo, default=str)
+        print("[+] %s nodes and %s relationships exported" % (len(nodes), len(edges)))
+        return True
+    except Exception as ex:
+        print("[!] Error while exporting graph")
+        logger.error("%s" % str(ex))
+        return False
+
+def get_local_adjacency(localGraph, edgeTypes, reverse=False):
+    # Compressed sparse rows (indptr, indices) of the given relationship types, built once per graph
+    adjacencyKey = (edgeTypes, reverse)
+    if adjacencyKey not in localGraph['adjacency']:
+        edgeArrays = [localGraph['edges'][edgeType] for edgeType in edgeTypes if edgeType in localGraph['edges']]
+        sources = np.concatenate([edgeArray[1 if reverse else 0] for edgeArray in edgeArrays] or [np.zeros(0, dtype=np.int64)])
+        targets = np.concatenate([edgeArray[0 if reverse else 1] for edgeArray in edgeArrays] or [np.zeros(0, dtype=np.int64)])
+        indptr = np.zeros(localGraph['nodeCount'] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=localGraph['nodeCount']), out=indptr[1:])
+        localGraph['adjacency'][adjacencyKey] = (indptr, targets[np.argsort(sources, kind='stable')])
+    return localGraph['adjacency'][adjacencyKey]
+
+def expand_local(indptr, indices, nodes):
+    # Neighbors of each node, with the position of the node they come from
+    starts = indptr[nodes]
+    counts = indptr[nodes + 1] - starts
+    rowPositions = np.repeat(np.arange(len(nodes)), counts)
+    offsets = np.arange(len(rowPositions)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return rowPositions, indices[np.repeat(starts, counts) + offsets]
+
+def get_local_closure(indptr, indices, startNodes, nodeCount, includeStart=False):
+    # Breadth-first search from all the start nodes at once, over (start position, node) pairs encoded as integers
+    startPositions = np.arange(len(startNodes), dtype=np.int64)
+    frontierPositions, frontierNodes = startPositions, startNodes
+    visitedKeys = startPositions * nodeCount + startNodes if includeStart else np.zeros(0, dtype=np.int64)
+    while len(frontierNodes):
+        rowPositions, neighbors = expand_local(indptr, indices, frontierNodes)
+        pairKeys = np.unique(frontierPositions[rowPositions] * nodeCount + neighbors)
+        pairKeys = pairKeys[~np.isin(pairKeys, visitedKeys, assume_unique=True)]
+        visitedKeys = np.union1d(visitedKeys, pairKeys)
+        frontierPositions, frontierNodes = pairKeys // nodeCount, pairKeys % nodeCount
+    return visitedKeys // nodeCount, visitedKeys % nodeCount
+
+def parse_local_pattern(pattern, patternIndex=0):
+    # (a:Label)-[Type1|Type2]->(b)<-[Type*]-(:Label), * follows one or more relationships and *0.. zero or more
+    nodes = []
+    relationships = []
+    pattern = pattern.strip()
+    position = 0
+    while True:
+        nodeMatch = re.compile(r"\((\w*)(?::(\w+))?\)").match(pattern, position)
+        if not nodeMatch:
+            raise ValueError("invalid pattern '%s'" % pattern)
+        nodes.append((nodeMatch.group(1) or "_%s_%s" % (patternIndex, len(nodes)), nodeMatch.group(2)))
+        position = nodeMatch.end()
+        if position == len(pattern):
+            return nodes, relationships
+        relationshipMatch = re.compile(r"(<?-)\[([\w|]+)(\*(?:0\.\.)?)?\](->|-)").match(pattern, position)
+        if not relationshipMatch or (relationshipMatch.group(1) == "<-") == (relationshipMatch.group(4) == "->"):
+            raise ValueError("invalid pattern '%s'" % pattern)
+        relationships.append({'types': tuple(relationshipMatch.group(2).split("|")), 'reverse': relationshipMatch.group(1) == "<-", 'closure': relationshipMatch.group(3)})
+        position = relationshipMatch.end()
+
+def parse_local_filter(localFilter):
+    filterMatch = re.match(r"^(NOT\s+)?(\w+)\.(\w+)\s+(IS\s+NULL|IS\s+NOT\s+NULL|=~|<>|=|CONTAINS|STARTS\s+WITH|ENDS\s+WITH)\s*(.*)$", localFilter.strip(), re.IGNORECASE)
+    if not filterMatch:
+        raise ValueError("invalid filter '%s'" % localFilter)
+    operator = " ".join(filterMatch.group(4).upper().split())
+    value = None if operator in ("IS NULL", "IS NOT NULL") else json.loads(filterMatch.group(5))
+    if operator == "=~":
+        value = re.compile(value)
+    return {'negate': bool(filterMatch.group(1)), 'alias': filterMatch.group(2), 'property': filterMatch.group(3), 'operator': operator, 'value': value}
+
+def evaluate_local_filter(localFilter, value):
+    # Three-valued logic as in Cypher: comparing null gives null, and only true keeps the row
+    operator = localFilter['operator']
+    filterValue = localFilter['value']
+    if operator == "IS NULL":
+        result = value is None
+    elif operator == "IS NOT NULL":
+        result = value is not None
+    elif value is None:
+        result = None
+    elif operator in ("=", "<>"):
+        result = isinstance(value, bool) == isinstance(filterValue, bool) and value == filterValue
+        if operator == "<>":
+            result = not result
+    elif not isinstance(value, str):
+        result = None
+    elif operator == "=~":
+        result = filterValue.fullmatch(value) is not None
+    elif operator == "CONTAINS":
+        result = filterValue in value
+    elif operator == "STARTS WITH":
+        result = value.startswith(filterValue)
+    else:
+        result = value.endswith(filterValue)
+    if localFilter['negate'] and result is not None:
+        result = not result
+    return result is True
+
+def select_local_rows(bindings, rows):
+    return dict((alias, column[rows]) for alias, column in bindings.items())
+
+def apply_local_filters(localGraph, bindings, pendingFilters):
+    # Filters are applied as soon as their node is bound, to keep the intermediate tables small
+    for localFilter in [localFilter for localFilter in pendingFilters if localFilter['alias'] in bindings]:
+        uniqueNodes, inverse = np.unique(bindings[localFilter['alias']], return_inverse=True)
+        nodeMask = np.array([evaluate_local_filter(localFilter, localGraph['properties'][node].get(localFilter['property'])) for node in uniqueNodes], dtype=bool)
+        bindings = select_local_rows(bindings, nodeMask[inverse.reshape(-1)])
+        pendingFilters.remove(localFilter)
+    return bindings
+
+def get_label_mask(localGraph, label):
+    return localGraph['labels'].get(label, np.zeros(localGraph['nodeCount'], dtype=bool))
+
+def match_local_pattern(localGraph, bindings, pattern, pendingFilters, patternIndex=0):
+    # The bindings table holds one node index array per alias, one row per match
+    nodes, relationships = parse_local_pattern(pattern, patternIndex)
+    if nodes[0][0] not in bindings and nodes[-1][0] in bindings:
+        # Patterns are followed from their bound end
+        nodes = nodes[::-1]
+        relationships = [dict(relationship, reverse=not relationship['reverse']) for relationship in relationships[::-1]]
+    alias, label = nodes[0]
+    if alias not in bindings:
+        nodeIndexes = np.flatnonzero(get_label_mask(localGraph, label)) if label else np.arange(localGraph['nodeCount'])
+        rowCount = len(next(iter(bindings.values()))) if bindings else 1
+        bindings = dict((boundAlias, np.repeat(column, len(nodeIndexes))) for boundAlias, column in bindings.items())
+        bindings[alias] = np.tile(nodeIndexes, rowCount)
+    elif label:
+        bindings = select_local_rows(bindings, get_label_mask(localGraph, label)[bindings[alias]])
+    bindings = apply_local_filters(localGraph, bindings, pendingFilters)
+    for relationship, (nextAlias, nextLabel) in zip(relationships, nodes[1:]):
+        indptr, indices = get_local_adjacency(localGraph, relationship['types'], relationship['reverse'])
+        if relationship['closure']:
+            startNodes, startPositions = np.unique(bindings[alias], return_inverse=True)
+            pairPositions, pairNodes = get_local_closure(indptr, indices, startNodes, localGraph['nodeCount'], relationship['closure'] == "*0..")
+            closurePtr = np.searchsorted(pairPositions, np.arange(len(startNodes) + 1))
+            rowPositions, neighbors = expand_local(closurePtr, pairNodes, startPositions.reshape(-1))
+        else:
+            rowPositions, neighbors = expand_local(indptr, indices, bindings[alias])
+        bindings = select_local_rows(bindings, rowPositions)
+        if nextAlias in bindings:
+            bindings = select_local_rows(bindings, bindings[nextAlias] == neighbors)
+        else:
+            bindings[nextAlias] = neighbors
+        if nextLabel:
+            bindings = select_local_rows(bindings, get_label_mask(localGraph, nextLabel)[bindings[nextAlias]])
+        bindings = apply_local_filters(localGraph, bindings, pendingFilters)
+        alias = nextAlias
+    return bindings
+
+def parse_local_return(localReturn):
+    returnMatch = re.match(r"^(?:(\w+)\((DISTINCT\s+)?)?(\w+)(?:\.(\w+))?(\))?$", localReturn.strip(), re.IGNORECASE)
+    if not returnMatch or bool(returnMatch.group(1)) != bool(returnMatch.group(5)):
+        raise ValueError("invalid return '%s'" % localReturn)
+    function = returnMatch.group(1).lower() if returnMatch.group(1) else None
+    if function not in (None, 'count', 'collect', 'datetime') or (returnMatch.group(2) and function == 'datetime'):
+        raise ValueError("invalid return '%s'" % localReturn)
+    return {'function': function, 'distinct': bool(returnMatch.group(2)), 'alias': returnMatch.group(3), 'property': returnMatch.group(4)}
+
+def get_local_datetime(value):
+    # Same output as replace(replace(toString(datetime({epochSeconds:toInt(value)})),"T"," "),"Z","")
+    try:
+        epochTime = datetime(1970, 1, 1) + timedelta(seconds=int(value))
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return epochTime.strftime("%Y-%m-%d %H:%M" if epochTime.second == 0 else "%Y-%m-%d %H:%M:%S")
+
+def get_local_key(values):
+    return tuple(tuple(value) if isinstance(value, list) else value for value in values)
+
+def get_local_records(localGraph, bindings, headers, localSpec):
+    localReturns = [parse_local_return(localReturn) for localReturn in localSpec['Return']]
+    if len(localReturns) != len(headers):
+        raise ValueError("section 'Return' must have one entry per header")
+    for localReturn in localReturns:
+        if localReturn['alias'] not in bindings:
+            raise ValueError("unknown alias '%s'" % localReturn['alias'])
+    properties = localGraph['properties']
+    columns = [bindings[localReturn['alias']].tolist() for localReturn in localReturns]
+    rowCount = len(columns[0])
+    aggregates = [localReturn['function'] in ('count', 'collect') for localReturn in localReturns]
+    records = []
+    groups = {}
+    seenRows = set()
+    for rowIndex in range(rowCount):
+        row = []
+        for localReturn, column in zip(localReturns, columns):
+            value = properties[column[rowIndex]].get(localReturn['property']) if localReturn['property'] else column[rowIndex]
+            row.append(get_local_datetime(value) if localReturn['function'] == 'datetime' else value)
+        if any(aggregates):
+            # Rows are grouped on the values that are not aggregated, as Cypher does
+            groupKey = get_local_key(value for value, aggregate in zip(row, aggregates) if not aggregate)
+            if groupKey not in groups:
+                groups[groupKey] = [[] if aggregate else value for value, aggregate in zip(row, aggregates)]
+            for group, value, aggregate in zip(groups[groupKey], row, aggregates):
+                if aggregate and value is not None:
+                    group.append(value)
+        elif localSpec.get('Distinct'):
+            rowKey = get_local_key(row)
+            if rowKey not in seenRows:
+                seenRows.add(rowKey)
+                records.append(dict(zip(headers, row)))
+        else:
+            records.append(dict(zip(headers, row)))
+    for group in groups.values():
+        record = {}
+        for header, localReturn, value in zip(headers, localReturns, group):
+            if localReturn['function'] in ('count', 'collect') and localReturn['distinct']:
+                value = list(dict((get_local_key([item]), item) for item in value).values())
+            record[header] = len(value) if localReturn['function'] == 'count' else value
+        records.append(record)
+    return records
+
+def run_local_query(localGraph, cypherYaml):
+    # Templates providing a Local section are evaluated on the in-memory graph instead of Neo4j
+    cypherDescription = cypherYaml['Description'].strip()
+    localSpec = cypherYaml.get('Local')
+    if not localSpec:
+        print("[!] Query [%s] is not supported by the local engine" % cypherDescription)
+        return False
+    try:
+        logger.info("Getting local result for query [%s]" % cypherDescription)
+        bindings = {}
+        pendingFilters = [parse_local_filter(localFilter) for localFilter in localSpec.get('Where', [])]
+        for patternIndex, pattern in enumerate(localSpec['Match']):
+            bindings = match_local_pattern(localGraph, bindings, pattern, pendingFilters, patternIndex)
+        if pendingFilters:
+            raise ValueError("unknown alias '%s'" % pendingFilters[0]['alias'])
+        for withoutIndex, without in enumerate(localSpec.get('Without', [])):
+            # Rows are removed when their bound node matches the pattern
+            nodes, relationships = parse_local_pattern(without['Match'])
+            anchor = nodes[0][0] if nodes[0][0] in bindings else nodes[-1][0]
+            withoutFilters = [parse_local_filter(localFilter) for localFilter in without.get('Where', [])]
+            withoutBindings = match_local_pattern(localGraph, {anchor: np.unique(bindings[anchor])}, without['Match'], withoutFilters, len(localSpec['Match']) + withoutIndex)
+            bindings = select_local_rows(bindings, ~np.isin(bindings[anchor], withoutBindings[anchor]))
+        records = get_local_records(localGraph, bindings, cypherYaml['Headers'], localSpec)
+        if localSpec.get('OrderBy') or localSpec.get('Limit'):
+            records = sort_records(records, localSpec)
+        return records
+    except Exception as ex:
+        print("[!] Error running local query [%s]" % cypherDescription)
+        logger.warning("%s" % str(ex))
+        return False
+
+def run_analytics(driver, outputDirectory, workers=1, reportWriter=None):
+    analyticsQueries = get_analytics_queries()
+    if estimateMode:
+        analyticsQueries = get_estimate_queries(analyticsQueries)
+    return execute_queries(driver, analyticsQueries, outputDirectory, workers, reportWriter=reportWriter)
+
+def get_analytics_queries():
+    analyticsCypher = [
+        {
+            "Description": "Nodes distributions",
+            "Category": "analytics",
+            "Headers": ['Node Type','Number Of Nodes'],
+            "Query": "MATCH (n) RETURN labels(n) AS `Node Type`, count(n) AS `Number Of Nodes`;",
+            "Estimate": {"CountStore": True}
+        },
+        {
+            "Description": "Domains available",
+            "Category": "analytics",
+            "Headers": ['Domain'],
+            "Query": "MATCH (n:Domain) RETURN n.name as Domain"
+        },
+        {
+            "Description": "Owned principals",
+            "Category": "analytics",
+            "Headers": ['Owned principale', 'DisplayName', 'Description', 'Wave'],
+            "Query": "MATCH (n) WHERE n.owned = true RETURN n.name AS `Owned principale`, n.displayname AS `DisplayName`, n.description AS `Description`, n.wave AS `Wave`"
+        }
+    ]
+
+    return analyticsCypher
+
+def get_neo4j_instances(config, neo4jConfPath, neo4jInstanceType):
+    # The configured local Neo4j service is part of the pool, extra instances can be declared in neo4jInstances
+    instances = []
+    if neo4jInstanceType == "local":
+        instances.append({'Name': 'default', 'URI': config.neo4jURI, 'User': config.neo4jUser, 'Pass': config.neo4jPass, 'ConfFile': neo4jConfPath, 'RestartCommand': None})
+    for i, instance in enumerate(getattr(config, 'neo4jInstances', [])):
+        instances.append({
+            'Name': instance.get('Name', "instance%s" % (i + 1)),
+            'URI': instance['URI'],
+            'User': instance.get('User', config.neo4jUser),
+            'Pass': instance.get('Pass', config.neo4jPass),
+            'ConfFile': os.path.join(instance['ConfPath'], "neo4j.conf"),
+            'RestartCommand': instance['RestartCommand']
+        })
+    return instances
+
+def restart_instance(instance, restartTimeout):
+    instanceConfig = types.SimpleNamespace(neo4jURI=instance['URI'], neo4jUser=instance['User'], neo4jPass=instance['Pass'])
+    if instance['RestartCommand'] is None:
+        return restart_service(get_service('neo4j'), instanceConfig, restartTimeout)
+    try:
+        subprocess.run(instance['RestartCommand'], check=True, stdout=subprocess.DEVNULL)
+    except Exception as ex:
+        print("[!] Error while restarting Neo4j instance [%s]" % instance['Name'])
+        logger.error("%s" % str(ex))
+        return False
+    startupTime = wait_for_neo4j(instanceConfig, restartTimeout)
+    if startupTime is False:
+        print("[!] Neo4j instance [%s] is not ready after %s seconds!" % (instance['Name'], restartTimeout))
+        return False
+    logger.info("Neo4j instance [%s] ready in %.1f seconds" % (instance['Name'], startupTime))
+    return True
+
+def run_database_queries(instance, DBName, cypherQueries, outputDirectory, workers, restartTimeout, neo4jDBPath):
+    print("[+] [%s] Switching Neo4j instance [%s] to database '%s'" % (DBName, instance['Name'], DBName))
+    set_active_database(instance['ConfFile'], DBName)
+    if not restart_instance(instance, restartTimeout):
+        return None
+    driver = neo4j.GraphDatabase.driver(instance['URI'], auth=(instance['User'], instance['Pass']))
+    closureBuilt = False
+    try:
+        if indexMode:
+            ensure_indexes(driver, cypherQueries, indexMode == "plan")
+        cacheIdentity = None
+        if resultCache:
+            cacheIdentity = get_cache_identity(resultCache['directory'], driver, neo4jDBPath, DBName)
+        if precomputeClosure and build_admin_closure(driver):
+            closureBuilt = True
+            cypherQueries = get_closure_queries(cypherQueries)
+        DBOutputDirectory = os.path.join(outputDirectory, DBName)
+        if saveResults:
+            os.makedirs(DBOutputDirectory, exist_ok=True)
+        startTime = time.perf_counter()
+        queryResults = execute_queries(driver, cypherQueries, DBOutputDirectory, workers, firstQueryIndex=0, showResults=False, cacheIdentity=cacheIdentity)
+        print("[+] [%s] %s queries run in %.1f seconds, %s with results" % (DBName, len(cypherQueries), time.perf_counter() - startTime, len(queryResults)))
+        if saveResults and queryResults:
+            build_report(DBOutputDirectory, queryResults)
+        return dict((parsedResult['queryIndex'], parsedResult['count']) for parsedResult in queryResults)
+    finally:
+        if closureBuilt and drop_admin_closure(driver) is not None and cacheIdentity:
+            store_identity_alias(resultCache['directory'], cacheIdentity, driver, neo4jDBPath, DBName)
+        driver.close()
+
+def run_multi_database(instances, DBNames, cypherQueries, outputDirectory, workers, restartTimeout, neo4jDBPath):
+    # Each Neo4j instance of the pool takes the next database from the queue until all of them are done
+    DBQueue = queue.Queue()
+    for DBName in DBNames:
+        DBQueue.put(DBName)
+    DBCounts = {}
+    originalDBs = [get_active_database(instance['ConfFile']) for instance in instances]
+
+    def instance_worker(instance):
+        while True:
+            try:
+                DBName = DBQueue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                DBCounts[DBName] = run_database_queries(instance, DBName, cypherQueries, outputDirectory, workers, restartTimeout, neo4jDBPath)
+            except Exception as ex:
+                print("[!] Error while running queries against database '%s'" % DBName)
+                logger.error("%s" % str(ex))
+                DBCounts[DBName] = None
+
+    print("[+] Running %s queries against %s databases using %s Neo4j {instances}".format(instances="instances" if len(instances) > 1 else "instance") % (len(cypherQueries), len(DBNames), len(instances)))
+    with futures.ThreadPoolExecutor(max_workers=len(instances)) as executor:
+        list(executor.map(instance_worker, instances))
+
+    # Put the instances back on their original database
+    for instance, originalDB in zip(instances, originalDBs):
+        if originalDB and get_active_database(instance['ConfFile']) != originalDB:
+            set_active_database(instance['ConfFile'], originalDB)
+            restart_instance(instance, restartTimeout)
+    show_database_comparison(DBNames, DBCounts, cypherQueries, outputDirectory)
+
+def show_database_comparison(DBNames, DBCounts, cypherQueries, outputDirectory):
+    headers = ['Query'] + DBNames
+    comparisonRows = []
+    for queryIndex, cypherYaml in enumerate(cypherQueries):
+        comparisonRow = [cypherYaml['Description'].strip()]
+        for DBName in DBNames:
+            if DBCounts.get(DBName) is None:
+                comparisonRow.append("error")
+            else:
+                comparisonRow.append(DBCounts[DBName].get(queryIndex, 0))
+        comparisonRows.append(comparisonRow)
+    print("[+] Databases comparison (number of results):\n")
+    print(tabulate.tabulate(comparisonRows, headers=headers, tablefmt='github') + '\n')
+    if saveResults:
+        outputFileName = os.path.join(outputDirectory, "BloodCheck-Comparison-" + sessionTimestamp + ".xlsx")
+        workbook = xlsxwriter.Workbook(outputFileName)
+        try:
+            write_report_sheet(workbook, "Comparison", headers, comparisonRows)
+        finally:
+            workbook.close()
+        print("[!] Comparison spreadsheet saved to [%s]" % (outputFileName))
+
+def confirmation():
+    reply = str(input("[!] Are you sure ?"+' (y/n): ')).lower().strip()
+    if len(reply) == 1:
+        if reply[0] == 'y':
+            return True
+    else:
+        return False
+
+def run_daemon(socketFile, configFile):
+    if not hasattr(socket, "AF_UNIX"):
+        print("[!] The daemon mode requires Unix sockets, which are not available on %s!" % (runningOS))
+        return False
+    global daemonState
+    # Module level settings are restored to these values before each command
+    daemonDefaults = {name: globals()[name] for name in ('previewSize', 'resultBatchSize', 'reportRowThreshold', 'columnarFormat', 'precomputeClosure', 'localGraph', 'catalogDirectory', 'profileQueries', 'profileDbHits', 'resultCache', 'indexMode', 'queryTimeout', 'runDeadline', 'queryRetries', 'estimateMode', 'sampleSize', 'estimateConfidence')}
+    daemonState = {'drivers': {}, 'catalogs': {}, 'localGraphs': {}, 'openedFiles': [], 'configFile': configFile, 'scriptPath': os.path.abspath(sys.argv[0]), 'defaults': daemonDefaults}
+    if os.path.exists(socketFile):
+        # A socket left behind by a stopped daemon is replaced, a running daemon is not
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                client.connect(socketFile)
+            print("[!] A daemon is already listening on [%s]!" % (socketFile))
+            return False
+        except OSError:
+            os.remove(socketFile)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        # Commands run with the privileges of the daemon, so the socket is only accessible to its user
+        previousUmask = os.umask(0o177)
+        try:
+            server.bind(socketFile)
+        finally:
+            os.umask(previousUmask)
+        server.listen(16)
+        print("[+] Daemon listening on [%s]" % (socketFile))
+        while True:
+            connection, _ = server.accept()
+            with connection:
+                run_daemon_command(connection)
+    except KeyboardInterrupt:
+        print("[!] Stopping daemon...")
+    except Exception as ex:
+        print("[!] Error while running the daemon")
+        logger.error("%s" % str(ex))
+        return False
+    finally:
+        server.close()
+        if os.path.exists(socketFile):
+            os.remove(socketFile)
+        for driver in daemonState['drivers'].values():
+            driver.close()
+    return True
+
+class LockedStream:
+    # Query workers print concurrently, which text streams do not support: their output could be interleaved with buffer contents
+    def __init__(self, stream):
+        self._stream = stream
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        with self._lock:
+            return self._stream.write(text)
+
+    def flush(self):
+        with self._lock:
+            self._stream.flush()
+
+    def __getattr__(self, attribute):
+        return getattr(self._stream, attribute)
+
+def run_daemon_command(connection):
+    # Commands run one at a time, since a run is described by module level state
+    global queryProfiles
+    global failedQueries
+    try:
+        request = json.loads(connection.makefile('rb').readline().decode("utf-8"))
+    except Exception as ex:
+        logger.warning("Invalid daemon command: %s" % str(ex))
+        return
+    outputFile = LockedStream(connection.makefile('w', buffering=1, encoding="utf-8", newline=''))
+    previousArgv = sys.argv
+    previousStdout = sys.stdout
+    previousDirectory = os.getcwd()
+    globals().update(daemonState['defaults'])
+    queryProfiles = []
+    failedQueries = []
+    logger.disabled = False
+    # Only the handlers writing to the console follow the command output, other handlers are left as is
+    consoleHandlers = [handler for handler in logger.handlers if getattr(handler, 'stream', None) is previousStdout]
+    exitCode = 0
+    try:
+        os.chdir(request['cwd'])
+        sys.argv = [daemonState['scriptPath']] + request['arguments']
+        sys.stdout = outputFile
+        for handler in consoleHandlers:
+            handler.setStream(outputFile)
+        try:
+            main()
+        except SystemExit as ex:
+            if isinstance(ex.code, int):
+                exitCode = ex.code
+            elif ex.code is not None:
+                print(ex.code)
+                exitCode = 1
+        except Exception as ex:
+            print("[!] Error while running the command")
+            logger.error("%s" % str(ex))
+            exitCode = 1
+        # The exit code follows the output, after a NUL character
+        outputFile.write("\x00%d" % (exitCode))
+        outputFile.flush()
+    except OSError as ex:
+        # The client went away
+        logger.warning("%s" % str(ex))
+    finally:
+        sys.stdout = previousStdout
+        for handler in consoleHandlers:
+            handler.setStream(previousStdout)
+        sys.argv = previousArgv
+        os.chdir(previousDirectory)
+        while daemonState['openedFiles']:
+            daemonState['openedFiles'].pop().close()
+        # The client reads until the connection is closed, which does not happen while its file object is still referenced
+        try:
+            outputFile.close()
+        except OSError:
+            pass
+
+def run_client(socketFile, arguments):
+    # Thin client: the command line is run by the daemon and its output is streamed back
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(socketFile)
+    except (AttributeError, OSError) as ex:
+        print("[!] Unable to connect to the daemon on [%s]" % (socketFile))
+        logger.error("%s" % str(ex))
+        return 1
+    with client:
+        client.sendall((json.dumps({'arguments': arguments, 'cwd': os.getcwd()}) + "\n").encode("utf-8"))
+        trailer = None
+        while True:
+            data = client.recv(65536)
+            if not data:
+                break
+            if trailer is None:
+                data, separator, trailer = data.partition(b"\x00")
+                sys.stdout.buffer.write(data)
+                sys.stdout.flush()
+                if not separator:
+                    trailer = None
+            else:
+                trailer += data
+    if not trailer:
+        print("[!] Connection to the daemon lost")
+        return 1
+    return int(trailer)
+
+def main():
+    if daemonState is None:
+        show_banner()
+
+    # Parse arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--config", help="define Neo4j configuration file", dest="configFile", metavar="CONFIGFILE", type=lambda x: is_valid_file(parser, x))
+    parser.add_argument("-dC", "--connect", help="run the command through the daemon listening on the socket", dest="connectSocket", metavar="SOCKET")
+    parser.add_argument("-dD", "--daemon", help="run as a daemon listening on the socket, keeping connections and templates loaded between commands", dest="daemonSocket", metavar="SOCKET")
+    parser.add_argument("-dG", "--generate", help="generate Neo4j database (the names can be provided to create several databases at once)", dest="generate", metavar="DATABASE", nargs="*")
+    parser.add_argument("-dL", "--list", help="list Neo4j database", action="store_true")
+    parser.add_argument("-dP", "--purge", help="purge Neo4j database", action="store_true")
+    parser.add_argument("-dR", "--restart", help="restart Neo4j local service", action="store_true")
+    parser.add_argument("--restart-timeout", help="maximum number of seconds to wait for Neo4j to be ready after a restart (default: 120)", dest="restartTimeout", metavar="RESTARTTIMEOUT", type=int, default=120)
+    parser.add_argument("-dI", "--ingest", help="ingest SharpHound collections (JSON files, zip archives or directories) into the active Neo4j database", dest="ingestPaths", metavar="COLLECTION", nargs="+")
+    parser.add_argument("--ingest-batch-size", help="number of nodes or relationships sent per ingestion transaction (default: 1000)", dest="ingestBatchSize", metavar="INGESTBATCHSIZE", type=int, default=1000)
+    parser.add_argument("-dS", "--switch", help="switch Neo4j database (the name can be provided to switch without prompting)", dest="switch", metavar="DATABASE", nargs="?", const=True)
+    parser.add_argument("-oI", "--inject", help="inject owned principales", dest="ownedInjectFile", metavar="OWNEDINJECTFILE", type=lambda x: is_valid_file(parser, x))
+    parser.add_argument("-oU", "--undo", help="undo the owned principales injection", dest="ownedUndoFile", metavar="OWNEDUNDOFILE", type=lambda x: is_valid_file(parser, x))
+    parser.add_argument("-oB", "--batch-size", help="number of owned principales sent per transaction (default: 1000)", dest="ownedBatchSize", metavar="OWNEDBATCHSIZE", type=int, default=1000)
+    parser.add_argument("-oW", "--wipe", help="wipe all owned principales", action="store_true")
+    parser.add_argument("-qA", "--analytics", help="run Neo4j database analytics", action="store_true")
+    parser.add_argument("-qF", "--query", help="run cypher query", dest="queryFile", metavar="QUERYFILE", type=lambda x: is_valid_file(parser, x))
+    parser.add_argument("-qD", "--dir", help="run all cypher queries from directory", dest="queryDirectory", metavar="QUERYDIRECTORY", type=lambda x: is_valid_directory(parser, x))
+    parser.add_argument("-qC", "--cache", help="reuse cached results when the database did not change", action="store_true")
+    parser.add_argument("--cache-dir", help="cache directory (default: _cache)", dest="cacheDirectory", metavar="CACHEDIRECTORY")
+    parser.add_argument("--cache-max-size", help="maximum cache size in MB (default: 1024)", dest="cacheMaxSize", metavar="CACHEMAXSIZE", type=int, default=1024)
+    parser.add_argument("--cache-max-age", help="maximum cache entry age in hours (default: 168)", dest="cacheMaxAge", metavar="CACHEMAXAGE", type=int, default=168)
+    parser.add_argument("-qE", "--export", help="export the Neo4j graph to a file for the local engine", dest="exportGraphFile", metavar="GRAPHFILE")
+    parser.add_argument("-qI", "--index", help="create the indexes used by the template lookups that are missing from the database, before running the queries", dest="createIndexes", action="store_true")
+    parser.add_argument("--index-dry-run", help="only show the index plan of -qI, without creating any index", dest="indexDryRun", action="store_true")
+    parser.add_argument("-qL", "--local", help="run the queries against a graph file with the local engine instead of Neo4j", dest="localGraphFile", metavar="GRAPHFILE", type=lambda x: is_valid_file(parser, x))
+    parser.add_argument("-qM", "--multi", help="run the queries against several databases (all databases if none is provided)", dest="multiDatabase", metavar="DATABASE", nargs="*")
+    parser.add_argument("-qX", "--diff", help="compare the saved results of two runs (result directories, optionally followed by @<timestamp>)", dest="diffRuns", metavar=("OLDRUN", "NEWRUN"), nargs=2)
+    parser.add_argument("-qT", "--estimate", help="estimate the templates providing an Estimate section on random node samples (or from the count store), with confidence intervals", action="store_true")
+    parser.add_argument("--sample-size", help="number of nodes sampled by each estimate, unless the template sets its own Sample (default: 1000)", dest="sampleSize", metavar="SAMPLESIZE", type=int, default=1000)
+    parser.add_argument("--confidence", help="confidence level of the estimate intervals, in percent (default: 95)", dest="estimateConfidence", metavar="CONFIDENCE", type=int, choices=[90, 95, 99], default=95)
+    parser.add_argument("-qP", "--precompute", help="precompute the group membership and admin rights closures used by the templates supporting them", action="store_true")
+    parser.add_argument("-qS", "--subdir", help="run all cypher queries from all subdirectories", dest="querySubDirectory", metavar="QUERYSUBDIRECTORY", type=lambda x: is_valid_directory(parser, x))
+    parser.add_argument("-o", "--output", help="output results in specified directory", dest="outputDirectory", metavar="OUTPUTDIRECTORY", type=lambda x: is_valid_directory(parser, x))
+    parser.add_argument("-s", "--save", help="save results to files", action="store_true")
+    parser.add_argument("-f", "--format", help="also save results as typed columnar files (parquet or arrow)", dest="columnarFormat", metavar="FORMAT", choices=["csv", "parquet", "arrow"], default="csv")
+    parser.add_argument("--report-rows", help="maximum rows per result kept in memory for the Excel report, larger results are read back from their CSV file (default: 20000)", dest="reportRowThreshold", metavar="REPORTROWS", type=int, default=20000)
+    parser.add_argument("--query-timeout", help="maximum number of seconds per cypher query, unless the template sets its own Timeout (default: no limit)", dest="queryTimeout", metavar="QUERYTIMEOUT", type=int)
+    parser.add_argument("--run-timeout", help="maximum number of seconds for all the cypher queries, the remaining ones are skipped once it is reached (default: no limit)", dest="runTimeout", metavar="RUNTIMEOUT", type=int)
+    parser.add_argument("--retries", help="number of retries of a cypher query after a transient error, unless the template sets its own Retries (default: 2)", dest="queryRetries", metavar="RETRIES", type=int, default=2)
+    parser.add_argument("-p", "--profile", help="profile each cypher query and report the slowest ones", action="store_true")
+    parser.add_argument("--profile-db-hits", help="also collect Neo4j PROFILE db hits (implies --profile)", dest="profileDbHits", action="store_true")
+    parser.add_argument("--progress", help="show a live progress view of the running queries", action="store_true")
+    parser.add_argument("--metrics-file", help="write the run metrics to a file in the Prometheus text format, refreshed every second", dest="metricsFile", metavar="METRICSFILE")
+    parser.add_argument("--metrics-port", help="serve the run metrics in the Prometheus text format on a local port", dest="metricsPort", metavar="METRICSPORT", type=int)
+    parser.add_argument("-w", "--workers", help="number of cypher queries (or ingestion batches) to run in parallel (default: 1)", dest="workers", metavar="WORKERS", type=int, default=1)
+    parser.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
+    args = parser.parse_args()
+
+    # Check Arguments
+    if len(sys.argv)==1 or (len(sys.argv)==2 and args.verbose):
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+    else:
+        if args.verbose:
+            print("[!] Increasing output verbosity")
+        else:
+            logger.disabled = True
+        if args.daemonSocket:
+            if daemonState is not None:
+                print("[!] The daemon is already running!")
+                sys.exit(1)
+            configFile = os.path.splitext(args.configFile.name)[0] if args.configFile else "config"
+            sys.exit(0 if run_daemon(args.daemonSocket, configFile) else 1)
+        if args.connectSocket and daemonState is None:
+            sys.exit(run_client(args.connectSocket, sys.argv[1:]))
+        if daemonState is not None and (args.switch is True or args.purge or args.wipe or args.generate == []):
+            # Commands prompting for a database name or a confirmation can't be answered through the socket
+            print("[!] Interactive commands can't be run through the daemon!")
+            sys.exit(1)
+        if args.diffRuns:
+            # Comparing saved results does not require Neo4j
+            global sessionTimestamp
+            sessionTimestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+            outputDirectory = args.outputDirectory or os.path.join(os.path.abspath(os.path.dirname(sys.argv[0])), "_output")
+            if not diff_runs(args.diffRuns[0], args.diffRuns[1], outputDirectory):
+                sys.exit(1)
+            sys.exit(0)
+        if args.localGraphFile:
+            # The local engine needs neither Neo4j nor its configuration
+            if args.generate is not None or args.list or args.purge or args.restart or args.switch or args.ownedInjectFile or args.ownedUndoFile or args.wipe or args.exportGraphFile or args.multiDatabase is not None or args.precompute or args.ingestPaths or args.createIndexes or args.indexDryRun or args.estimate:
+                print("[!] The local engine can only be used to run queries!")
+                sys.exit(1)
+            localNeo4jDB = None
+            neo4jInstanceType = None
+        else:
+            if args.configFile:
+                logger.info("Config file provided")
+                configFile = os.path.splitext(args.configFile.name)[0]
+                logger.info(configFile)
+            elif daemonState is not None:
+                logger.info("No config file provided. Using the config file of the daemon instead")
+                configFile = daemonState['configFile']
+            else:
+                logger.info("No config file provided. Using the default config file instead")
+                configFile = "config"
+            try:
+                config = importlib.import_module(configFile)
+                if config.neo4jURI and config.neo4jConfPath and config.neo4jDataPath and config.neo4jUser and config.neo4jPass:
+                    neo4jConfPath = os.path.join(config.neo4jConfPath,"neo4j.conf")
+                    neo4jDBPath = os.path.join(config.neo4jDataPath,"databases")
+                    neo4jInstanceType = config.neo4jInstanceType
+                    logger.info("neo4jInstanceType -> " + config.neo4jInstanceType)
+                    logger.info("neo4jURI -> " + config.neo4jURI)
+                    logger.info("neo4jConfPath -> " + neo4jConfPath)
+                    logger.info("neo4jDBPath -> " + neo4jDBPath)
+                    localNeo4jDB = re.search("^.*(localhost|127(?:\.[0-9]+){0,2}\.[0-9]+).*$", config.neo4jURI)
+                    if localNeo4jDB:
+                        if os.path.isfile(neo4jConfPath) and os.path.isdir(neo4jDBPath):
+                            print("[!] Access to Neo4j installation path [OK]")
+                        else:
+                            print("[!] Access to Neo4j installation path [KO]")
+                            print("[+] Please check your configuration")
+                            sys.exit(1)
+                    else:
+                        print("[!] Remote Neo4j URI detected! Local Neo4j databases management won't be possible!")
+            except Exception as ex:
+                print("[!] Error while parsing the configuration file")
+                logger.error("%s" % str(ex))
+                sys.exit(1)
+        driver = None
+        session = None
+        try:
+            if args.generate is not None or args.switch or args.purge or args.list:
+                if localNeo4jDB:
+                    currentDB = get_active_database(neo4jConfPath)
+                    DBlist = get_databases(neo4jDBPath)
+                    if args.generate is not None:
+                        if not generate_database(neo4jDBPath, DBlist, args.generate):
+                            sys.exit(1)
+                    if args.list:
+                        list_databases(DBlist, currentDB)
+                        selectedDB = False
+                    if args.switch is True:
+                        selectedDB = select_database_to_switch(DBlist, currentDB)
+                        set_active_database(neo4jConfPath, selectedDB)
+                    elif args.switch:
+                        # Databases generated by this command are not in the list yet
+                        if not os.path.isdir(os.path.join(neo4jDBPath, args.switch)) or args.switch == "graph.db":
+                            print("[!] Database '%s' does not exist!" % (args.switch))
+                            sys.exit(1)
+                        print("[!] Switching to database '%s'" % (args.switch))
+                        set_active_database(neo4jConfPath, args.switch)
+                    if args.purge:
+                        selectedDB = select_database_to_purge(DBlist, currentDB)
+                        if selectedDB == currentDB:
+                            print("[!] Can't delete current database '%s' !" % (selectedDB))
+                            DBlist = get_databases(neo4jDBPath)
+                            selectedDB = select_database_to_switch(DBlist, currentDB)
+                            set_active_database(neo4jConfPath, selectedDB)
+                        else:
+                            DBPath = os.path.join(neo4jDBPath,selectedDB)
+                            if os.path.isdir(DBPath):
+                                try:
+                                    if confirmation():
+                                        shutil.rmtree(DBPath)
+                                        print("[!] Database '%s' deleted!" % (selectedDB))
+                                    else:
+                                        print("[!] Action aborted!")
+                                except OSError as e:
+                                    logger.error("Error: %s : %s" % (DBPath, e.strerror))
+                else:
+                    print("[!] Can't manage remote Neo4j databases!")
+                    sys.exit(1)
+            
+            if args.restart:
+                if neo4jInstanceType == "docker" or neo4jInstanceType == "remote":
+                    print("[!] Can't manage docker/remote Neo4j service!")
+                    sys.exit(1)
+                else:
+                    service = get_service('neo4j')
+                    if service:
+                        print("[!] Restarting Neo4j service...")
+                        serviceStatus = restart_service(service, config, args.restartTimeout)
+            
+            if (args.queryFile or args.queryDirectory or args.querySubDirectory or args.ownedInjectFile or args.ownedUndoFile or args.wipe or args.analytics or args.exportGraphFile or args.ingestPaths) and not args.localGraphFile:
+                if neo4jInstanceType == "local":
+                    service = get_service('neo4j')
+                    if service:
+                        if service and service['status'] == 'running':
+                            driver = connect_to_server(config)
+                        else:
+                            print("[!] Restarting Neo4j service...")
+                            serviceStatus = restart_service(service, config, args.restartTimeout)
+                            if serviceStatus:
+                                driver = connect_to_server(config)
+                            else:
+                                print("[!] An error occured while restarting the Neo4j service!")
+                                sys.exit(1)
+                    else:
+                        print("[!] Please check that the Neo4j service is installed!")
+                        sys.exit(1)
+                else:
+                    try:
+                        driver = connect_to_server(config)
+                    except:
+                        print("[!] An error occured while connecting to the Neo4j server!")
+                        sys.exit(1)
+
+            if args.ingestPaths:
+                if not ingest_collections(driver, args.ingestPaths, max(1, args.ingestBatchSize), max(1, args.workers)):
+                    sys.exit(1)
+
+            if args.exportGraphFile:
+                if not export_local_graph(driver, args.exportGraphFile):
+                    sys.exit(1)
+
+            if args.localGraphFile:
+                global localGraph
+                localGraph = get_local_graph(args.localGraphFile.name)
+                if not localGraph:
+                    sys.exit(1)
+                driver = None
+            
+            if args.queryFile or args.queryDirectory or args.querySubDirectory or args.analytics:
+                global allResults
+                allResults = []
+                global queryCount
+                queryCount = 0
+                workers = max(1, args.workers)
+                cypherQueries = []
+                if args.outputDirectory:
+                    outputDirectory = args.outputDirectory
+                else:
+                    pathName = os.path.dirname(sys.argv[0])
+                    fullPath = os.path.abspath(pathName)
+                    outputDirectory = os.path.join(fullPath, "_output").strip()
+                global catalogDirectory
+                catalogDirectory = args.cacheDirectory
+                global saveResults
+                saveResults = True if args.save else False
+                global reportRowThreshold
+                reportRowThreshold = max(0, args.reportRowThreshold)
+                global columnarFormat
+                if args.columnarFormat != "csv":
+                    if pa is None:
+                        sys.exit("[!] The pyarrow package is required to save results as %s files" % (args.columnarFormat))
+                    columnarFormat = args.columnarFormat
+                global profileQueries
+                profileQueries = True if args.profile or args.profileDbHits else False
+                global indexMode
+                if args.indexDryRun:
+                    indexMode = "plan"
+                elif args.createIndexes:
+                    indexMode = "create"
+                global profileDbHits
+                profileDbHits = True if args.profileDbHits else False
+                global queryTimeout
+                queryTimeout = args.queryTimeout if args.queryTimeout and args.queryTimeout > 0 else None
+                global queryRetries
+                queryRetries = max(0, args.queryRetries)
+                global estimateMode
+                estimateMode = True if args.estimate else False
+                global sampleSize
+                sampleSize = max(1, args.sampleSize)
+                global estimateConfidence
+                estimateConfidence = args.estimateConfidence
+                now = datetime.now()
+                sessionTimestamp = now.strftime("%Y%m%d-%H%M%S")
+                if saveResults or profileQueries:
+                    try:
+                        tempFilePath = os.path.join(outputDirectory,''.join(random.choice(string.ascii_lowercase) for i in range(7)))
+                        fileHandle = open(tempFilePath, 'w')
+                        fileHandle.close()
+                        os.remove(tempFilePath)
+                    except IOError:
+                        sys.exit("[!] Unable to write to directory [%s]" % (outputDirectory))
+                if saveResults:
+                    print("[+] Saving results to directory [%s]" % (outputDirectory))
+                if args.cache and localGraph is not None:
+                    print("[!] The result cache is not used by the local engine")
+                elif args.cache:
+                    global resultCache
+                    cacheDirectory = args.cacheDirectory or os.path.join(os.path.abspath(os.path.dirname(sys.argv[0])), "_cache")
+                    os.makedirs(cacheDirectory, exist_ok=True)
+                    evict_cache(cacheDirectory, args.cacheMaxSize, args.cacheMaxAge)
+                    activeDB = get_active_database(neo4jConfPath) if localNeo4jDB and os.path.isfile(neo4jConfPath) else None
+                    databaseIdentity = get_cache_identity(cacheDirectory, driver, neo4jDBPath if localNeo4jDB else None, activeDB)
+                    if databaseIdentity:
+                        print("[+] Using result cache [%s]" % (cacheDirectory))
+                        resultCache = {'directory': cacheDirectory, 'identity': databaseIdentity, 'database': activeDB}
+                    else:
+                        print("[!] Unable to identify the database, result cache disabled")
+                if args.queryFile:
+                    logger.info("Cypher query file provided")
+                    queryFile = args.queryFile.name
+                    logger.info(queryFile)
+                    cypherYaml = load_yaml_file(queryFile)
+                    if cypherYaml:
+                        cypherQueries.append(cypherYaml)
+                    
+                if args.queryDirectory:
+                    logger.info("Cypher query directory provided")
+                    queryDirectory = args.queryDirectory
+                    logger.info(queryDirectory)
+                    cypherQueries.extend(load_yaml_folder(queryDirectory) or [])
+                
+                if args.querySubDirectory:
+                    logger.info("Cypher query subdirectory provided")
+                    querySubDirectory = args.querySubDirectory
+                    logger.info(querySubDirectory)
+                    cypherQueries.extend(load_yaml_folder(querySubDirectory, recursive=True) or [])
+
+                if indexMode and args.multiDatabase is None:
+                    ensure_indexes(driver, cypherQueries + (get_analytics_queries() if args.analytics else []), indexMode == "plan")
+
+                # The closure is built once the database identity is known, as writing it changes the fingerprint,
+                # the identity found after its removal is stored as an alias of this one
+                closureQueries = False
+                if args.precompute:
+                    global precomputeClosure
+                    precomputeClosure = True
+                    if args.multiDatabase is None:
+                        closureQueries = build_admin_closure(driver)
+
+                global runDeadline
+                runDeadline = time.perf_counter() + args.runTimeout if args.runTimeout and args.runTimeout > 0 else None
+                global runMetrics
+                if args.progress or args.metricsFile or args.metricsPort:
+                    runMetrics = start_run_metrics(args.progress, args.metricsFile, args.metricsPort)
+                try:
+                    if args.multiDatabase is not None:
+                        if args.analytics:
+                            cypherQueries.extend(get_analytics_queries())
+                        if estimateMode:
+                            cypherQueries = get_estimate_queries(cypherQueries)
+                        instances = get_neo4j_instances(config, neo4jConfPath, neo4jInstanceType if localNeo4jDB else None)
+                        if not instances:
+                            print("[!] Running queries against several databases requires a local Neo4j service or neo4jInstances in the config file!")
+                            sys.exit(1)
+                        DBlist = get_databases(neo4jDBPath) or []
+                        DBNames = args.multiDatabase or DBlist
+                        for DBName in DBNames:
+                            if DBName not in DBlist:
+                                print("[!] Database '%s' does not exist!" % (DBName))
+                                sys.exit(1)
+                        if cypherQueries and DBNames:
+                            run_multi_database(instances, DBNames, cypherQueries, outputDirectory, workers, args.restartTimeout, neo4jDBPath)
+                    else:
+                        if closureQueries:
+                            cypherQueries = get_closure_queries(cypherQueries)
+                        if estimateMode:
+                            cypherQueries = get_estimate_queries(cypherQueries)
+                        reportWriter = start_report_writer(outputDirectory) if saveResults else None
+                        try:
+                            if cypherQueries:
+                                allResults.extend(execute_queries(driver, cypherQueries, outputDirectory, workers, reportWriter=reportWriter))
+
+                            if args.analytics:
+                                print("[+] Running analytics...\n")
+                                allResults.extend(run_analytics(driver, outputDirectory, workers, reportWriter))
+                        finally:
+                            if reportWriter:
+                                stop_report_writer(reportWriter)
+
+                        if len(allResults) == 0:
+                            print("[!] No result found!")
+                finally:
+                    if closureQueries and drop_admin_closure(driver) is not None and resultCache:
+                        store_identity_alias(resultCache['directory'], resultCache['identity'], driver, neo4jDBPath if localNeo4jDB else None, resultCache.get('database'))
+                    if runMetrics:
+                        stop_run_metrics(runMetrics)
+                        runMetrics = None
+                if profileQueries and queryProfiles:
+                    show_profile_report(outputDirectory, queryProfiles)
+                if failedQueries:
+                    show_failed_queries(failedQueries)
+                if resultCache:
+                    evict_cache(resultCache['directory'], args.cacheMaxSize, args.cacheMaxAge)
+            
+            if args.ownedInjectFile or args.ownedUndoFile or args.wipe:
+                session = driver.session()
+                if args.ownedInjectFile:
+                    logger.info("Owned file provided")
+                    ownedFile = args.ownedInjectFile.name
+                    logger.info(ownedFile)
+                    inject_owned(session, ownedFile, max(1, args.ownedBatchSize))
+                
+                if args.ownedUndoFile:
+                    logger.info("Owned file provided")
+                    ownedFile = args.ownedUndoFile.name
+                    logger.info(ownedFile)
+                    undo_owned(session, ownedFile, max(1, args.ownedBatchSize))
+                
+                if args.wipe:
+                    wipe_owned(session)
+        except KeyboardInterrupt:
+            print("[!] Aborting !")
+            selectedDB = False
+        finally:
+            # Closed on every exit, the drivers of the daemon are kept for the next commands and closed when it stops
+            if session is not None:
+                session.close()
+            if driver is not None and daemonState is None:
+                driver.close()
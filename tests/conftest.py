@@ -0,0 +1,92 @@
+#  -*- coding: utf-8 -*-
+
+import os
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bloodcheck_core
+
+templateDirectory = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates")
+
+
+class StubResult:
+    # Iterable over dict records, as consumed by parse_result and get_partitions. Generators are streamed,
+    # so that an answer can fail after its first records.
+    def __init__(self, records):
+        self.records = records if isinstance(records, types.GeneratorType) else list(records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def single(self):
+        return self.records[0] if self.records else None
+
+    def keys(self):
+        return list(self.records[0].keys()) if self.records else []
+
+    def consume(self):
+        pass
+
+
+class StubTransaction:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def run(self, CypherQuery, **parameters):
+        self.driver.queries.append((CypherQuery, parameters))
+        return StubResult(self.driver.answer(CypherQuery, **parameters))
+
+    def commit(self):
+        self.driver.transactions.append("commit")
+
+    def rollback(self):
+        self.driver.transactions.append("rollback")
+
+
+class StubSession:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        pass
+
+    def run(self, CypherQuery, **parameters):
+        CypherQuery = getattr(CypherQuery, 'text', CypherQuery)
+        self.driver.queries.append((CypherQuery, parameters))
+        return StubResult(self.driver.answer(CypherQuery, **parameters))
+
+    def begin_transaction(self):
+        return StubTransaction(self.driver)
+
+
+class StubDriver:
+    # Answers each query with the records returned by the answer function
+    def __init__(self, answer):
+        self.answer = answer
+        self.queries = []
+        self.transactions = []
+
+    def session(self):
+        return StubSession(self)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def bc(monkeypatch):
+    # Module level run state, reset for each test
+    for name, value in (('saveResults', False), ('resultCache', None), ('localGraph', None), ('columnarFormat', None), ('estimateMode', False), ('sampleSize', 1000), ('estimateConfidence', 95), ('profileQueries', False), ('profileDbHits', False), ('queryTimeout', None), ('runDeadline', None), ('runMetrics', None), ('queryProfiles', []), ('failedQueries', []), ('queryCount', 0), ('sessionTimestamp', "20240101-000000")):
+        monkeypatch.setattr(bloodcheck_core, name, value, raising=False)
+    monkeypatch.setattr(bloodcheck_core.logger, 'disabled', True)
+    return bloodcheck_core
@@ -0,0 +1,72 @@
+#  -*- coding: utf-8 -*-
+
+import os
+import time
+
+import pytest
+
+from conftest import StubDriver
+
+cypherYaml = {
+    'Description': "Enabled users",
+    'Hash': "0",
+    'Headers': ['User'],
+    'Query': "MATCH (u:User) WHERE u.enabled = true RETURN u.name AS User"
+}
+
+
+def test_cache_key_follows_the_template(bc):
+    cacheKey = bc.get_cache_key(cypherYaml, "db:1")
+    assert bc.get_cache_key(dict(cypherYaml), "db:1") == cacheKey
+    assert bc.get_cache_key(cypherYaml, "db:2") != cacheKey
+    assert bc.get_cache_key(dict(cypherYaml, Hash="1"), "db:1") != cacheKey
+    assert bc.get_cache_key(dict(cypherYaml, Query=cypherYaml['Query'] + " LIMIT 1"), "db:1") != cacheKey
+    assert bc.get_cache_key(dict(cypherYaml, Headers=['Name']), "db:1") != cacheKey
+    assert bc.get_cache_key(dict(cypherYaml, Partition={'Query': "RETURN 1 AS partition", 'SliceQuery': cypherYaml['Query']}), "db:1") != cacheKey
+
+
+def test_cached_result_is_reused(bc, monkeypatch, tmp_path):
+    monkeypatch.setattr(bc, 'resultCache', {'directory': str(tmp_path), 'identity': "db:1"})
+    driver = StubDriver(lambda CypherQuery: [{'User': "USER%s@BENCH.LOCAL" % userIndex} for userIndex in range(3)])
+    outputFileName = str(tmp_path / "first.csv")
+    parsedResult = bc.fetch_result(driver, cypherYaml, outputFileName)
+    assert parsedResult['count'] == 3 and not parsedResult.get('cached')
+    cachedFileName = str(tmp_path / "second.csv")
+    cachedResult = bc.fetch_result(driver, cypherYaml, cachedFileName)
+    assert cachedResult['cached']
+    assert cachedResult['count'] == 3
+    assert len(driver.queries) == 1
+    with open(outputFileName, 'r', encoding="utf-8") as first, open(cachedFileName, 'r', encoding="utf-8") as second:
+        assert first.read() == second.read()
+    # Another database does not share the entry
+    assert not bc.fetch_result(driver, cypherYaml, cacheIdentity="db:2").get('cached')
+    assert len(driver.queries) == 2
+
+
+def test_failed_query_leaves_no_temporary_file(bc, monkeypatch, tmp_path):
+    monkeypatch.setattr(bc, 'resultCache', {'directory': str(tmp_path), 'identity': "db:1"})
+    # Records are written to the temporary file as soon as they are read
+    monkeypatch.setattr(bc, 'resultBatchSize', 1)
+
+    def answer(CypherQuery):
+        yield {'User': "USER1@BENCH.LOCAL"}
+        raise RuntimeError("Connection reset")
+    assert bc.fetch_result(StubDriver(answer), cypherYaml) is False
+    assert os.listdir(str(tmp_path)) == []
+    # A timeout is raised to the caller once the first records were written
+    with pytest.raises(bc.QueryTimeout):
+        bc.fetch_result(StubDriver(lambda CypherQuery: [{'User': "USER1@BENCH.LOCAL"}]), cypherYaml, queryDeadline=time.perf_counter() - 1)
+    assert os.listdir(str(tmp_path)) == []
+    # Without an output file, only the cache entry is kept
+    assert bc.fetch_result(StubDriver(lambda CypherQuery: [{'User': "USER1@BENCH.LOCAL"}]), cypherYaml)['count'] == 1
+    assert sorted(os.path.splitext(fileName)[1] for fileName in os.listdir(str(tmp_path))) == [".csv", ".json"]
+
+
+def test_eviction_removes_stale_temporary_files(bc, tmp_path):
+    staleFile = tmp_path / ("0" * 64 + ".csv.tmp")
+    recentFile = tmp_path / ("1" * 64 + ".json.part")
+    staleFile.write_text("User\n")
+    recentFile.write_text("{}")
+    os.utime(str(staleFile), (time.time() - 2 * bc.cacheTempMaxAge, time.time() - 2 * bc.cacheTempMaxAge))
+    bc.evict_cache(str(tmp_path), 1024, 168)
+    assert os.listdir(str(tmp_path)) == [recentFile.name]
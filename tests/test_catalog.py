@@ -0,0 +1,58 @@
+#  -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+from conftest import templateDirectory
+
+template = """Description: %s
+Headers:
+  - User
+Query: 'MATCH (u:User) RETURN u.name AS User'
+"""
+
+
+@pytest.fixture
+def catalog(bc, monkeypatch, tmp_path):
+    monkeypatch.setattr(bc, 'catalogDirectory', str(tmp_path / "catalog"))
+    return bc
+
+
+def write_templates(templateDirectory, count):
+    os.makedirs(templateDirectory, exist_ok=True)
+    for templateIndex in range(count):
+        with open(os.path.join(templateDirectory, "template_%03d.yml" % templateIndex), 'w', encoding="utf-8") as fo:
+            fo.write(template % ("Template %03d" % templateIndex))
+
+
+def test_template_without_hash(catalog, tmp_path):
+    write_templates(str(tmp_path / "templates"), 1)
+    cypherQueries = catalog.load_query_catalog(str(tmp_path / "templates"))
+    assert [cypherYaml['Description'] for cypherYaml in cypherQueries] == ["Template 000"]
+    with pytest.raises(ValueError):
+        catalog.validate_cypher_yaml(dict(cypherQueries[0], Hash=1))
+
+
+def test_invalid_templates_are_skipped(catalog, tmp_path):
+    write_templates(str(tmp_path / "templates"), 2)
+    with open(str(tmp_path / "templates" / "template_001.yml"), 'w', encoding="utf-8") as fo:
+        fo.write("Description: No query\nHeaders: [User]\n")
+    assert len(catalog.load_query_catalog(str(tmp_path / "templates"))) == 1
+    # Cached as invalid until the file changes
+    assert len(catalog.load_query_catalog(str(tmp_path / "templates"))) == 1
+
+
+def test_parallel_parsing_matches_sequential(catalog, monkeypatch, tmp_path):
+    write_templates(str(tmp_path / "templates"), 40)
+    sequentialQueries = catalog.load_query_catalog(str(tmp_path / "templates"))
+    monkeypatch.setattr(catalog, 'catalogParallelThreshold', 1)
+    monkeypatch.setattr(catalog.os, 'cpu_count', lambda: 2)
+    monkeypatch.setattr(catalog, 'catalogDirectory', str(tmp_path / "other"))
+    assert catalog.load_query_catalog(str(tmp_path / "templates")) == sequentialQueries
+
+
+def test_catalog_reuses_parsed_templates(catalog, monkeypatch):
+    cypherQueries = catalog.load_query_catalog(templateDirectory, recursive=True)
+    monkeypatch.setattr(catalog, 'load_yaml_file', lambda yamlFile: pytest.fail("template parsed again"))
+    assert catalog.load_query_catalog(templateDirectory, recursive=True) == cypherQueries
@@ -0,0 +1,87 @@
+#  -*- coding: utf-8 -*-
+
+import pytest
+
+from conftest import StubDriver
+
+
+class ClosureGraph:
+    # Counts the closure relationships and the committed transactions of a graph with 3 member nodes
+    def __init__(self, closure=0, failing=False):
+        self.closure = closure
+        self.txId = 100
+        self.failing = failing
+
+    def answer(self, CypherQuery, nodeIds=None):
+        if "queryJmx" in CypherQuery:
+            return [{'txId': self.txId}]
+        if "MATCH (n) RETURN count(n)" in CypherQuery:
+            return [{'count': 10}]
+        if "MATCH ()-[r]->() RETURN count(r)" in CypherQuery:
+            return [{'count': 20 + self.closure}]
+        if "DELETE r" in CypherQuery:
+            deleted = min(self.closure, 10000)
+            self.closure -= deleted
+            self.txId += 1 if deleted else 0
+            return [{'deleted': deleted}]
+        if "RETURN DISTINCT id(n) AS nodeId" in CypherQuery:
+            return [{'nodeId': nodeId} for nodeId in (1, 2, 3)]
+        if "CREATE (n)-[:BloodCheck" in CypherQuery:
+            if self.failing:
+                raise RuntimeError("Transaction failed")
+            self.closure += 2 * len(nodeIds)
+            self.txId += 1
+            return [{'created': 2 * len(nodeIds)}]
+        raise AssertionError(CypherQuery)
+
+
+def test_build_and_drop(bc):
+    graph = ClosureGraph(closure=4)
+    driver = StubDriver(graph.answer)
+    assert bc.build_admin_closure(driver, batchSize=2)
+    # Relationships left by a previous run are removed first
+    assert graph.closure == 12
+    # 3 nodes by batches of 2, for each closure
+    assert driver.transactions == ["commit"] * 4
+    assert bc.drop_admin_closure(driver) == 12
+    assert graph.closure == 0
+
+
+def test_failed_build_is_removed(bc):
+    graph = ClosureGraph(failing=True)
+    driver = StubDriver(graph.answer)
+    assert not bc.build_admin_closure(driver)
+    assert driver.transactions == ["rollback"]
+    assert graph.closure == 0
+
+
+def test_closure_queries(bc):
+    cypherQueries = [
+        {'Description': "Local admins", 'Headers': ['User', 'Computer'], 'Query': "MATCH p=(u:User)-[:MemberOf|AdminTo*1..]->(c:Computer) RETURN u.name AS User, c.name AS Computer", 'ClosureQuery': "MATCH (u:User)-[:BloodCheckAdminTo]->(c:Computer) RETURN u.name AS User, c.name AS Computer", 'Partition': {'Query': "RETURN 1 AS partition"}},
+        {'Description': "Users", 'Headers': ['User'], 'Query': "MATCH (u:User) RETURN u.name AS User"}
+    ]
+    closureQueries = bc.get_closure_queries(cypherQueries)
+    assert closureQueries[0]['Query'] == cypherQueries[0]['ClosureQuery']
+    assert 'Partition' not in closureQueries[0]
+    assert closureQueries[1] is cypherQueries[1]
+    assert 'Partition' in cypherQueries[0]
+
+
+@pytest.mark.parametrize("otherWrite", [False, True])
+def test_identity_survives_the_closure(bc, tmp_path, otherWrite):
+    graph = ClosureGraph()
+    driver = StubDriver(graph.answer)
+    cacheIdentity = bc.get_cache_identity(str(tmp_path), driver)
+    assert bc.build_admin_closure(driver)
+    assert bc.get_database_identity(driver) != cacheIdentity
+    assert bc.drop_admin_closure(driver)
+    bc.store_identity_alias(str(tmp_path), cacheIdentity, driver)
+    if otherWrite:
+        graph.txId += 1
+        assert bc.get_cache_identity(str(tmp_path), driver) != cacheIdentity
+    else:
+        assert bc.get_cache_identity(str(tmp_path), driver) == cacheIdentity
+        # The next run chains its alias to the same identity
+        assert bc.build_admin_closure(driver) and bc.drop_admin_closure(driver)
+        bc.store_identity_alias(str(tmp_path), cacheIdentity, driver)
+        assert bc.get_cache_identity(str(tmp_path), driver) == cacheIdentity
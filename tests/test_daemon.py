@@ -0,0 +1,86 @@
+#  -*- coding: utf-8 -*-
+
+import json
+import os
+import socket
+import sys
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def daemon(bc, monkeypatch, tmp_path):
+    # The state run_daemon sets up, with the module level settings restored before each command
+    monkeypatch.setattr(bc, 'daemonState', {'drivers': {}, 'catalogs': {}, 'localGraphs': {}, 'openedFiles': [], 'configFile': "config", 'scriptPath': str(tmp_path / "BloodCheck.py"), 'defaults': {'previewSize': 10, 'queryTimeout': None}})
+    return bc
+
+
+def send_command(bc, request):
+    # Runs a command over a connected socket pair and returns the raw bytes streamed back to the client
+    client, connection = socket.socketpair()
+    with client:
+        client.sendall(request)
+
+        def serve():
+            with connection:
+                bc.run_daemon_command(connection)
+        daemonThread = threading.Thread(target=serve)
+        daemonThread.start()
+        response = b""
+        while True:
+            data = client.recv(65536)
+            if not data:
+                break
+            response += data
+        daemonThread.join()
+    return response
+
+
+def get_request(arguments, cwd):
+    return (json.dumps({'arguments': arguments, 'cwd': str(cwd)}) + "\n").encode("utf-8")
+
+
+def test_command_output_and_exit_code(daemon, monkeypatch, tmp_path):
+    commands = []
+
+    def main():
+        commands.append((list(sys.argv), os.getcwd(), daemon.previewSize, daemon.queryTimeout))
+        openedFile = open(str(tmp_path / "owned.txt"), 'w')
+        daemon.daemonState['openedFiles'].append(openedFile)
+        print("[+] Running é")
+        sys.exit(3)
+    monkeypatch.setattr(daemon, 'main', main)
+    # Settings left by a previous command
+    monkeypatch.setattr(daemon, 'previewSize', 50)
+    monkeypatch.setattr(daemon, 'queryTimeout', 30)
+    previousArgv = sys.argv
+    previousDirectory = os.getcwd()
+    response = send_command(daemon, get_request(["-qD", "templates"], tmp_path))
+    output, separator, exitCode = response.partition(b"\x00")
+    assert output.decode("utf-8") == "[+] Running é\n"
+    assert (separator, exitCode) == (b"\x00", b"3")
+    assert commands == [([str(tmp_path / "BloodCheck.py"), "-qD", "templates"], str(tmp_path), 10, None)]
+    # The process state is given back once the command completed
+    assert sys.argv is previousArgv
+    assert os.getcwd() == previousDirectory
+    assert daemon.daemonState['openedFiles'] == []
+
+
+@pytest.mark.parametrize("failure, exitCode, message", [
+    (SystemExit("[!] Database 'ghost' does not exist!"), b"1", "[!] Database 'ghost' does not exist!\n"),
+    (SystemExit(None), b"0", ""),
+    (RuntimeError("Unexpected error"), b"1", "[!] Error while running the command\n"),
+])
+def test_command_failures(daemon, monkeypatch, tmp_path, failure, exitCode, message):
+    def main():
+        raise failure
+    monkeypatch.setattr(daemon, 'main', main)
+    output, separator, trailer = send_command(daemon, get_request([], tmp_path)).partition(b"\x00")
+    assert output.decode("utf-8").startswith(message)
+    assert trailer == exitCode
+
+
+def test_invalid_request(daemon, monkeypatch):
+    monkeypatch.setattr(daemon, 'main', lambda: pytest.fail("Invalid requests are not run"))
+    assert send_command(daemon, b"not json\n") == b""
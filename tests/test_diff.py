@@ -0,0 +1,61 @@
+#  -*- coding: utf-8 -*-
+
+import csv
+import os
+
+import pytest
+
+headers = ['User', 'Computer']
+
+
+def write_result(fileName, rows, trailingDelimiter=False):
+    with open(fileName, 'w', encoding="utf-8", newline='') as fo:
+        csv.writer(fo, delimiter=';', lineterminator='\n').writerow(headers)
+        for row in rows:
+            fo.write(";".join(row) + (";" if trailingDelimiter else "") + "\n")
+
+
+def read_changes(diffFileName):
+    with open(diffFileName, 'r', encoding="utf-8", newline='') as fi:
+        reader = csv.reader(fi, delimiter=';')
+        assert next(reader) == ["Change"] + headers
+        return sorted(tuple(row) for row in reader)
+
+
+@pytest.fixture
+def resultFiles(tmp_path):
+    oldRows = [("USER%03d" % userIndex, "COMP%03d" % (userIndex % 7)) for userIndex in range(200)]
+    newRows = oldRows[2:] + [("USER900", "COMP001"), ("USER901", "COMP002"), oldRows[10]]
+    oldFileName = str(tmp_path / "old.csv")
+    newFileName = str(tmp_path / "new.csv")
+    # Older runs end each row with a delimiter
+    write_result(oldFileName, oldRows, trailingDelimiter=True)
+    write_result(newFileName, newRows)
+    return oldFileName, newFileName
+
+
+expectedChanges = [("+", "USER010", "COMP003"), ("+", "USER900", "COMP001"), ("+", "USER901", "COMP002"), ("-", "USER000", "COMP000"), ("-", "USER001", "COMP001")]
+
+
+@pytest.mark.parametrize("diffChunkSize", [64 * 1024 * 1024, 10, 500])
+def test_diff_result_files(bc, monkeypatch, tmp_path, resultFiles, diffChunkSize):
+    # Small chunk sizes split the files into several buckets, which must give the same changes
+    monkeypatch.setattr(bc, 'diffChunkSize', diffChunkSize)
+    diffFileName = str(tmp_path / "diff.csv")
+    diffCounts = bc.diff_result_files(resultFiles[0], resultFiles[1], diffFileName)
+    assert diffCounts == {'old': 200, 'new': 201, 'added': 3, 'removed': 2}
+    assert read_changes(diffFileName) == expectedChanges
+
+
+def test_diff_missing_result(bc, monkeypatch, tmp_path, resultFiles):
+    monkeypatch.setattr(bc, 'diffChunkSize', 10)
+    diffFileName = str(tmp_path / "diff.csv")
+    diffCounts = bc.diff_result_files(None, resultFiles[1], diffFileName)
+    assert diffCounts == {'old': 0, 'new': 201, 'added': 201, 'removed': 0}
+
+
+def test_identical_results_write_no_diff(bc, monkeypatch, tmp_path, resultFiles):
+    monkeypatch.setattr(bc, 'diffChunkSize', 10)
+    diffFileName = str(tmp_path / "diff.csv")
+    assert bc.diff_result_files(resultFiles[1], resultFiles[1], diffFileName)['added'] == 0
+    assert not os.path.exists(diffFileName)
@@ -0,0 +1,90 @@
+#  -*- coding: utf-8 -*-
+
+import pytest
+
+from conftest import StubDriver
+
+cacheYaml = {'Description': "Nodes distributions", 'Hash': "0", 'Headers': ['Node Type', 'Number Of Nodes'], 'Query': "MATCH (n) RETURN labels(n) AS `Node Type`, count(n) AS `Number Of Nodes`", 'Estimate': {'CountStore': True}}
+
+
+def get_records(records):
+    return dict((record['Statistic'], (record['Estimate'], record['Lower bound'], record['Upper bound'])) for record in records)
+
+
+def test_proportion_interval(bc):
+    records = get_records(bc.get_estimate_records({'Domain Admins': dict((nodeId, True) for nodeId in range(20))}, 200, 10000))
+    estimate, lowerBound, upperBound = records['Domain Admins (%)']
+    assert estimate == 10.0
+    assert 5 < lowerBound < estimate < upperBound < 16
+    assert records['Domain Admins (count)'] == (1000.0, pytest.approx(lowerBound * 100, abs=1), pytest.approx(upperBound * 100, abs=1))
+
+
+def test_interval_narrows_with_confidence(bc, monkeypatch):
+    statistics = {'Domain Admins': dict((nodeId, True) for nodeId in range(20))}
+    monkeypatch.setattr(bc, 'estimateConfidence', 99)
+    wideBounds = get_records(bc.get_estimate_records(statistics, 200, 10000))['Domain Admins (%)']
+    monkeypatch.setattr(bc, 'estimateConfidence', 90)
+    narrowBounds = get_records(bc.get_estimate_records(statistics, 200, 10000))['Domain Admins (%)']
+    assert wideBounds[1] < narrowBounds[1] and narrowBounds[2] < wideBounds[2]
+
+
+def test_full_sample_is_exact(bc):
+    # The finite population correction removes the sampling error when every node is sampled
+    records = get_records(bc.get_estimate_records({'Admin count': {0: 4, 1: 2}, 'Admins': {0: True}}, 10, 10))
+    assert records['Admin count (mean)'] == (0.6, 0.6, 0.6)
+    assert records['Admin count (total)'] == (6.0, 6.0, 6.0)
+    assert records['Admins (%)'] == (10.0, 10.0, 10.0)
+
+
+def test_mean_interval(bc):
+    records = get_records(bc.get_estimate_records({'Admin count': dict((nodeId, nodeId % 5) for nodeId in range(100))}, 100, 100000))
+    estimate, lowerBound, upperBound = records['Admin count (mean)']
+    assert estimate == 2.0
+    assert lowerBound == pytest.approx(2.0 - 1.96 * (2.0202 / 100) ** 0.5, abs=0.01)
+    assert upperBound == pytest.approx(2.0 + 1.96 * (2.0202 / 100) ** 0.5, abs=0.01)
+
+
+def test_statistics_without_rows(bc):
+    # Without any value, proportions are told apart from the Proportions section of the template
+    records = get_records(bc.get_estimate_records({'Domain Admins': {}, 'Admin count': {}}, 100, 1000, ['Domain Admins']))
+    assert records['Domain Admins (%)'][:2] == (0.0, 0.0)
+    assert records['Domain Admins (%)'][2] > 0
+    assert records['Admin count (mean)'] == (0.0, 0.0, 0.0)
+    assert 'Admin count (%)' not in records
+
+
+def test_empty_population(bc):
+    records = get_records(bc.get_estimate_records({'Domain Admins': {}}, 0, 0, ['Domain Admins']))
+    assert records == {'Domain Admins': (0.0, 0.0, 0.0)}
+
+
+def test_cache_key_separates_estimates(bc, monkeypatch):
+    exactKey = bc.get_cache_key(cacheYaml, "db:1")
+    monkeypatch.setattr(bc, 'estimateMode', True)
+    estimateKey = bc.get_cache_key(cacheYaml, "db:1")
+    assert estimateKey != exactKey
+    monkeypatch.setattr(bc, 'sampleSize', 500)
+    assert bc.get_cache_key(cacheYaml, "db:1") != estimateKey
+    monkeypatch.setattr(bc, 'sampleSize', 1000)
+    monkeypatch.setattr(bc, 'estimateConfidence', 99)
+    assert bc.get_cache_key(cacheYaml, "db:1") != estimateKey
+
+
+def test_estimate_query_samples_the_population(bc, monkeypatch):
+    monkeypatch.setattr(bc, 'estimateMode', True)
+    monkeypatch.setattr(bc, 'sampleSize', 50)
+
+    def answer(CypherQuery, rate=None, sample=None):
+        if "count(n)" in CypherQuery:
+            return [{'count': 400}]
+        if sample is None:
+            return [{'nodeId': nodeId} for nodeId in range(400) if nodeId % 4 == 0]
+        return [{'node': nodeId, 'Domain Admins': True} for nodeId in sample if nodeId % 8 == 0]
+    cypherYaml = {'Description': "Percentage of Domain Admins", 'Headers': ['DA Percentage'], 'Query': "RETURN 1", 'Estimate': {'Population': "User", 'Proportions': ['Domain Admins'], 'Query': "MATCH (u:User) WHERE id(u) IN $sample RETURN id(u) AS node, true AS `Domain Admins`"}}
+    estimateYaml = bc.get_estimate_queries([cypherYaml])[0]
+    assert estimateYaml['Headers'] == bc.estimateHeaders
+    driver = StubDriver(answer)
+    parsedResult = bc.fetch_result(driver, estimateYaml)
+    records = get_records(dict(zip(bc.estimateHeaders, row)) for row in parsedResult['preview'])
+    assert len(driver.queries[-1][1]['sample']) == 50
+    assert records['Domain Admins (%)'][0] == pytest.approx(50.0, abs=20)
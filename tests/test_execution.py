@@ -0,0 +1,28 @@
+#  -*- coding: utf-8 -*-
+
+import os
+
+import benchmark
+from conftest import templateDirectory
+
+
+def run_templates(bc, driver, outputDirectory, workers):
+    os.makedirs(outputDirectory)
+    cypherQueries = bc.load_yaml_folder(templateDirectory, recursive=True)
+    queryResults = bc.execute_queries(driver, cypherQueries, str(outputDirectory), workers, firstQueryIndex=0, showResults=False)
+    outputFiles = {}
+    for fileName in sorted(os.listdir(outputDirectory)):
+        with open(os.path.join(outputDirectory, fileName), 'r', encoding="utf-8") as fi:
+            outputFiles[fileName] = fi.read()
+    return [(parsedResult['queryIndex'], parsedResult['count'], parsedResult['preview']) for parsedResult in queryResults], outputFiles
+
+
+def test_parallel_matches_sequential(bc, monkeypatch, tmp_path):
+    monkeypatch.setattr(bc, 'saveResults', True)
+    driver = benchmark.MemoryDriver(benchmark.generate_graph(users=200, computers=100, groups=20))
+    sequentialResults, sequentialFiles = run_templates(bc, driver, tmp_path / "sequential", 1)
+    parallelResults, parallelFiles = run_templates(bc, driver, tmp_path / "parallel", 4)
+    assert sequentialResults
+    assert parallelResults == sequentialResults
+    assert parallelFiles == sequentialFiles
+    assert [queryIndex for queryIndex, count, preview in parallelResults] == sorted(queryIndex for queryIndex, count, preview in parallelResults)
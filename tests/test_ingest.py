@@ -0,0 +1,106 @@
+#  -*- coding: utf-8 -*-
+
+import json
+import zipfile
+
+import pytest
+
+groups = [
+    {
+        'ObjectIdentifier': "S-1-5-21-1-512",
+        'Properties': {'name': "DOMAIN ADMINS@BENCH.LOCAL", 'domain': "BENCH.LOCAL", 'highvalue': True, 'extra': {'ignored': True}},
+        'Members': [{'ObjectIdentifier': "s-1-5-21-1-1001", 'ObjectType': "User"}, {'ObjectIdentifier': "S-1-5-21-1-1105", 'ObjectType': "Group"}],
+        'Aces': [{'PrincipalSID': "S-1-5-21-1-519", 'PrincipalType': "Group", 'RightName': "GenericAll", 'IsInherited': False}]
+    },
+    {
+        'ObjectIdentifier': "S-1-5-21-1-1105",
+        'Properties': {'name': "HELPDESK@BENCH.LOCAL", 'description': "Helpdesk \"team\", level 1 é", 'serviceprincipalnames': ["HTTP/a", None, 1]},
+        'Members': [],
+        'Aces': []
+    }
+]
+computers = [
+    {
+        'ObjectIdentifier': "S-1-5-21-1-2001",
+        'Properties': {'name': "SRV01.BENCH.LOCAL"},
+        'PrimaryGroupSID': "S-1-5-21-1-515",
+        'LocalAdmins': {'Results': [{'ObjectIdentifier': "S-1-5-21-1-1105", 'ObjectType': "Group"}], 'Collected': True},
+        'Sessions': {'Results': [{'UserSID': "S-1-5-21-1-1001", 'ComputerSID': "S-1-5-21-1-2001"}], 'Collected': True}
+    }
+]
+
+
+def write_collection(path, items, objectType, version=5):
+    with open(path, 'w', encoding="utf-8") as fo:
+        json.dump({'data': items, 'meta': {'type': objectType, 'count': len(items), 'version': version}}, fo, indent=1)
+
+
+@pytest.mark.parametrize("chunkSize", [7, 64, 1024 * 1024])
+def test_read_items_across_chunks(bc, tmp_path, chunkSize):
+    collectionFile = str(tmp_path / "20240101_groups.json")
+    write_collection(collectionFile, groups, "groups")
+    assert list(bc.read_ingest_items(collectionFile, chunkSize=chunkSize)) == [("groups", group) for group in groups]
+
+
+def test_read_items_with_meta_first(bc, tmp_path):
+    # The object type is read from the meta section when the file name does not tell it
+    collectionFile = str(tmp_path / "collection.json")
+    with open(collectionFile, 'w', encoding="utf-8-sig") as fo:
+        fo.write(json.dumps({'meta': {'type': "computers"}, 'data': computers}))
+    assert [objectType for objectType, item in bc.read_ingest_items(collectionFile, chunkSize=16)] == ["computers"]
+
+
+def test_read_bloodhound3_items(bc, tmp_path):
+    collectionFile = str(tmp_path / "legacy.json")
+    with open(collectionFile, 'w', encoding="utf-8") as fo:
+        json.dump({'computers': computers, 'meta': {'type': "computers", 'count': 1}}, fo)
+    assert list(bc.read_ingest_items(collectionFile, chunkSize=32)) == [("computers", computers[0])]
+
+
+def test_read_zip_members(bc, tmp_path):
+    collectionZip = str(tmp_path / "collection.zip")
+    with zipfile.ZipFile(collectionZip, 'w') as zipFile:
+        zipFile.writestr("20240101_groups.json", json.dumps({'data': groups, 'meta': {'type': "groups"}}))
+        zipFile.writestr("20240101_computers.json", json.dumps({'data': computers, 'meta': {'type': "computers"}}))
+        zipFile.writestr("readme.txt", "not a collection")
+    ingestFiles = bc.get_ingest_files([collectionZip])
+    assert ingestFiles == [(collectionZip, "20240101_computers.json"), (collectionZip, "20240101_groups.json")]
+    items = [item for ingestPath, memberName in ingestFiles for item in bc.read_ingest_items(ingestPath, memberName, chunkSize=50)]
+    assert [objectType for objectType, item in items] == ["computers", "groups", "groups"]
+
+
+def test_truncated_collection(bc, tmp_path):
+    collectionFile = str(tmp_path / "groups.json")
+    with open(collectionFile, 'w', encoding="utf-8") as fo:
+        fo.write(json.dumps({'data': groups})[:-20])
+    with pytest.raises(ValueError):
+        list(bc.read_ingest_items(collectionFile, chunkSize=32))
+
+
+def test_group_rows(bc):
+    nodes, edges = bc.get_ingest_rows("groups", groups[0])
+    assert nodes == [("Group", "S-1-5-21-1-512", {'name': "DOMAIN ADMINS@BENCH.LOCAL", 'domain': "BENCH.LOCAL", 'highvalue': True, 'objectid': "S-1-5-21-1-512"})]
+    assert ("User", "MemberOf", "Group", "S-1-5-21-1-1001", "S-1-5-21-1-512", {'isacl': False}) in edges
+    assert ("Group", "MemberOf", "Group", "S-1-5-21-1-1105", "S-1-5-21-1-512", {'isacl': False}) in edges
+    assert ("Group", "GenericAll", "Group", "S-1-5-21-1-519", "S-1-5-21-1-512", {'isacl': True, 'isinherited': False}) in edges
+    assert len(edges) == 3
+
+
+def test_mixed_list_properties(bc):
+    nodes, edges = bc.get_ingest_rows("groups", groups[1])
+    assert nodes[0][2]['serviceprincipalnames'] == ["HTTP/a", "1"]
+    assert edges == []
+
+
+def test_computer_rows(bc):
+    nodes, edges = bc.get_ingest_rows("computers", computers[0])
+    assert nodes[0][:2] == ("Computer", "S-1-5-21-1-2001")
+    assert sorted(edge[:5] for edge in edges) == [
+        ("Computer", "HasSession", "User", "S-1-5-21-1-2001", "S-1-5-21-1-1001"),
+        ("Computer", "MemberOf", "Group", "S-1-5-21-1-2001", "S-1-5-21-1-515"),
+        ("Group", "AdminTo", "Computer", "S-1-5-21-1-1105", "S-1-5-21-1-2001")
+    ]
+
+
+def test_object_without_identifier(bc):
+    assert bc.get_ingest_rows("users", {'Properties': {'name': "GHOST"}}) == ([], [])
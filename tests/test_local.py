@@ -0,0 +1,84 @@
+#  -*- coding: utf-8 -*-
+
+import pytest
+
+# The local engine is optional and needs numpy
+pytest.importorskip("numpy")
+
+nodes = [
+    (['User'], {'name': "ALICE@BENCH.LOCAL", 'enabled': True, 'owned': True, 'description': "Admin account"}),
+    (['User'], {'name': "BOB@BENCH.LOCAL", 'enabled': False}),
+    (['User'], {'name': "CAROL@BENCH.LOCAL", 'enabled': True, 'description': "Helpdesk"}),
+    (['Group'], {'name': "HELPDESK@BENCH.LOCAL", 'objectid': "S-1-5-21-1-1105"}),
+    (['Group'], {'name': "SERVER ADMINS@BENCH.LOCAL", 'objectid': "S-1-5-21-1-1106"}),
+    (['Group'], {'name': "DOMAIN ADMINS@BENCH.LOCAL", 'objectid': "S-1-5-21-1-512"}),
+    (['Computer'], {'name': "SRV01.BENCH.LOCAL", 'pwdlastset': 1700000000}),
+    (['Computer'], {'name': "WKS01.BENCH.LOCAL", 'pwdlastset': None}),
+]
+edges = [
+    (0, 'MemberOf', 3),
+    (3, 'MemberOf', 4),
+    (4, 'AdminTo', 6),
+    (1, 'AdminTo', 7),
+    (2, 'MemberOf', 3),
+    (0, 'MemberOf', 5),
+]
+
+
+@pytest.fixture
+def localGraph(bc):
+    return bc.build_local_graph(nodes, edges)
+
+
+def run_local(bc, localGraph, headers, **localSpec):
+    records = bc.run_local_query(localGraph, {'Description': "Local", 'Headers': headers, 'Query': "", 'Local': localSpec})
+    assert records is not False
+    return [tuple(record[header] for header in headers) for record in records]
+
+
+@pytest.mark.parametrize("localFilter, names", [
+    ("u.enabled = true", ["ALICE", "CAROL"]),
+    ("u.enabled <> true", ["BOB"]),
+    ("u.description IS NULL", ["BOB"]),
+    ("u.description IS NOT NULL", ["ALICE", "CAROL"]),
+    ('u.description CONTAINS "Admin"', ["ALICE"]),
+    ('u.name STARTS WITH "BOB"', ["BOB"]),
+    ('u.name ENDS WITH "@BENCH.LOCAL"', ["ALICE", "BOB", "CAROL"]),
+    ('u.description =~ "(?i)help.*"', ["CAROL"]),
+    ('NOT u.name STARTS WITH "A"', ["BOB", "CAROL"]),
+])
+def test_local_filters(bc, localGraph, localFilter, names):
+    records = run_local(bc, localGraph, ['User'], Match=["(u:User)"], Where=[localFilter], Return=["u.name"], OrderBy="User")
+    assert records == [(name + "@BENCH.LOCAL",) for name in names]
+
+
+def test_local_membership_closure(bc, localGraph):
+    records = run_local(bc, localGraph, ['User', 'Group'], Match=["(u:User)-[MemberOf*]->(g:Group)"], Where=['u.name STARTS WITH "ALICE"'], Return=["u.name", "g.name"], OrderBy="Group")
+    assert records == [("ALICE@BENCH.LOCAL", "DOMAIN ADMINS@BENCH.LOCAL"), ("ALICE@BENCH.LOCAL", "HELPDESK@BENCH.LOCAL"), ("ALICE@BENCH.LOCAL", "SERVER ADMINS@BENCH.LOCAL")]
+
+
+def test_local_admin_closure(bc, localGraph):
+    # One row per principal and computer pair, whatever the number of paths
+    records = run_local(bc, localGraph, ['User', 'Computer'], Match=["(u:User)-[MemberOf|AdminTo*]->(c:Computer)"], Return=["u.name", "c.name"], OrderBy="User")
+    assert records == [("ALICE@BENCH.LOCAL", "SRV01.BENCH.LOCAL"), ("BOB@BENCH.LOCAL", "WKS01.BENCH.LOCAL"), ("CAROL@BENCH.LOCAL", "SRV01.BENCH.LOCAL")]
+
+
+def test_local_zero_length_paths(bc, localGraph):
+    records = run_local(bc, localGraph, ['Principal', 'Admin count'], Match=["(n)-[MemberOf*0..]->()-[AdminTo]->(c:Computer)"], Return=["n.name", "count(DISTINCT c)"], OrderBy="Principal")
+    assert records == [("ALICE@BENCH.LOCAL", 1), ("BOB@BENCH.LOCAL", 1), ("CAROL@BENCH.LOCAL", 1), ("HELPDESK@BENCH.LOCAL", 1), ("SERVER ADMINS@BENCH.LOCAL", 1)]
+
+
+def test_local_without(bc, localGraph):
+    records = run_local(bc, localGraph, ['User'], Match=["(u:User)"], Without=[{'Match': "(u)-[MemberOf*]->(g:Group)", 'Where': ['g.objectid ENDS WITH "-512"']}], Return=["u.name"], OrderBy="User")
+    assert records == [("BOB@BENCH.LOCAL",), ("CAROL@BENCH.LOCAL",)]
+
+
+def test_local_order_and_limit(bc, localGraph):
+    # Null values come first in descending orders, as in Neo4j
+    records = run_local(bc, localGraph, ['Computer', 'Password last set'], Match=["(c:Computer)"], Return=["c.name", "c.pwdlastset"], OrderBy="Password last set", Descending=True, Limit=1)
+    assert records == [("WKS01.BENCH.LOCAL", None)]
+
+
+def test_local_collect(bc, localGraph):
+    records = run_local(bc, localGraph, ['Group', 'Members'], Match=["(u:User)-[MemberOf]->(g:Group)"], Where=['g.name STARTS WITH "HELPDESK"'], Return=["g.name", "collect(u.name)"])
+    assert [(group, sorted(members)) for group, members in records] == [("HELPDESK@BENCH.LOCAL", ["ALICE@BENCH.LOCAL", "CAROL@BENCH.LOCAL"])]
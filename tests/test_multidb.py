@@ -0,0 +1,75 @@
+#  -*- coding: utf-8 -*-
+
+import threading
+
+import pytest
+
+from conftest import StubDriver
+
+cypherQueries = [
+    {'Description': "Enabled users", 'Hash': "0", 'Headers': ['User'], 'Query': "MATCH (u:User) WHERE u.enabled = true RETURN u.name AS User"},
+    {'Description': "Computers", 'Hash': "0", 'Headers': ['Computer'], 'Query': "MATCH (c:Computer) RETURN c.name AS Computer"}
+]
+databaseSizes = {'alpha.db': 3, 'beta.db': 5, 'gamma.db': 0, 'delta.db': 2}
+
+
+@pytest.fixture
+def instances(bc, monkeypatch, tmp_path):
+    # Two local instances, each restart loads the database set in its configuration file
+    instances = []
+    for instanceIndex in range(2):
+        confFile = tmp_path / ("neo4j-%s.conf" % instanceIndex)
+        confFile.write_text("dbms.active_database=graph.db\n")
+        instances.append({'Name': "neo4j-%s" % instanceIndex, 'URI': "bolt://localhost:%s" % (7687 + instanceIndex), 'User': "neo4j", 'Pass': "neo4j", 'ConfFile': str(confFile)})
+    state = {'loaded': {}, 'restarts': [], 'drivers': [], 'comparison': None, 'lock': threading.Lock()}
+
+    def restart_instance(instance, restartTimeout):
+        with state['lock']:
+            state['restarts'].append(instance['Name'])
+        DBName = bc.get_active_database(instance['ConfFile'])
+        state['loaded'][instance['URI']] = DBName
+        return DBName != "delta.db"
+
+    def get_driver(URI, auth=None):
+        DBName = state['loaded'][URI]
+
+        def answer(CypherQuery):
+            label = "Computer" if "Computer" in CypherQuery else "User"
+            return [{label: "%s%s@%s" % (label.upper(), rowIndex, DBName)} for rowIndex in range(databaseSizes[DBName] * (2 if label == "Computer" else 1))]
+        driver = StubDriver(answer)
+        driver.closed = False
+        driver.close = lambda: setattr(driver, 'closed', True)
+        with state['lock']:
+            state['drivers'].append(driver)
+        return driver
+    monkeypatch.setattr(bc, 'restart_instance', restart_instance)
+    monkeypatch.setattr(bc.neo4j.GraphDatabase, 'driver', get_driver)
+    monkeypatch.setattr(bc, 'show_database_comparison', lambda DBNames, DBCounts, cypherQueries, outputDirectory: state.update(comparison=(DBNames, dict(DBCounts))))
+    return instances, state
+
+
+def test_databases_fan_out_over_instances(bc, instances, tmp_path):
+    instances, state = instances
+    DBNames = ['alpha.db', 'beta.db', 'gamma.db', 'delta.db']
+    bc.run_multi_database(instances, DBNames, cypherQueries, str(tmp_path), 2, 60, str(tmp_path))
+    comparedDBs, DBCounts = state['comparison']
+    assert comparedDBs == DBNames
+    assert DBCounts == {'alpha.db': {0: 3, 1: 6}, 'beta.db': {0: 5, 1: 10}, 'gamma.db': {}, 'delta.db': None}
+    # One driver per database that came up, closed once its queries completed
+    assert len(state['drivers']) == 3
+    assert all(driver.closed for driver in state['drivers'])
+    # Every instance is put back on its original database
+    assert [bc.get_active_database(instance['ConfFile']) for instance in instances] == ["graph.db", "graph.db"]
+
+
+def test_failed_database_does_not_stop_the_others(bc, instances, monkeypatch, tmp_path):
+    instances, state = instances
+    runDatabaseQueries = bc.run_database_queries
+
+    def run_database_queries(instance, DBName, *args):
+        if DBName == "alpha.db":
+            raise RuntimeError("Unexpected error")
+        return runDatabaseQueries(instance, DBName, *args)
+    monkeypatch.setattr(bc, 'run_database_queries', run_database_queries)
+    bc.run_multi_database(instances[:1], ['alpha.db', 'beta.db'], cypherQueries, str(tmp_path), 1, 60, str(tmp_path))
+    assert state['comparison'][1] == {'alpha.db': None, 'beta.db': {0: 5, 1: 10}}
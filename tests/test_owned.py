@@ -0,0 +1,80 @@
+#  -*- coding: utf-8 -*-
+
+import re
+
+import pytest
+
+from conftest import StubDriver
+
+
+class OwnedGraph:
+    # Applies the SET and REMOVE of each label of the UNION to nodes kept by label and name
+    def __init__(self):
+        self.nodes = {
+            'User': {"ALICE@BENCH.LOCAL": {}, "BOB@BENCH.LOCAL": {'owned': True, 'wave': "0"}},
+            'Computer': {"SRV01.BENCH.LOCAL": {}},
+            'OU': {"SERVERS@BENCH.LOCAL": {}},
+            'GPO': {"DEFAULT DOMAIN POLICY@BENCH.LOCAL": {}},
+            'Domain': {"BENCH.LOCAL": {}}
+        }
+
+    def answer(self, CypherQuery, principals):
+        records = []
+        for labelQuery in CypherQuery.split("UNION ALL"):
+            label = re.search(r"MATCH \(n:(\w+) \{name: principal\.name\}\)", labelQuery).group(1)
+            matched = []
+            for principal in principals:
+                properties = self.nodes.get(label, {}).get(principal['name'])
+                if properties is None:
+                    continue
+                if "SET n.owned = true" in labelQuery:
+                    properties['owned'] = True
+                    properties['wave'] = principal['wave'] or properties.get('wave')
+                elif "REMOVE n.owned, n.wave" in labelQuery:
+                    properties.pop('owned', None)
+                    properties.pop('wave', None)
+                matched.append(principal['name'])
+            records.append({'matched': matched})
+        return records
+
+
+@pytest.fixture
+def ownedFile(tmp_path):
+    ownedFile = tmp_path / "owned.txt"
+    ownedFile.write_text("alice@bench.local;1\n\nSRV01.BENCH.LOCAL\nservers@bench.local;2\nDEFAULT DOMAIN POLICY@BENCH.LOCAL\nbench.local\nghost@bench.local\n", encoding="utf-8")
+    return str(ownedFile)
+
+
+def test_owned_query_covers_each_label(bc):
+    CypherQuery = bc.get_owned_query("SET n.owned = true")
+    assert [re.search(r"MATCH \(n:(\w+)", labelQuery).group(1) for labelQuery in CypherQuery.split("UNION ALL")] == bc.ownedLabels
+    assert {'OU', 'GPO', 'Domain'} <= set(bc.ownedLabels)
+
+
+def test_inject_and_undo(bc, ownedFile, capsys):
+    graph = OwnedGraph()
+    driver = StubDriver(graph.answer)
+    bc.inject_owned(driver.session(), ownedFile, batchSize=2)
+    assert graph.nodes['User']["ALICE@BENCH.LOCAL"] == {'owned': True, 'wave': "1"}
+    assert graph.nodes['Computer']["SRV01.BENCH.LOCAL"] == {'owned': True, 'wave': None}
+    assert graph.nodes['OU']["SERVERS@BENCH.LOCAL"] == {'owned': True, 'wave': "2"}
+    assert graph.nodes['GPO']["DEFAULT DOMAIN POLICY@BENCH.LOCAL"]['owned']
+    assert graph.nodes['Domain']["BENCH.LOCAL"]['owned']
+    # 6 principales by batches of 2, one transaction each
+    assert driver.transactions == ["commit"] * 3
+    output = capsys.readouterr().out
+    assert "[+] 5 nodes set as owned, 1 not found" in output
+    assert "[!] [GHOST@BENCH.LOCAL] node not found" in output
+    bc.undo_owned(driver.session(), ownedFile, batchSize=1000)
+    assert all(properties == {} for label in ('OU', 'GPO', 'Domain', 'Computer') for properties in graph.nodes[label].values())
+    assert graph.nodes['User'] == {"ALICE@BENCH.LOCAL": {}, "BOB@BENCH.LOCAL": {'owned': True, 'wave': "0"}}
+    assert "[+] 5 nodes reset, 1 not found" in capsys.readouterr().out
+
+
+def test_failed_batch_is_rolled_back(bc, ownedFile):
+    def answer(CypherQuery, principals):
+        raise RuntimeError("Transaction failed")
+    driver = StubDriver(answer)
+    with pytest.raises(RuntimeError):
+        bc.inject_owned(driver.session(), ownedFile)
+    assert driver.transactions == ["rollback"]
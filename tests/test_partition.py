@@ -0,0 +1,60 @@
+#  -*- coding: utf-8 -*-
+
+import threading
+import time
+
+from conftest import StubDriver
+
+
+def get_partitioned_driver(peakSlices):
+    runningSlices = []
+    lock = threading.Lock()
+
+    def answer(CypherQuery, partition=None):
+        if partition is None:
+            return [{'partition': list(range(start, start + 5))} for start in range(0, 50, 5)]
+        with lock:
+            runningSlices.append(partition)
+            peakSlices[0] = max(peakSlices[0], len(runningSlices))
+        # Later slices complete first, the merged records must still follow the partition order
+        time.sleep(0.001 * (50 - partition[0]) / 5)
+        with lock:
+            runningSlices.remove(partition)
+        return [{'Name': "node%02d" % nodeId, 'Value': nodeId % 7} for nodeId in partition]
+    return StubDriver(answer)
+
+
+def get_partitioned_yaml(**partitionSpec):
+    return {
+        'Description': "Partitioned",
+        'Hash': "0",
+        'Headers': ['Name', 'Value'],
+        'Query': "MATCH (n) RETURN n.name AS Name, n.value AS Value",
+        'Partition': dict({'Query': "MATCH (n) RETURN collect(id(n)) AS partition", 'SliceQuery': "MATCH (n) WHERE id(n) IN $partition RETURN n.name AS Name, n.value AS Value"}, **partitionSpec)
+    }
+
+
+def test_partitions_keep_order(bc):
+    for workers in (1, 3):
+        peakSlices = [0]
+        cypherYaml = get_partitioned_yaml(Workers=workers)
+        bc.validate_cypher_yaml(cypherYaml)
+        records = list(bc.run_partitioned_query(get_partitioned_driver(peakSlices), cypherYaml, cypherYaml['Partition']['SliceQuery'], {'dbHits': []}))
+        assert [record['Name'] for record in records] == ["node%02d" % nodeId for nodeId in range(50)]
+        assert peakSlices[0] <= workers
+
+
+def test_partitions_merge_order_and_limit(bc):
+    cypherYaml = get_partitioned_yaml(Workers=3, OrderBy='Value', Descending=True, Limit=8)
+    bc.validate_cypher_yaml(cypherYaml)
+    records = bc.run_partitioned_query(get_partitioned_driver([0]), cypherYaml, cypherYaml['Partition']['SliceQuery'], {'dbHits': []})
+    assert [record['Value'] for record in records] == [6] * 7 + [5]
+    assert [record['Name'] for record in records][:7] == ["node%02d" % nodeId for nodeId in range(6, 50, 7)]
+
+
+def test_partitioned_template_runs_slice_query(bc):
+    driver = get_partitioned_driver([0])
+    parsedResult = bc.fetch_result(driver, get_partitioned_yaml(Workers=2))
+    assert parsedResult['count'] == 50
+    assert all('$partition' in CypherQuery for CypherQuery, parameters in driver.queries if 'partition' in parameters)
+    assert not any(CypherQuery == get_partitioned_yaml()['Query'] for CypherQuery, parameters in driver.queries)
@@ -0,0 +1,40 @@
+#  -*- coding: utf-8 -*-
+
+import os
+import sys
+import zipfile
+
+import pytest
+
+
+@pytest.fixture
+def neo4jDBPath(bc, monkeypatch, tmp_path):
+    # The clean archive is looked up next to the script, the databases live in data/databases
+    with zipfile.ZipFile(str(tmp_path / "Clean.graphdb.zip"), 'w') as zipFile:
+        zipFile.writestr("neostore", "store")
+        zipFile.writestr("schema/index/label.db", "index")
+    monkeypatch.setattr(sys, 'argv', [str(tmp_path / "BloodCheck.py")])
+    monkeypatch.setattr(bc, 'change_directory_ownership', lambda directoryPath: None)
+    neo4jDBPath = tmp_path / "data" / "databases"
+    (neo4jDBPath / "existing.db").mkdir(parents=True)
+    return str(neo4jDBPath)
+
+
+def test_databases_are_cloned_from_the_template(bc, neo4jDBPath):
+    DBlist = ["existing.db"]
+    assert bc.generate_database(neo4jDBPath, DBlist, ["alpha", "beta", "alpha"])
+    assert DBlist == ["existing.db", "alpha", "beta"]
+    for DBName in ("alpha", "beta"):
+        with open(os.path.join(neo4jDBPath, DBName, "schema", "index", "label.db"), 'r') as fi:
+            assert fi.read() == "index"
+        assert not os.path.exists(os.path.join(neo4jDBPath, DBName, ".bloodcheck-archive"))
+    assert os.path.isfile(os.path.join(os.path.dirname(neo4jDBPath), "bloodcheck-template", ".bloodcheck-archive"))
+
+
+def test_invalid_names_skip_the_extraction(bc, neo4jDBPath, monkeypatch, capsys):
+    extractions = []
+    monkeypatch.setattr(bc, 'get_template_database', lambda neo4jDBPath, cleanDBPath: extractions.append(cleanDBPath))
+    assert bc.generate_database(neo4jDBPath, ["existing.db"], ["existing.db", "bad.name", "../outside", ""]) is False
+    assert extractions == []
+    assert "[!] No valid database name provided!" in capsys.readouterr().out
+    assert sorted(os.listdir(os.path.dirname(neo4jDBPath))) == ["databases"]
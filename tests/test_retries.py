@@ -0,0 +1,88 @@
+#  -*- coding: utf-8 -*-
+
+import os
+import time
+
+import neo4j
+import pytest
+
+from conftest import StubDriver
+
+cypherYaml = {'Description': "Kerberoastable users", 'Hash': "0", 'Headers': ['User'], 'Query': "MATCH (u:User) WHERE u.hasspn = true RETURN u.name AS User"}
+
+
+@pytest.fixture
+def noDelay(bc, monkeypatch):
+    monkeypatch.setattr(bc, 'retryDelay', 0.0)
+    return bc
+
+
+def get_flaky_driver(attemptRows):
+    # Each attempt streams its rows, and fails after them when its rows end with an exception
+    attempts = []
+
+    def answer(CypherQuery):
+        rows = attemptRows[len(attempts)]
+        attempts.append(CypherQuery)
+        for row in rows:
+            if isinstance(row, Exception):
+                raise row
+            yield {'User': row}
+    return StubDriver(answer), attempts
+
+
+def test_transient_error_is_retried(noDelay, tmp_path):
+    driver, attempts = get_flaky_driver([["USER1", neo4j.exceptions.ServiceUnavailable("connection lost")], ["USER1", "USER2"]])
+    outputFileName = str(tmp_path / "result.csv")
+    parsedResult, status, attemptCount, error = noDelay.fetch_result_with_retries(driver, cypherYaml, outputFileName)
+    assert (status, attemptCount, parsedResult['count']) == ('ok', 2, 2)
+    with open(outputFileName, 'r', encoding="utf-8") as fi:
+        assert fi.read().splitlines() == ["User", "USER1", "USER2"]
+
+
+def test_partial_rows_are_removed_before_retry(noDelay, monkeypatch, tmp_path):
+    # A retry returning no row does not write any file, the rows of the failed attempt must not be left behind
+    monkeypatch.setattr(noDelay, 'resultBatchSize', 1)
+    driver, attempts = get_flaky_driver([["USER1", "USER2", neo4j.exceptions.ServiceUnavailable("connection lost")], []])
+    outputFileName = str(tmp_path / "result.csv")
+    parsedResult, status, attemptCount, error = noDelay.fetch_result_with_retries(driver, cypherYaml, outputFileName)
+    assert (status, attemptCount, parsedResult['count']) == ('ok', 2, 0)
+    assert not os.path.exists(outputFileName)
+
+
+def test_retries_are_bounded(noDelay, tmp_path):
+    failure = neo4j.exceptions.ServiceUnavailable("connection lost")
+    driver, attempts = get_flaky_driver([[failure]] * 3)
+    parsedResult, status, attemptCount, error = noDelay.fetch_result_with_retries(driver, dict(cypherYaml, Retries=1), str(tmp_path / "result.csv"))
+    assert (parsedResult, status, attemptCount) == (False, 'error', 2)
+    assert "connection lost" in error
+
+
+def test_query_errors_are_not_retried(noDelay, tmp_path):
+    driver, attempts = get_flaky_driver([[ValueError("syntax error")], []])
+    parsedResult, status, attemptCount, error = noDelay.fetch_result_with_retries(driver, cypherYaml, str(tmp_path / "result.csv"))
+    assert (parsedResult, status) == (False, 'error')
+    assert len(attempts) == 1
+
+
+def test_slow_stream_times_out(noDelay, tmp_path):
+    # The deadline is checked on each record, not only every thousand records
+    def answer(CypherQuery):
+        for userIndex in range(100):
+            time.sleep(0.01)
+            yield {'User': "USER%s" % userIndex}
+    outputFileName = str(tmp_path / "result.csv")
+    startTime = time.perf_counter()
+    parsedResult, queryProfile = noDelay.profile_result(StubDriver(answer), dict(cypherYaml, Timeout=0.1), outputFileName)
+    assert parsedResult is False
+    assert queryProfile['status'] == 'timeout'
+    assert time.perf_counter() - startTime < 0.5
+    assert not os.path.exists(outputFileName)
+
+
+def test_run_deadline_skips_queries(noDelay, monkeypatch):
+    monkeypatch.setattr(noDelay, 'runDeadline', time.perf_counter() - 1)
+    driver, attempts = get_flaky_driver([["USER1"]])
+    parsedResult, status, attemptCount, error = noDelay.fetch_result_with_retries(driver, cypherYaml)
+    assert (parsedResult, status, attemptCount) == (False, 'skipped', 0)
+    assert attempts == []